@@ -1,14 +1,212 @@
 #!/usr/bin/env python3
-import connexion
+import os
+import sys
+import time
+import signal
+import socket
 import logging
-from flask_cors import CORS
 
 
+# WRS_WORKERS > 1 runs a pre-fork server: this (master) process binds the port and forks the
+# workers, which share the listening socket. Workers import the service after fork, so each
+# creates its own etcd/SQLite and AMS clients and keeps its own caches, kept coherent by its own
+# registry watch. The master only uses the standard library.
+#   SIGHUP          graceful reload, new workers (with the code on disk) replace the old ones,
+#                   which stop accepting and finish their requests within WRS_GRACEFUL_TIMEOUT
+#   SIGTERM/SIGINT  graceful shutdown
+# Workers that die are replaced. With PROMETHEUS_MULTIPROC_DIR set, /metrics adds up the
+# metrics of all workers.
+# Each worker (or the only process) is monkey-patched by gevent before it imports the service, so
+# blocking calls (sockets, sleeps, locks, threads, etcd calls) of any request yield to the other requests
+
+HOST = os.environ.get('WRS_HOST', '0.0.0.0')
+PORT = int(os.environ.get('WRS_PORT', 12015))
+WORKERS = int(os.environ.get('WRS_WORKERS', 1))
+WORKER_CONNECTIONS = int(os.environ.get('WRS_WORKER_CONNECTIONS', 1000))  # concurrent requests per worker
+GRACEFUL_TIMEOUT = float(os.environ.get('WRS_GRACEFUL_TIMEOUT', 30))
+LISTEN_BACKLOG = int(os.environ.get('WRS_LISTEN_BACKLOG', 2048))
+
 logging.basicConfig(level=logging.INFO)
-app = connexion.App(__name__)
-app.add_api('swagger/jt-wrs.yaml', base_path='/api/jt-wrs/v0.1')
-CORS(app.app)
+
+
+def patch_for_gevent():
+    # after fork in the workers, the master does not run gevent. gRPC (the etcd client) polls its
+    # channels in its own threads, init_gevent makes it yield to the hub instead, it must run
+    # before the first channel is created (on the first etcd call)
+    from gevent import monkey
+    monkey.patch_all()
+
+    import grpc.experimental.gevent
+    grpc.experimental.gevent.init_gevent()
+
+
+def create_app():
+    import connexion
+    from flask_cors import CORS
+    from jt_wrs import metrics, tracing
+
+    app = connexion.App(__name__)
+    app.add_api('swagger/jt-wrs.yaml', base_path='/api/jt-wrs/v0.1')
+    CORS(app.app)
+    metrics.init_app(app.app)
+    tracing.init_app(app.app)
+
+    return app
+
+
+def start_migrations():
+    from jt_wrs import migrations
+
+    # ie, WRS_BACKGROUND_MIGRATIONS=migrate_workflow_records
+    migrations.start_background(os.environ.get('WRS_BACKGROUND_MIGRATIONS'))
+
+
+def _run_worker(listener, run_migrations):
+    import gevent
+    from gevent import socket as gevent_socket
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    patch_for_gevent()
+    app = create_app()
+    if run_migrations:
+        start_migrations()
+
+    # non-blocking, workers woken for the same connection must not block in accept
+    listener = gevent_socket.socket(listener.family, listener.type, fileno=listener.detach())
+    server = WSGIServer(listener, app.app, spawn=Pool(WORKER_CONNECTIONS))
+
+    # stop accepting, serve_forever then waits for the requests being handled
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        gevent.signal_handler(signum, server.close)
+
+    server.serve_forever(stop_timeout=GRACEFUL_TIMEOUT)
+
+
+class Master(object):
+    def __init__(self, host, port, workers):
+        self.address = (host, port)
+        self.workers = workers
+        self.listener = None
+        self.children = {}  # pid -> generation of the worker
+        self.generation = 0
+        self.started_migrations = False
+        self._reload = False
+        self._stop = False
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._reload = True
+        elif signum in (signal.SIGTERM, signal.SIGINT):
+            self._stop = True
+
+    def _spawn(self):
+        run_migrations = not self.started_migrations
+        self.started_migrations = True
+
+        pid = os.fork()
+        if pid:
+            self.children[pid] = self.generation
+            return
+
+        # worker
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+
+        code = 0
+        try:
+            _run_worker(self.listener, run_migrations)
+        except BaseException as err:
+            print('Error: worker %s failed: %s' % (os.getpid(), str(err)))
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if not pid:
+                return
+
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and not self._stop:
+                print('Worker %s exited with status %s, replacing it' % (pid, status))
+
+    def _signal_children(self, signum, generations=None):
+        for pid, generation in list(self.children.items()):
+            if generations is None or generation in generations:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def _clear_multiprocess_metrics(self):
+        # metrics of workers from an earlier run would be added to this run's
+        path = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+        if path and os.path.isdir(path):
+            for name in os.listdir(path):
+                if name.endswith('.db'):
+                    os.remove(os.path.join(path, name))
+
+    def run(self):
+        self._clear_multiprocess_metrics()
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen(LISTEN_BACKLOG)
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+
+        print('Serving on %s:%s with %s workers, master pid %s' % (self.address + (self.workers, os.getpid())))
+
+        while not self._stop:
+            self._reap()
+
+            if self._reload:
+                self._reload = False
+                self.generation += 1
+                print('Reloading, replacing %s workers' % len(self.children))
+                old_generations = set(range(self.generation))
+                for _ in range(self.workers):
+                    self._spawn()
+                self._signal_children(signal.SIGTERM, old_generations)
+
+            # replace dead workers, at most once a second each
+            current = sum(1 for generation in self.children.values() if generation == self.generation)
+            for _ in range(self.workers - current):
+                self._spawn()
+
+            time.sleep(1)
+
+        print('Shutting down %s workers' % len(self.children))
+        self._signal_children(signal.SIGTERM)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        self._signal_children(signal.SIGKILL)
+        for pid in list(self.children):
+            os.waitpid(pid, 0)
+
+        self.listener.close()
+        return 0
+
 
 if __name__ == '__main__':
+    if WORKERS > 1:
+        sys.exit(Master(HOST, PORT, WORKERS).run())
+
+    patch_for_gevent()
+    app = create_app()
+    start_migrations()
+
     # run our standalone gevent server
-    app.run(port=12015, server='gevent')
+    app.run(host=HOST, port=PORT, server='gevent')
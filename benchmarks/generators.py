@@ -0,0 +1,131 @@
+import json
+import yaml
+import base64
+from collections import namedtuple
+
+
+# synthetic JTracker workflows, job JSONs and etcd key sets for the benchmarks
+
+KeyValue = namedtuple('KeyValue', ['key', 'value', 'mod_revision'])
+
+
+def workflow_dict(tasks=10, scatter_tasks=0, scatter_sub_tasks=2, list_inputs=0, chain=False):
+    # tasks plain tasks and scatter_tasks scatter tasks (each with scatter_sub_tasks sub tasks, over
+    # the job's 'samples'). With chain every plain task takes the output of the one before, which
+    # gives a dependency chain as deep as there are tasks. list_inputs adds a list input of that
+    # many items to every plain task
+    workflow_tasks = {}
+
+    for i in range(tasks):
+        task_input = {
+            'ref': 'ref',
+            'conf': 'conf.level'
+        }
+        if chain and i > 0:
+            task_input['previous'] = 'out@task%s' % (i - 1)
+        if list_inputs:
+            task_input['files'] = ['out@task%s' % (i - 1) if chain and i > 0 and j == 0 else 'ref'
+                                   for j in range(list_inputs)]
+
+        workflow_tasks['task%s' % i] = {
+            'tool': 'tool%s' % (i % 5),
+            'input': task_input
+        }
+
+    for i in range(scatter_tasks):
+        sub_tasks = {}
+        for j in range(scatter_sub_tasks):
+            sub_input = {
+                'reads': 'sample.file',
+                'sample': 'sample',
+                'ref': 'ref'
+            }
+            if j > 0:
+                sub_input['previous'] = 'out@scatter%s_task%s' % (i, j - 1)
+            elif tasks:
+                sub_input['prepared'] = 'out@task%s' % (tasks - 1)
+
+            sub_tasks['scatter%s_task%s' % (i, j)] = {
+                'tool': 'tool%s' % (j % 5),
+                'input': sub_input
+            }
+
+        workflow_tasks['scatter%s' % i] = {
+            'scatter': {
+                'input': {
+                    'sample': {
+                        'with_items': 'samples',
+                        'task_suffix': 'sample.id'
+                    }
+                }
+            },
+            'tasks': sub_tasks
+        }
+
+    return {
+        'workflow': {
+            'name': 'benchmark-workflow',
+            'version': '0.1.0',
+            'runtime': {
+                'docker': 'ubuntu:18.04'
+            },
+            'input': {
+                'samples': {'type': 'array'},
+                'ref': {'type': 'string', 'default': '[ref]genome.fa'},
+                'conf': {'type': 'object'},
+                'extra': {'type': 'array', 'default': ['[data]a.txt', 'b.txt']}
+            },
+            'tasks': workflow_tasks
+        },
+        'tools': dict(('tool%s' % i, {'command': 'tool%s.py' % i}) for i in range(5))
+    }
+
+
+def workflow_yaml(**kwargs):
+    return yaml.safe_dump(workflow_dict(**kwargs), default_flow_style=False)
+
+
+def job_json(scatter_width=10):
+    return {
+        'samples': [{'id': 'sample-%s' % i, 'file': 'sample-%s.bam' % i} for i in range(scatter_width)],
+        'conf': {'level': 3}
+    }
+
+
+def workflow_keyset(workflow_id='00000000-0000-0000-0000-000000000000', versions=10, root='/jt:wrs'):
+    # etcd keys of a workflow with that many versions in the per attribute key layout, as written by
+    # register_workflow, with values (file bodies left empty as they are not read when decoding)
+    prefix = '%s/workflow/id:%s/' % (root, workflow_id)
+
+    kvs = []
+    revision = 1
+    for k, v in [('workflow_type', 'JTracker'), ('git_account', 'jtracker-io'), ('git_repo', 'demo-workflows'),
+                 ('name', 'benchmark-workflow'), ('owner.id', '11111111-1111-1111-1111-111111111111')]:
+        kvs.append(KeyValue((prefix + k).encode('utf-8'), v.encode('utf-8'), revision))
+
+    for i in range(versions):
+        revision += 1
+        version = '0.%s.0' % i
+        for k, v in [('git_path', 'benchmark-workflow'), ('git_tag', 'benchmark-workflow.%s' % version),
+                     ('workflowfile', ''), ('workflow_package', '')]:
+            kvs.append(KeyValue(('%sver:%s/%s' % (prefix, version, k)).encode('utf-8'), v.encode('utf-8'), revision))
+
+    return prefix, sorted(kvs, key=lambda kv: kv.key)
+
+
+def load_keyset(path):
+    # key set recorded with: etcdctl get --prefix /jt:wrs/workflow/id:<workflow_id>/ -w json > keyset.json
+    with open(path) as f:
+        response = json.load(f)
+
+    kvs = [KeyValue(base64.b64decode(kv['key']), base64.b64decode(kv.get('value', '')), int(kv.get('mod_revision', 0)))
+           for kv in response.get('kvs', [])]
+    if not kvs:
+        raise ValueError('No keys in recorded key set: %s' % path)
+
+    # the workflow prefix is everything up to and including the workflow id
+    parts = kvs[0].key.decode('utf-8').split('/')
+    id_index = [i for i, p in enumerate(parts) if p.startswith('id:')][0]
+    prefix = '/'.join(parts[:id_index + 1]) + '/'
+
+    return prefix, sorted(kvs, key=lambda kv: kv.key)
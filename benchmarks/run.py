@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import generators
+from jt_wrs import records, wrs
+from jt_wrs.jtracker.job import Job
+from jt_wrs.jtracker.workflow import Workflow
+
+
+# micro-benchmarks of workflow parsing, job plan expansion and decoding of workflows read from etcd.
+#
+#   python benchmarks/run.py                          # run all, save to benchmarks/results/<commit>.json
+#   python benchmarks/run.py -k job_plan --max-scatter-width 10000
+#   python benchmarks/run.py --compare benchmarks/results/<older commit>.json
+#   python benchmarks/run.py --keyset keyset.json    # also decode a recorded key set, see generators.load_keyset
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+SCATTER_WIDTHS = (10, 100, 1000, 10000, 100000)
+
+
+def _workflow_init_cases():
+    for name, kwargs in [
+        ('tasks=10', dict(tasks=10)),
+        ('tasks=100', dict(tasks=100)),
+        ('tasks=1000', dict(tasks=1000)),
+        ('tasks=50,scatters=10', dict(tasks=50, scatter_tasks=10, scatter_sub_tasks=5)),
+        ('tasks=500,chain', dict(tasks=500, chain=True)),
+        ('tasks=100,list_inputs=50', dict(tasks=100, list_inputs=50))
+    ]:
+        workflow_yaml = generators.workflow_yaml(**kwargs)
+        yield 'workflow_init[%s]' % name, lambda workflow_yaml=workflow_yaml: Workflow(workflow_yaml_string=workflow_yaml)
+
+
+def _plan(workflow, job_json):
+    return Job(workflow, dict(job_json)).job_with_task_execution_plan
+
+
+def _compact_plan(workflow, job_json):
+    return Job(workflow, dict(job_json)).job_with_compact_task_execution_plan
+
+
+def _job_plan_cases(max_scatter_width):
+    workflow = Workflow(workflow_yaml_string=generators.workflow_yaml(tasks=5, scatter_tasks=2, scatter_sub_tasks=3))
+    for width in SCATTER_WIDTHS:
+        if width <= max_scatter_width:
+            job_json = generators.job_json(scatter_width=width)
+            yield 'job_plan[scatter_width=%s]' % width, lambda job_json=job_json: _plan(workflow, job_json)
+            yield 'job_plan_compact[scatter_width=%s]' % width, \
+                lambda job_json=job_json: _compact_plan(workflow, job_json)
+
+    for name, kwargs in [
+        ('tasks=500,chain', dict(tasks=500, chain=True)),
+        ('tasks=100,list_inputs=50', dict(tasks=100, list_inputs=50))
+    ]:
+        chain_workflow = Workflow(workflow_yaml_string=generators.workflow_yaml(**kwargs))
+        job_json = generators.job_json(scatter_width=10)
+        yield 'job_plan[%s]' % name, lambda w=chain_workflow, job_json=job_json: _plan(w, job_json)
+
+
+def _record_kvs(workflow_id, prefix, kvs):
+    # the same workflow in the records layout
+    workflow, revisions = wrs._decode_key_layout(workflow_id, prefix, kvs)
+    header, versions = records.split_workflow(workflow)
+
+    record_prefix = wrs._record_prefix(workflow_id).encode('utf-8')
+    record_kvs = [generators.KeyValue(record_prefix + records.HEADER_RECORD,
+                                      records.encode_header(header).encode('utf-8'), 1)]
+    for i, (version, (attributes, files)) in enumerate(versions.items()):
+        record_kvs.append(generators.KeyValue(record_prefix + ('ver:%s' % version).encode('utf-8'),
+                                              records.encode_version(attributes, files).encode('utf-8'), i + 2))
+    return record_kvs
+
+
+def _decode_cases(keyset):
+    keysets = [('versions=%s' % n, generators.workflow_keyset(versions=n)) for n in (1, 10, 100, 1000)]
+    if keyset:
+        keysets.append(('recorded', generators.load_keyset(keyset)))
+
+    for name, (prefix, kvs) in keysets:
+        workflow_id = prefix.rstrip('/').rsplit('id:', 1)[-1]
+        yield 'decode_keys[%s]' % name, \
+            lambda workflow_id=workflow_id, prefix=prefix, kvs=kvs: wrs._decode_key_layout(workflow_id, prefix, kvs)
+
+        record_kvs = _record_kvs(workflow_id, prefix, kvs)
+        yield 'decode_records[%s]' % name, \
+            lambda workflow_id=workflow_id, record_kvs=record_kvs: records.decode(workflow_id, record_kvs)
+
+
+def cases(max_scatter_width=max(SCATTER_WIDTHS), keyset=None):
+    yield from _workflow_init_cases()
+    yield from _job_plan_cases(max_scatter_width)
+    yield from _decode_cases(keyset)
+
+
+def measure(fn, repeat=5, min_time=0.05):
+    # seconds per call (best and median of repeat runs, each long enough to be timed reliably)
+    # and peak memory allocated during one call
+    fn()  # warm up
+
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2
+
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - start) / loops)
+    timings.sort()
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds_min': timings[0],
+        'seconds_median': timings[len(timings) // 2],
+        'loops': loops,
+        'peak_bytes': peak
+    }
+
+
+def _commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(RESULTS_DIR)).decode('utf-8').strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD', '--', 'jt_wrs'], stderr=subprocess.DEVNULL,
+                                cwd=os.path.dirname(os.path.dirname(RESULTS_DIR)))
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return '%.1f %s' % (n, unit)
+        n /= 1024.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='JT-WRS micro-benchmarks')
+    parser.add_argument('-k', '--filter', help='only run benchmarks with this in their name')
+    parser.add_argument('--max-scatter-width', type=int, default=max(SCATTER_WIDTHS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keyset', help='recorded etcd key set to decode, etcdctl get --prefix -w json output')
+    parser.add_argument('--output', help='where to save the results, default: benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', help='results saved earlier to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='exit with error if any benchmark is this many times slower than in --compare')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f).get('results', {})
+
+    results = {}
+    regressions = []
+    for name, fn in cases(args.max_scatter_width, args.keyset):
+        if args.filter and args.filter not in name:
+            continue
+
+        result = results[name] = measure(fn, repeat=args.repeat)
+        line = '%-45s %12.6f s %12s' % (name, result['seconds_min'], _format_bytes(result['peak_bytes']))
+
+        if name in baseline:
+            ratio = result['seconds_min'] / baseline[name]['seconds_min']
+            line += '   x%.2f time, x%.2f memory' % (ratio,
+                                                      result['peak_bytes'] / max(baseline[name]['peak_bytes'], 1))
+            if ratio > args.threshold:
+                regressions.append(name)
+
+        print(line)
+        sys.stdout.flush()
+
+    commit = _commit()
+    output = args.output or os.path.join(RESULTS_DIR, '%s.json' % commit)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'created': int(time.time()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results
+        }, f, indent=2, sort_keys=True)
+    print('Results saved to %s' % output)
+
+    if regressions:
+        print('Slower than %s by more than x%s: %s' % (args.compare, args.threshold, ', '.join(regressions)))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
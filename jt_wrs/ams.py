@@ -0,0 +1,140 @@
+import json
+import threading
+import requests
+from gevent.pool import Pool
+from requests.adapters import HTTPAdapter
+from . import metrics
+from .cache import LRUCache, SingleFlight
+from .exceptions import OwnerNameNotFound, OwnerIDNotFound, AMSNotAvailable
+
+
+_NOT_FOUND = object()  # marker for negatively cached lookups
+
+
+class OwnerResolver(object):
+    # resolves owner name <-> owner id against AMS, with one pooled HTTP session,
+    # a bidirectional TTL cache, negative caching of unknown owners and
+    # de-duplication of concurrent lookups for the same owner
+    def __init__(self, ams_url, timeout=5, ttl=300, negative_ttl=30, maxsize=4096, pool_size=20):
+        self._ams_url = ams_url.strip('/')
+        self._timeout = timeout
+        self._negative_ttl = negative_ttl
+        self._pool_size = pool_size
+
+        self._name_to_id = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._id_to_name = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._inflight = SingleFlight()
+
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+
+        return self._session
+
+    def get_id_by_name(self, owner_name):
+        owner_id = self._name_to_id.get(owner_name)
+        if owner_id is _NOT_FOUND:
+            raise OwnerNameNotFound(owner_name)
+        elif owner_id is not None:
+            return owner_id
+
+        return self._inflight.do(('name', owner_name), self._fetch_id_by_name, owner_name)
+
+    def get_name_by_id(self, owner_id):
+        owner_name = self._id_to_name.get(owner_id)
+        if owner_name is _NOT_FOUND:
+            raise OwnerIDNotFound(owner_id)
+        elif owner_name is not None:
+            return owner_name
+
+        return self._inflight.do(('id', owner_id), self._fetch_name_by_id, owner_id)
+
+    def get_ids_by_names(self, owner_names):
+        # owner name -> owner id, or the exception looking it up raised, for many owners.
+        # Owners not cached are looked up concurrently
+        return self._get_many(owner_names, self._name_to_id, OwnerNameNotFound, self.get_id_by_name)
+
+    def get_names_by_ids(self, owner_ids):
+        return self._get_many(owner_ids, self._id_to_name, OwnerIDNotFound, self.get_name_by_id)
+
+    def _get_many(self, keys, cache, not_found, get):
+        def lookup(key):
+            try:
+                return get(key)
+            except Exception as err:
+                return err
+
+        results = {}
+        missing = []
+        for key in set(keys):
+            value = cache.get(key)
+            if value is _NOT_FOUND:
+                results[key] = not_found(key)
+            elif value is not None:
+                results[key] = value
+            else:
+                missing.append(key)
+
+        if len(missing) == 1:
+            results[missing[0]] = lookup(missing[0])
+        elif missing:
+            # greenlets, concurrent as the sockets of requests are monkey patched (see app.py)
+            results.update(zip(missing, Pool(min(len(missing), self._pool_size)).map(lookup, missing)))
+
+        return results
+
+    def stats(self):
+        return {
+            'name_to_id': self._name_to_id.stats(),
+            'id_to_name': self._id_to_name.stats()
+        }
+
+    def _fetch_id_by_name(self, owner_name):
+        with metrics.ams_call('account_by_name'):
+            account = self._get_account('%s/accounts/%s' % (self._ams_url, owner_name))
+        if account is None:
+            self._name_to_id.put(owner_name, _NOT_FOUND, ttl=self._negative_ttl)
+            raise OwnerNameNotFound(owner_name)
+
+        self._remember(account)
+        return account.get('id')
+
+    def _fetch_name_by_id(self, owner_id):
+        with metrics.ams_call('account_by_id'):
+            account = self._get_account('%s/accounts/_id/%s' % (self._ams_url, owner_id))
+        if account is None:
+            self._id_to_name.put(owner_id, _NOT_FOUND, ttl=self._negative_ttl)
+            raise OwnerIDNotFound(owner_id)
+
+        self._remember(account)
+        return account.get('name')
+
+    def _remember(self, account):
+        owner_id, owner_name = account.get('id'), account.get('name')
+        if owner_id and owner_name:
+            self._name_to_id.put(owner_name, owner_id)
+            self._id_to_name.put(owner_id, owner_name)
+
+    def _get_account(self, request_url):
+        # returns the account, or None when AMS says it does not exist
+        try:
+            r = self.session.get(request_url, timeout=self._timeout)
+        except:
+            raise AMSNotAvailable('AMS service temporarily unavailable')
+
+        if r.status_code >= 500:
+            raise AMSNotAvailable('AMS service temporarily unavailable')
+        elif r.status_code != 200:
+            return
+
+        return json.loads(r.text)
@@ -0,0 +1,273 @@
+import os
+import json
+from urllib.parse import urlencode
+from flask import Response, request
+from . import wrs
+from .exceptions import OwnerNameNotFound, AMSNotAvailable, RegistrationQueueFull, InvalidCursor, \
+    InvalidTaskDependency, InvalidLookup, InvalidJobJSON
+
+# registered versions never change, so version pinned resources can be cached for long
+IMMUTABLE_MAX_AGE = int(os.environ.get('WRS_IMMUTABLE_MAX_AGE', 365 * 24 * 3600))
+
+
+def _cache_headers(etag, immutable=False):
+    return {
+        'ETag': '"%s"' % etag,
+        'Cache-Control': 'public, max-age=%s, immutable' % IMMUTABLE_MAX_AGE if immutable else 'no-cache'
+    }
+
+
+def _not_modified(etag):
+    return request.if_none_match.contains_weak(etag)
+
+
+def _next_page_link(cursor):
+    args = request.args.to_dict(flat=False)
+    args['cursor'] = [cursor]
+    return '<%s?%s>; rel="next"' % (request.base_url, urlencode(args, doseq=True))
+
+
+def get_health():
+    health = wrs.get_health()
+    return health, 200 if health['healthy'] else 503
+
+
+def get_all_workflows(limit=None, cursor=None, fields=None, versions='all'):
+    return get_workflows(None, limit=limit, cursor=cursor, fields=fields, versions=versions)
+
+
+def get_workflows(owner_name=None, limit=None, cursor=None, fields=None, versions='all'):
+    try:
+        workflows, next_cursor = wrs.list_workflows(owner_name, limit=limit, cursor=cursor,
+                                                    fields=fields, versions=versions)
+    except OwnerNameNotFound as err:
+        return str(err), 404
+    except AMSNotAvailable as err:
+        return str(err), 500
+    except InvalidCursor as err:
+        return str(err), 400
+
+    # a page can be empty before the end, when none of its workflows could be decoded
+    if not workflows and not cursor and not next_cursor:
+        return 'No workflow found', 404
+
+    headers = {}
+    if next_cursor:
+        headers['Link'] = _next_page_link(next_cursor)
+        headers['X-Next-Cursor'] = next_cursor
+
+    return workflows, 200, headers
+
+
+def get_workflow_by_id_and_version(workflow_id, workflow_version=None):
+    etag = wrs.get_workflow_etag_by_id(workflow_id, workflow_version)
+    if not etag:
+        return 'No workflow found', 404
+
+    headers = _cache_headers(etag, immutable=bool(workflow_version))
+    if _not_modified(etag):
+        return '', 304, headers
+
+    workflow = wrs.get_workflow_by_id_and_version(workflow_id, workflow_version)
+    return (workflow, 200, headers) if workflow else ('No workflow found', 404)
+
+
+def lookup_workflows(workflows):
+    try:
+        return {'workflows': wrs.lookup_workflows(workflows)}
+    except InvalidLookup as err:
+        return str(err), 400
+
+
+def get_workflow_by_id(workflow_id):
+    return get_workflow_by_id_and_version(workflow_id) or ('No workflow found', 404)
+
+
+def get_workflow(owner_name, workflow_name):
+    return get_workflow_ver(owner_name, workflow_name, None)
+
+
+def get_workflow_ver(owner_name, workflow_name, workflow_version):
+    try:
+        etag = wrs.get_workflow_etag(owner_name, workflow_name, workflow_version)
+        if not etag:
+            return 'No workflow found', 404
+
+        headers = _cache_headers(etag, immutable=bool(workflow_version))
+        if _not_modified(etag):
+            return '', 304, headers
+
+        workflow = wrs.get_workflow(owner_name, workflow_name, workflow_version)
+    except OwnerNameNotFound as err:
+        return str(err), 404
+    except AMSNotAvailable as err:
+        return str(err), 500
+
+    return (workflow, 200, headers) if workflow else ('No workflow found', 404)
+
+
+def register_workflow(owner_name, workflow_entry=None):
+    try:
+        registration = wrs.submit_registration(owner_name, workflow_entry)
+    except OwnerNameNotFound as err:
+        return str(err), 404
+    except AMSNotAvailable as err:
+        return str(err), 500
+    except RegistrationQueueFull as err:
+        return str(err), 503
+    except Exception as err:
+        return 'Failed registering workflow: %s' % str(err), 400
+
+    return registration.to_dict(), 202, {'Location': '%s/registrations/%s' % (request.path.rstrip('/'),
+                                                                               registration.id)}
+
+
+def get_registration(owner_name, registration_id, wait=0):
+    registration = wrs.get_registration(registration_id, wait=min(wait, 60))
+    if not registration or registration.owner_name != owner_name:
+        return 'No registration found', 404
+
+    return registration.to_dict()
+
+
+def delete_workflow(owner_name, workflow_name, worklow_version=None):
+    pass
+
+
+def delete_workflow1(owner_name, workflow_name):
+    delete_workflow(owner_name, workflow_name)
+
+
+def release_workflow(owner_name, workflow_name, workflow_version):
+    pass
+
+
+def get_job_json_template(owner_name, workflow_name, workflow_version):
+    try:
+        etag = wrs.get_workflow_etag(owner_name, workflow_name, workflow_version, resource='job_json_template')
+        if not etag:
+            return 'No workflow found', 404
+
+        headers = _cache_headers(etag, immutable=True)
+        if _not_modified(etag):
+            return '', 304, headers
+
+        template = wrs.get_jobjson_template(owner_name, workflow_name, workflow_version)
+        return (template, 200, headers) if template is not None else ('No workflow found', 404)
+    except OwnerNameNotFound as err:
+        return str(err), 404
+    except AMSNotAvailable as err:
+        return str(err), 500
+    except NotImplementedError as err:
+        return str(err), 501
+
+
+def get_execution_plan(owner_name, workflow_name, workflow_version, job_json, stream=False, graph=False,
+                       expand=True):
+    if graph and (stream or not expand):
+        return 'Task graph is only available for expanded plans not streamed', 400
+
+    try:
+        if stream:
+            plan = wrs.iter_execution_plan(owner_name, workflow_name, workflow_version, job_json, expand=expand)
+            if plan is None:
+                return 'JobJSON invalid', 400
+            return Response(_ndjson(plan), mimetype='application/x-ndjson')
+
+        return wrs.get_execution_plan(owner_name, workflow_name, workflow_version, job_json, graph=graph,
+                                      expand=expand) \
+               or ('JobJSON invalid', 400)
+    except (InvalidJobJSON, InvalidTaskDependency) as err:
+        return str(err), 400
+    except NotImplementedError as err:
+        return str(err), 501
+
+
+def _ndjson_body():
+    # one JSON document per line, blank lines skipped. Raises ValueError
+    return [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+
+
+def get_execution_plans(owner_name, workflow_name, workflow_version, job_jsons=None, graph=False, expand=True):
+    if job_jsons is None and request.mimetype == 'application/x-ndjson':
+        try:
+            job_jsons = _ndjson_body()
+        except ValueError as err:
+            return 'Invalid NDJSON: %s' % str(err), 400
+
+    if not job_jsons:
+        return 'No JobJSON supplied', 400
+
+    if graph and not expand:
+        return 'Task graph is only available for expanded plans', 400
+
+    try:
+        return wrs.get_execution_plans(owner_name, workflow_name, workflow_version, job_jsons, graph=graph,
+                                       expand=expand) \
+               or ('No workflow found', 404)
+    except OwnerNameNotFound as err:
+        return str(err), 404
+    except AMSNotAvailable as err:
+        return str(err), 500
+    except NotImplementedError as err:
+        return str(err), 501
+
+
+def validate_job_jsons(owner_name, workflow_name, workflow_version, job_jsons=None):
+    if job_jsons is None and request.mimetype == 'application/x-ndjson':
+        try:
+            job_jsons = _ndjson_body()
+        except ValueError as err:
+            return 'Invalid NDJSON: %s' % str(err), 400
+
+    if not job_jsons:
+        return 'No JobJSON supplied', 400
+
+    try:
+        results = wrs.validate_job_jsons(owner_name, workflow_name, workflow_version, job_jsons)
+        return results if results is not None else ('No workflow found', 404)
+    except OwnerNameNotFound as err:
+        return str(err), 404
+    except AMSNotAvailable as err:
+        return str(err), 500
+    except NotImplementedError as err:
+        return str(err), 501
+
+
+def _ndjson(parts):
+    # response status is already sent once streaming starts, errors go into the last line
+    try:
+        for part in parts:
+            yield json.dumps(part) + '\n'
+    except Exception as err:
+        yield json.dumps({'_error': 'Failed generating execution plan: %s' % str(err)}) + '\n'
+
+
+def download_workflowfile(owner_name, workflow_name, workflow_version):
+    etag = wrs.get_workflow_etag(owner_name, workflow_name, workflow_version, resource='workflowfile')
+    if not etag:
+        return 'No workflowfile found', 404
+
+    headers = _cache_headers(etag, immutable=True)
+    if _not_modified(etag):
+        return '', 304, headers
+
+    workflowfile = wrs.get_workflowfile(owner_name, workflow_name, workflow_version)
+    return (workflowfile, 200, headers) if workflowfile else ('No workflowfile found', 404)
+
+def download_workflow_package(owner_name, workflow_name, workflow_version):
+    etag = wrs.get_workflow_etag(owner_name, workflow_name, workflow_version, resource='workflow_package')
+    if not etag:
+        return 'No workflow package found', 404
+
+    headers = _cache_headers(etag, immutable=True)
+    if _not_modified(etag):
+        return '', 304, headers
+
+    workflow_package = wrs.get_workflow_package(owner_name, workflow_name, workflow_version)
+    if not workflow_package:
+        return 'No workflow package found', 404
+
+    headers['Content-Disposition'] = 'attachment; filename=%s.%s.tar.gz' % (workflow_name, workflow_version)
+    return Response(workflow_package, mimetype='application/gzip', headers=headers)
+
@@ -0,0 +1,103 @@
+import zipfile
+import tempfile
+import posixpath
+import requests
+from .exceptions import WorkflowArchiveTooLarge, WorkflowArchiveNotAvailable
+
+
+class WorkflowArchive(object):
+    # git archive streamed into a spooled temp file (in memory while small, on disk
+    # after that), only members under workflow_dir are read. Use as context manager,
+    # the temp file is always removed on exit
+    def __init__(self, url, workflow_dir, max_bytes=100 * 1024 * 1024, spool_bytes=8 * 1024 * 1024,
+                 timeout=30):
+        self._url = url
+        self._workflow_dir = '/'.join(p.strip('/') for p in workflow_dir.split('/') if p.strip('/')) + '/'
+        self._max_bytes = max_bytes
+        self._spool_bytes = spool_bytes
+        self._timeout = timeout
+        self._file = None
+        self._zfile = None
+        self._members = None
+
+    def __enter__(self):
+        try:
+            self._download()
+            self._zfile = zipfile.ZipFile(self._file)
+        except zipfile.BadZipfile:
+            self.close()
+            raise WorkflowArchiveNotAvailable(self._url)
+        except:
+            self.close()
+            raise
+
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._zfile is not None:
+            self._zfile.close()
+            self._zfile = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _download(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=self._spool_bytes)
+
+        try:
+            r = requests.get(self._url, stream=True, timeout=self._timeout)
+        except requests.RequestException:
+            raise WorkflowArchiveNotAvailable(self._url)
+
+        try:
+            if r.status_code != 200:
+                raise WorkflowArchiveNotAvailable(self._url)
+
+            if int(r.headers.get('Content-Length') or 0) > self._max_bytes:
+                raise WorkflowArchiveTooLarge(self._max_bytes)
+
+            size = 0
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > self._max_bytes:
+                    raise WorkflowArchiveTooLarge(self._max_bytes)
+                self._file.write(chunk)
+        finally:
+            r.close()
+
+        self._file.seek(0)
+
+    @property
+    def members(self):
+        # path relative to workflow_dir -> ZipInfo, for the files under workflow_dir
+        if self._members is None:
+            members = {}
+            total_size = 0
+            for info in self._zfile.infolist():
+                if not info.filename.startswith(self._workflow_dir) or info.filename.endswith('/'):
+                    continue
+
+                path = posixpath.normpath(info.filename[len(self._workflow_dir):])
+                if path.startswith('..'):
+                    continue  # refuse anything pointing outside of workflow_dir
+
+                total_size += info.file_size
+                if total_size > self._max_bytes:  # guard against decompression bombs
+                    raise WorkflowArchiveTooLarge(self._max_bytes)
+
+                members[path] = info
+
+            self._members = members
+
+        return self._members
+
+    def read(self, path):
+        info = self.members.get(path)
+        if info is not None:
+            return self._zfile.read(info)
+
+    def open(self, path):
+        return self._zfile.open(self.members[path])
@@ -0,0 +1,156 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from gevent.event import Event
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024, ttl=None, maxweight=None, getsizeof=None):
+        self._maxsize = maxsize
+        self._ttl = ttl  # seconds, None means entries never expire
+        self._maxweight = maxweight  # total weight (eg, bytes) of entries, None means unbounded
+        self._getsizeof = getsizeof or (lambda value: 1)
+        self._data = OrderedDict()  # key -> (value, expires at, weight)
+        self._weight = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        if self._maxsize <= 0:
+            return
+
+        ttl = ttl if ttl is not None else self._ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        weight = self._getsizeof(value) if self._maxweight is not None else 0
+
+        if self._maxweight is not None and weight > self._maxweight:
+            return  # would evict everything else and still not fit
+
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, expires_at, weight)
+            self._weight += weight
+
+            while len(self._data) > self._maxsize or \
+                    (self._maxweight is not None and self._weight > self._maxweight):
+                _, (_, _, evicted_weight) = self._data.popitem(last=False)
+                self._weight -= evicted_weight
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._weight -= entry[2]
+            return entry[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self._maxsize,
+            'weight': self._weight,
+            'maxweight': self._maxweight,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+        }
+
+
+def deep_getsizeof(obj, _seen=None, sample=None):
+    # rough memory footprint of an object graph made of dicts, lists and scalars. With sample,
+    # lists and tuples longer than that are estimated from that many of their items
+    _seen = _seen if _seen is not None else set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_getsizeof(k, _seen, sample) + deep_getsizeof(v, _seen, sample) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)) and sample and len(obj) > sample:
+        items = obj[::len(obj) // sample]
+        size += sum(deep_getsizeof(i, _seen, sample) for i in items) * len(obj) // len(items)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_getsizeof(i, _seen, sample) for i in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_getsizeof(vars(obj), _seen, sample)
+
+    return size
+
+
+class _Call(object):
+    def __init__(self):
+        # gevent's, waiting yields to the leader when it is a greenlet of the same thread
+        # (the API is served by a gevent server) and still works across threads
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    # concurrent calls for the same key share the result of one execution
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
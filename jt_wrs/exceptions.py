@@ -2,7 +2,14 @@ __all__ = [
     'OwnerIDNotFound',
     'OwnerNameNotFound',
     'AMSNotAvailable',
-    'InvalidJTWorkflowFile'
+    'InvalidJTWorkflowFile',
+    'RegistrationQueueFull',
+    'WorkflowArchiveNotAvailable',
+    'WorkflowArchiveTooLarge',
+    'InvalidCursor',
+    'InvalidTaskDependency',
+    'InvalidLookup',
+    'InvalidJobJSON'
 ]
 
 
@@ -23,3 +30,38 @@ class AMSNotAvailable(Exception):
 class InvalidJTWorkflowFile(Exception):
     def __str__(self):
         return 'Invalid JTracker Workflow File'
+
+
+class RegistrationQueueFull(Exception):
+    def __str__(self):
+        return 'Too many workflow registrations queued, please retry later'
+
+
+class WorkflowArchiveNotAvailable(Exception):
+    def __str__(self):
+        return 'Unable to download workflow archive: %s' % (self.args[0])
+
+
+class WorkflowArchiveTooLarge(Exception):
+    def __str__(self):
+        return 'Workflow archive exceeds size limit of %s bytes' % (self.args[0])
+
+
+class InvalidCursor(Exception):
+    def __str__(self):
+        return 'Invalid cursor: %s' % (self.args[0])
+
+
+class InvalidTaskDependency(Exception):
+    def __str__(self):
+        return 'Invalid task dependency: %s' % (self.args[0])
+
+
+class InvalidLookup(Exception):
+    def __str__(self):
+        return 'Invalid workflow lookup: %s' % (self.args[0])
+
+
+class InvalidJobJSON(Exception):
+    def __str__(self):
+        return 'Invalid JobJSON: %s' % (self.args[0])
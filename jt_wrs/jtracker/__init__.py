@@ -1,19 +1,37 @@
-from ..__init__ import __version__
+from .. import __version__
 from .workflow import Workflow
 from .job import Job
+from .validator import JobValidator
 
 
 class JTracker(object):
-    def __init__(self,  workflow_yaml_file=None, workflow_yaml_string=None):
-        self._workflow = Workflow(workflow_yaml_file=workflow_yaml_file, workflow_yaml_string=workflow_yaml_string)
+    def __init__(self,  workflow_yaml_file=None, workflow_yaml_string=None, timer=None):
+        # timer, see Workflow
+        self._workflow = Workflow(workflow_yaml_file=workflow_yaml_file, workflow_yaml_string=workflow_yaml_string,
+                                  timer=timer)
+        self._job_validator = JobValidator(self._workflow)
 
     @property
     def workflow(self):
         return self._workflow
 
+    @property
+    def job_json_template(self):
+        return self._job_validator.template()
+
+    def job_json_errors(self, job_json):
+        return self._job_validator.errors(job_json)
+
     def validate_job_json(self, job_json):
-        pass
+        # raises InvalidJobJSON, before any task is generated
+        self._job_validator.validate(job_json)
+
+    def get_execution_plan(self, job_json, expand=True):
+        self.validate_job_json(job_json)
+        job = Job(self.workflow, job_json)
+        return job.job_with_task_execution_plan if expand else job.job_with_compact_task_execution_plan
 
-    def get_execution_plan(self, job_json):
+    def iter_execution_plan(self, job_json, expand=True):
+        self.validate_job_json(job_json)
         job = Job(self.workflow, job_json)
-        return job.job_with_task_execution_plan
+        return job.iter_job_with_task_execution_plan(expand=expand)
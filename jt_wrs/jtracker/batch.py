@@ -0,0 +1,112 @@
+import os
+import atexit
+import pickle
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from gevent.threadpool import ThreadPool
+
+
+WORKER_WORKFLOW_CACHE_SIZE = 32
+
+# compiled workflows already unpickled in this (worker) process, keyed by (workflow id, version)
+_worker_workflows = OrderedDict()
+
+
+def expand_plans(jt, job_jsons, expand=True):
+    # plans in the order of the job JSONs, a failing job does not fail the others
+    results = []
+    for job_json in job_jsons:
+        try:
+            results.append({'job_execution_plan': jt.get_execution_plan(job_json, expand=expand)})
+        except Exception as err:
+            results.append({'error': 'Failed generating execution plan: %s' % str(err)})
+
+    return results
+
+
+def _expand_plans_in_worker(workflow_key, jt_pickle, job_jsons, expand=True):
+    jt = _worker_workflows.get(workflow_key)
+    if jt is None:
+        jt = pickle.loads(jt_pickle)
+        _worker_workflows[workflow_key] = jt
+        while len(_worker_workflows) > WORKER_WORKFLOW_CACHE_SIZE:
+            _worker_workflows.popitem(last=False)
+
+    return expand_plans(jt, job_jsons, expand=expand)
+
+
+class PlanPool(object):
+    # expands batches of job JSONs against one compiled workflow in worker processes,
+    # small batches are not worth the IPC and are expanded in the calling process.
+    # The executor is only used from one thread of its own: writing a large batch to the
+    # workers' pipe and waiting for the plans would otherwise block the gevent hub, and the
+    # executor's own (monkey-patched) threads are greenlets that only run in the thread that
+    # started them. Batches take turns there, each is already spread over all worker processes
+    def __init__(self, workers=None, inline_batch_size=8):
+        self._workers = workers or os.cpu_count() or 1
+        self._inline_batch_size = inline_batch_size
+        self._executor = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pickles = OrderedDict()  # (workflow id, version) -> pickled compiled workflow
+
+    @property
+    def thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = ThreadPool(1)
+                    # before concurrent.futures joins the executor's threads at exit
+                    getattr(threading, '_register_atexit', atexit.register)(self.shutdown)
+        return self._thread
+
+    def _pickled(self, workflow_key, jt):
+        # a registered version never changes, it is pickled once
+        with self._lock:
+            jt_pickle = self._pickles.pop(workflow_key, None)
+            if jt_pickle is None:
+                jt_pickle = pickle.dumps(jt)
+            self._pickles[workflow_key] = jt_pickle
+            while len(self._pickles) > WORKER_WORKFLOW_CACHE_SIZE:
+                self._pickles.popitem(last=False)
+        return jt_pickle
+
+    def _expand(self, workflow_key, jt_pickle, job_jsons, expand):
+        # in the executor's thread
+        if self._executor is None:
+            # spawn, forking a process with live etcd/gRPC channels is not safe
+            self._executor = ProcessPoolExecutor(max_workers=self._workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+
+        chunk_size = -(-len(job_jsons) // self._workers)  # ceiling division
+        futures = [self._executor.submit(_expand_plans_in_worker, workflow_key, jt_pickle,
+                                         job_jsons[i:i + chunk_size], expand)
+                   for i in range(0, len(job_jsons), chunk_size)]
+
+        results = []
+        for future in futures:
+            results += future.result()
+
+        return results
+
+    def expand(self, workflow_key, jt, job_jsons, expand=True):
+        if self._workers <= 1 or len(job_jsons) <= self._inline_batch_size:
+            return expand_plans(jt, job_jsons, expand=expand)
+
+        jt_pickle = self._pickled(workflow_key, jt)
+        return self.thread.spawn(self._expand, workflow_key, jt_pickle, job_jsons, expand).get()
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def shutdown(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._pickles.clear()
+        if thread is not None:
+            thread.spawn(self._shutdown).get()
+            thread.kill()
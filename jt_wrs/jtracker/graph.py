@@ -0,0 +1,73 @@
+from ..exceptions import InvalidTaskDependency
+
+
+def plan_graph(tasks):
+    # dependency graph of the tasks of an execution plan, built in time linear to the number of
+    # tasks and dependencies. Tasks are referred to by their index in tasks:
+    #   parents/children, the tasks each task depends on / that depend on it
+    #   levels, waves of tasks that can run in parallel, all parents of a task are in earlier waves
+    #   critical_path, a longest chain of dependent tasks, as long as there are levels
+    # A dependency like 'completed@align.sample_1' is on that task, one like 'completed@align' on
+    # task 'align' or, when align is in a scatter, on all its tasks ('align.<suffix>')
+    index = {}
+    scattered = {}
+    for i, task in enumerate(tasks):
+        index[task['task']] = i
+        if '.' in task['task']:
+            scattered.setdefault(task['task'].split('.', 1)[0], []).append(i)
+
+    parents = []
+    children = [[] for _ in tasks]
+    for i, task in enumerate(tasks):
+        task_parents = set()
+        for dependency in task.get('depends_on') or []:
+            parts = dependency.split('@')
+            parent = parts[1] if len(parts) > 1 else parts[0]
+
+            if parent in index:
+                task_parents.add(index[parent])
+            elif parent in scattered:
+                task_parents.update(scattered[parent])
+            else:
+                raise InvalidTaskDependency("task '%s' depends on '%s', which is not in the plan"
+                                            % (task['task'], dependency))
+
+        parents.append(sorted(task_parents))
+        for parent in parents[-1]:
+            children[parent].append(i)
+
+    # Kahn's algorithm, one wave at a time
+    pending = [len(p) for p in parents]
+    reached_from = [None] * len(tasks)  # parent in the previous level, for the critical path
+    levels = []
+    wave = [i for i, n in enumerate(pending) if not n]
+    while wave:
+        levels.append(wave)
+        next_wave = []
+        for parent in wave:
+            for child in children[parent]:
+                pending[child] -= 1
+                if not pending[child]:
+                    reached_from[child] = parent
+                    next_wave.append(child)
+        wave = next_wave
+
+    if sum(len(level) for level in levels) < len(tasks):
+        cyclic = [tasks[i]['task'] for i, n in enumerate(pending) if n][:10]
+        raise InvalidTaskDependency('dependency cycle among tasks: %s' % ', '.join(cyclic))
+
+    critical_path = []
+    if levels:
+        i = levels[-1][0]
+        while i is not None:
+            critical_path.append(i)
+            i = reached_from[i]
+        critical_path.reverse()
+
+    return {
+        'parents': parents,
+        'children': children,
+        'levels': levels,
+        'critical_path': critical_path,
+        'critical_path_length': len(critical_path)
+    }
@@ -0,0 +1,263 @@
+import re
+
+
+SUFFIX_PATTERN = re.compile('[^0-9a-zA-Z]+')
+
+# placeholders in scatter tasks of compact (unexpanded) plans, see TaskTemplate.compact_task
+TASK_SUFFIX = '${task_suffix}'
+ITEM = '${item}'
+ITEM_FIELD = '${item.%s}'
+POSITION = '${position}'
+
+# kinds of input bindings, resolved from the raw task definition once per workflow
+_CONST = 0           # value fixed at compile time, ie, '{{output@parent_task}}'
+_SCATTER_OUTPUT = 1  # output of a parent task in the same scatter: prefix + task suffix + '}}'
+_ITEM = 2            # the scatter item itself
+_ITEM_FIELD = 3      # a field of the scatter item
+_JOB_FIELD = 4       # a root level field of the job JSON
+_JOB_NESTED = 5      # a field of a root level object in the job JSON
+_LIST = 6            # list of bindings
+
+
+class TaskTemplate(object):
+    def __init__(self, workflow, task_name):
+        task = workflow.workflow_tasks[task_name]
+        tool = workflow.workflow_dict.get('tools').get(task.get('tool'))
+
+        self._name = task_name
+        self._tool = task.get('tool')
+        self._command = tool.get('command')
+        self._runtime = tool.get('runtime')
+        self._depends_on = task.get('depends_on')
+
+        call_input = task.get('input', {})
+        scatter_setting = task.get('scatter')
+        if scatter_setting:
+            self._compile_scatter(workflow, scatter_setting, call_input)
+        else:
+            self._scatter_name = None
+            self._inputs = [(i, self._compile_input(v)) for i, v in call_input.items()]
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def is_scatter(self):
+        return self._scatter_name is not None
+
+    def _compile_input(self, value):
+        if isinstance(value, list):
+            return _LIST, [self._compile_input(v) for v in value], None
+        elif '@' in value:
+            return _CONST, '{{%s}}' % value, None
+        else:
+            return _JOB_FIELD, value, None
+
+    def _compile_scatter(self, workflow, scatter_setting, call_input):
+        self._scatter_name = scatter_setting.get('name')
+
+        # must always have one key (at least for now)
+        input_variable = list(scatter_setting.get('input').keys())[0]
+        self._with_items_field = scatter_setting.get('input').get(input_variable).get('with_items')
+
+        task_suffix_field = scatter_setting.get('input').get(input_variable).get('task_suffix')
+        self._suffix_from_count = not task_suffix_field
+        self._suffix_key = None
+        if task_suffix_field:
+            suffix_fields = task_suffix_field.split('.')
+            if len(suffix_fields) == 2 and suffix_fields[0] == input_variable:
+                self._suffix_key = suffix_fields[1]
+
+        # parent tasks in the same scatter get the task suffix appended: before + suffix + after
+        self._scatter_depends_on = None
+        if self._depends_on:
+            self._scatter_depends_on = []
+            for parent_call in self._depends_on:
+                parts = parent_call.split('@')
+                if self._in_this_scatter(workflow, parts[1]):
+                    self._scatter_depends_on.append(('%s@%s.' % (parts[0], parts[1]),
+                                                     ''.join('@%s' % p for p in parts[2:])))
+                else:
+                    self._scatter_depends_on.append((parent_call, None))
+
+        self._inputs = []
+        for i, value in call_input.items():
+            if '@' in value:
+                if self._in_this_scatter(workflow, value.split('@')[1]):
+                    binding = _SCATTER_OUTPUT, '{{%s.' % value, '}}'
+                else:
+                    binding = _CONST, '{{%s}}' % value, None
+            elif len(value.split('.')) == 2:
+                if value.split('.')[0] == input_variable:
+                    binding = _ITEM_FIELD, value.split('.')[1], None
+                else:
+                    binding = _JOB_NESTED, value.split('.')[0], value.split('.')[1]
+            elif value == input_variable:
+                binding = _ITEM, None, None
+            else:
+                binding = _JOB_FIELD, value, None
+
+            self._inputs.append((i, binding))
+
+    def job_requirements(self):
+        # what tasks of this template need in the job JSON, see JobValidator:
+        #   ('object', <field>, <key>), a root level object a key is read from
+        #   ('items', <field>, <item keys>, <suffix>), the scatter items, keys read from each item
+        #   (empty when items are used as they are) and the task suffix: None when made from the
+        #   position, ITEM from the item or the key of the item it is made from
+        requirements = set()
+
+        def add(binding):
+            kind, a, b = binding
+            if kind == _JOB_NESTED:
+                requirements.add(('object', a, b))
+            elif kind == _LIST:
+                for binding in a:
+                    add(binding)
+
+        for i, binding in self._inputs:
+            add(binding)
+
+        if self.is_scatter:
+            if self._suffix_from_count:
+                suffix = None
+            else:
+                suffix = ITEM if self._suffix_key is None else self._suffix_key
+            item_keys = tuple(sorted(set(a for i, (kind, a, b) in self._inputs if kind == _ITEM_FIELD)))
+            requirements.add(('items', self._with_items_field, item_keys, suffix))
+
+        return requirements
+
+    def _in_this_scatter(self, workflow, task_name):
+        return workflow.workflow_tasks.get(task_name).get('scatter', {}).get('name') == self._scatter_name
+
+    def _bind_job(self, binding, job_json):
+        # resolve job level bindings, which are the same for every scatter item
+        kind, a, b = binding
+        if kind == _JOB_FIELD:
+            return _CONST, job_json.get(a), None
+        elif kind == _JOB_NESTED:
+            return _CONST, job_json.get(a).get(b), None
+        elif kind == _LIST:
+            return _LIST, [self._bind_job(binding, job_json) for binding in a], None
+        return binding
+
+    def _task_suffix(self, item, count):
+        if self._suffix_from_count:
+            task_suffix = str(count)
+        elif isinstance(item, dict):
+            if self._suffix_key is None:
+                print('Error: error in scatter call definition')
+                task_suffix = None
+            else:
+                task_suffix = item.get(self._suffix_key)
+        elif isinstance(item, str) or isinstance(item, int):
+            task_suffix = str(item)
+        else:
+            print('Error: item from withitems field must be dict, string or int')
+            task_suffix = None
+
+        return SUFFIX_PATTERN.sub('_', task_suffix)  # need to avoid special character
+
+    def _task(self, name, input_, depends_on):
+        return {
+            'task': name,
+            'input': input_,
+            'tool': self._tool,
+            'depends_on': depends_on,
+            'command': self._command,
+            'runtime': self._runtime
+        }
+
+    def tasks(self, job_json):
+        # generate the tasks of this template for the job, scatter items are expanded one by one
+        if not self.is_scatter:
+            yield self._task(self._name,
+                             {i: _resolve(self._bind_job(binding, job_json)) for i, binding in self._inputs},
+                             list(self._depends_on) if self._depends_on else self._depends_on)
+            return
+
+        items = job_json.get(self._with_items_field)
+        # the with_items_field must be in the original job JSON, at least for now
+        if not items:
+            print('Error: can not find with_items field')
+            return
+
+        inputs = [(i, self._bind_job(binding, job_json)) for i, binding in self._inputs]
+
+        task_suffix_set = set()
+        for count, item in enumerate(items, 1):
+            task_suffix = self._task_suffix(item, count)
+            task_suffix_set.add(task_suffix)
+
+            depends_on = self._depends_on
+            if self._scatter_depends_on:
+                depends_on = [before if after is None else before + task_suffix + after
+                              for before, after in self._scatter_depends_on]
+
+            input_ = {}
+            for i, (kind, a, b) in inputs:
+                if kind == _CONST:
+                    input_[i] = a
+                elif kind == _SCATTER_OUTPUT:
+                    input_[i] = a + task_suffix + b
+                elif kind == _ITEM:
+                    input_[i] = item
+                elif kind == _ITEM_FIELD:
+                    input_[i] = item.get(a)
+
+            yield self._task('%s.%s' % (self._name, task_suffix), input_, depends_on)
+
+        if len(task_suffix_set) < len(items):
+            print('duplicated task suffix detected')
+
+    def compact_task(self, job_json):
+        # a scatter task once for all items, instead of one task per item. TASK_SUFFIX in its name,
+        # inputs and dependencies stands for the suffix of each item's task, an input of ITEM for
+        # the item and ITEM_FIELD for a field of it. 'scatter' tells where the items are and how
+        # the suffix is made: from POSITION (of the item, counting from 1), ITEM or ITEM_FIELD,
+        # with runs of characters other than letters and digits replaced with '_'
+        items = job_json.get(self._with_items_field)
+        if not items:
+            print('Error: can not find with_items field')
+            return
+
+        input_ = {}
+        for i, binding in self._inputs:
+            kind, a, b = self._bind_job(binding, job_json)
+            if kind == _CONST:
+                input_[i] = a
+            elif kind == _SCATTER_OUTPUT:
+                input_[i] = a + TASK_SUFFIX + b
+            elif kind == _ITEM:
+                input_[i] = ITEM
+            elif kind == _ITEM_FIELD:
+                input_[i] = ITEM_FIELD % a
+
+        depends_on = self._depends_on
+        if self._scatter_depends_on:
+            depends_on = [before if after is None else before + TASK_SUFFIX + after
+                          for before, after in self._scatter_depends_on]
+
+        if self._suffix_from_count:
+            task_suffix = POSITION
+        elif self._suffix_key is not None:
+            task_suffix = ITEM_FIELD % self._suffix_key
+        else:
+            task_suffix = ITEM
+
+        task = self._task('%s.%s' % (self._name, TASK_SUFFIX), input_, depends_on)
+        task['scatter'] = {
+            'with_items': self._with_items_field,
+            'items': len(items),
+            'task_suffix': task_suffix
+        }
+        return task
+
+
+def _resolve(binding):
+    kind, a, b = binding
+    if kind == _LIST:
+        return [_resolve(binding) for binding in a]
+    return a
@@ -0,0 +1,168 @@
+from copy import deepcopy
+from .task_template import ITEM, SUFFIX_PATTERN
+from ..exceptions import InvalidJobJSON
+
+
+# types of workflow inputs (workflow.input.<input>.type) and the values they take
+TYPES = {
+    'string': (str,),
+    'integer': (int,),
+    'number': (int, float),
+    'boolean': (bool,),
+    'array': (list,),
+    'object': (dict,)
+}
+
+# values of inputs without default in job JSON templates, by type
+PLACEHOLDERS = {
+    'string': '',
+    'integer': 0,
+    'number': 0,
+    'boolean': False,
+    'array': [],
+    'object': {}
+}
+
+MAX_ERRORS = 20  # reported per job JSON
+
+
+def _is_type(value, types):
+    # bool is an int in python, not an integer or number here
+    return isinstance(value, types) and (bool in types or not isinstance(value, bool))
+
+
+class JobValidator(object):
+    # checks job JSONs before any task is generated, compiled once per workflow from its input
+    # definition (root level inputs only, like defaults) and from what its tasks need:
+    #   inputs without default are required, inputs with a type must be of that type
+    #   objects keys are read from must be objects
+    #   scatter items must be a non-empty array of items each task suffix can be made of, objects
+    #   when keys are read from them, and no two items may give the same suffix
+    def __init__(self, workflow):
+        input_def = workflow.workflow_dict.get('workflow', {}).get('input') or {}
+
+        self._inputs = []  # (input, required, type name, types)
+        self._defaults = {}
+        for name, definition in input_def.items():
+            definition = definition if isinstance(definition, dict) else {}
+            type_name = definition.get('type') if isinstance(definition.get('type'), str) else None
+            self._inputs.append((name, 'default' not in definition, type_name, TYPES.get(type_name)))
+            if 'default' in definition:
+                self._defaults[name] = definition['default']
+
+        objects = set()
+        items = {}  # (input, suffix) -> item keys
+        for task_template in workflow.task_templates:
+            for requirement in task_template.job_requirements():
+                if requirement[0] == 'object':
+                    objects.add(requirement[1:])
+                elif requirement[0] == 'items':
+                    kind, name, item_keys, suffix = requirement
+                    items.setdefault((name, suffix), set()).update(item_keys)
+
+        self._objects = sorted(objects)
+        self._items = [(name, tuple(sorted(item_keys)), suffix) for (name, suffix), item_keys in sorted(
+            items.items(), key=lambda i: (i[0][0], str(i[0][1])))]
+
+    def _value(self, job_json, name):
+        return job_json[name] if name in job_json else self._defaults.get(name)
+
+    def errors(self, job_json):
+        # what is wrong with the job JSON, nothing when it is valid
+        if not isinstance(job_json, dict):
+            return ['JobJSON must be an object']
+
+        errors = []
+        failed = set()  # inputs already reported
+        for name, required, type_name, types in self._inputs:
+            if name not in job_json:
+                if required:
+                    errors.append("missing input '%s'" % name)
+                    failed.add(name)
+            elif types and not _is_type(job_json[name], types):
+                errors.append("input '%s' must be of type %s" % (name, type_name))
+                failed.add(name)
+
+        for name, key in self._objects:
+            if name not in failed and not isinstance(self._value(job_json, name), dict):
+                errors.append("input '%s' must be an object, '%s' is read from it" % (name, key))
+                failed.add(name)
+
+        for name, item_keys, suffix in self._items:
+            if name in failed:
+                continue
+
+            items = self._value(job_json, name)
+            if not isinstance(items, list) or not items:
+                errors.append("input '%s' must be a non-empty array of scatter items" % name)
+            else:
+                errors += self._item_errors(name, items, item_keys, suffix)
+
+            if len(errors) >= MAX_ERRORS:
+                break
+
+        return errors[:MAX_ERRORS]
+
+    @staticmethod
+    def _item_errors(name, items, item_keys, suffix):
+        errors = []
+        suffixes = set()
+        for i, item in enumerate(items, 1):
+            if item_keys or suffix not in (None, ITEM):
+                if not isinstance(item, dict):
+                    errors.append("item %s of '%s' must be an object" % (i, name))
+                elif suffix not in (None, ITEM):
+                    if not isinstance(item.get(suffix), str):
+                        errors.append("item %s of '%s' must have '%s', a string for its task suffix"
+                                      % (i, name, suffix))
+                    else:
+                        task_suffix = SUFFIX_PATTERN.sub('_', item[suffix])
+                        if task_suffix in suffixes:
+                            errors.append("item %s of '%s' has the same task suffix as another: %s"
+                                          % (i, name, task_suffix))
+                        suffixes.add(task_suffix)
+            elif suffix == ITEM:
+                if not isinstance(item, (str, int)):
+                    errors.append("item %s of '%s' must be a string or an integer for its task suffix" % (i, name))
+                else:
+                    task_suffix = SUFFIX_PATTERN.sub('_', str(item))
+                    if task_suffix in suffixes:
+                        errors.append("item %s of '%s' has the same task suffix as another: %s"
+                                      % (i, name, task_suffix))
+                    suffixes.add(task_suffix)
+
+            if len(errors) >= MAX_ERRORS:
+                break
+
+        return errors
+
+    def validate(self, job_json):
+        errors = self.errors(job_json)
+        if errors:
+            raise InvalidJobJSON('; '.join(errors))
+
+    def template(self):
+        # job JSON to start from: defaults, placeholders of inputs without one, and one example
+        # scatter item with the keys read from it
+        template = {}
+        for name, required, type_name, types in self._inputs:
+            template[name] = deepcopy(self._defaults[name] if name in self._defaults else PLACEHOLDERS.get(type_name))
+
+        for name, key in self._objects:
+            if not isinstance(template.get(name), dict):
+                template[name] = {}
+            template[name].setdefault(key, None)
+
+        for name, item_keys, suffix in self._items:
+            if template.get(name):
+                continue
+
+            if item_keys or suffix not in (None, ITEM):
+                item = dict((key, None) for key in item_keys)
+                if suffix not in (None, ITEM):
+                    item[suffix] = ''
+            else:
+                item = ''
+            template[name] = [item]
+
+        return template
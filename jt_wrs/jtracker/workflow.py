@@ -1,22 +1,38 @@
 import yaml
 import json
+from contextlib import contextmanager
+from .task_template import TaskTemplate
+
+
+@contextmanager
+def _untimed(name):
+    yield
 
 
 class Workflow(object):
-    def __init__(self, workflow_yaml_file=None, workflow_yaml_string=None):
-        if workflow_yaml_string:
-            self._workflow_dict = yaml.load(workflow_yaml_string)
-        else:
-            with open(workflow_yaml_file, 'r') as stream:
-                self._workflow_dict = yaml.load(stream)
+    # timer, when given, is called with the name of each stage, 'yaml' (parsing) and 'normalize',
+    # and returns a context manager timing it, eg, the service's tracing.span
+    def __init__(self, workflow_yaml_file=None, workflow_yaml_string=None, timer=None):
+        timer = timer or _untimed
+
+        with timer('yaml'):
+            if workflow_yaml_string:
+                self._workflow_dict = yaml.safe_load(workflow_yaml_string)
+            else:
+                with open(workflow_yaml_file, 'r') as stream:
+                    self._workflow_dict = yaml.safe_load(stream)
 
-        self._name = self.workflow_dict.get('workflow').get('name')
-        self._version = self.workflow_dict.get('workflow').get('version')
+        with timer('normalize'):
+            self._name = self.workflow_dict.get('workflow').get('name')
+            self._version = self.workflow_dict.get('workflow').get('version')
 
-        self._get_workflow_tasks()
+            self._get_workflow_tasks()
 
-        self._add_default_runtime_to_tools()
-        self._update_dependency()
+            self._add_default_runtime_to_tools()
+            self._update_dependency()
+
+            # tasks compiled once here, so jobs only need to fill in their own values
+            self._task_templates = [TaskTemplate(self, t) for t in self.workflow_tasks]
 
     @property
     def name(self):
@@ -34,6 +50,10 @@ class Workflow(object):
     def workflow_tasks(self):
         return self._workflow_tasks
 
+    @property
+    def task_templates(self):
+        return self._task_templates
+
     def _get_workflow_tasks(self):
         tasks = self.workflow_dict.get('workflow', {}).get('tasks', {})
 
@@ -0,0 +1,171 @@
+import os
+import time
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request
+from prometheus_client import Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from . import tracing
+
+
+# prometheus metrics of the service, exposed at /metrics once init_app is called on the flask app.
+# With several worker processes (see app.py) and PROMETHEUS_MULTIPROC_DIR set, counters and
+# histograms are added up over all workers, cache metrics are those of the worker answering
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'))
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+REQUEST_LATENCY = Histogram('wrs_request_duration_seconds', 'Request latency by API operation',
+                            ['operation'], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter('wrs_requests_total', 'Requests by API operation and status code', ['operation', 'status'])
+
+ETCD_LATENCY = Histogram('wrs_etcd_request_duration_seconds', 'etcd call latency by call',
+                         ['call'], buckets=LATENCY_BUCKETS)
+ETCD_ERRORS = Counter('wrs_etcd_errors_total', 'Failed etcd calls by call', ['call'])
+ETCD_RETRIES = Counter('wrs_etcd_retries_total', 'Retried etcd calls by call', ['call'])
+ETCD_READ_BYTES = Counter('wrs_etcd_read_bytes_total', 'Bytes (keys and values) read from etcd')
+REQUEST_ETCD_READ_BYTES = Histogram('wrs_request_etcd_read_bytes', 'Bytes read from etcd per request',
+                                    ['operation'], buckets=BYTES_BUCKETS)
+
+SQLITE_LATENCY = Histogram('wrs_sqlite_request_duration_seconds', 'SQLite store call latency by call',
+                           ['call'], buckets=LATENCY_BUCKETS)
+SQLITE_ERRORS = Counter('wrs_sqlite_errors_total', 'Failed SQLite store calls by call', ['call'])
+
+AMS_LATENCY = Histogram('wrs_ams_request_duration_seconds', 'AMS call latency by call',
+                        ['call'], buckets=LATENCY_BUCKETS)
+AMS_ERRORS = Counter('wrs_ams_errors_total', 'Failed AMS calls by call', ['call'])
+
+WORKFLOW_COMPILE_LATENCY = Histogram('wrs_workflow_compile_duration_seconds',
+                                     'Time to parse and normalize a workflow file', buckets=LATENCY_BUCKETS)
+PLAN_LATENCY = Histogram('wrs_plan_duration_seconds', 'Time to expand job execution plans, per call',
+                         ['mode'], buckets=LATENCY_BUCKETS)
+PLAN_TASKS = Histogram('wrs_plan_tasks', 'Tasks in a generated job execution plan', buckets=COUNT_BUCKETS)
+PLAN_SCATTER_WIDTH = Histogram('wrs_plan_scatter_width', 'Tasks a scatter task expanded to in a plan',
+                               buckets=COUNT_BUCKETS)
+
+
+def _add_request_etcd_bytes(nbytes):
+    if has_request_context():
+        g.wrs_etcd_read_bytes = g.get('wrs_etcd_read_bytes', 0) + nbytes
+
+
+def observe_etcd_read(nbytes):
+    ETCD_READ_BYTES.inc(nbytes)
+    _add_request_etcd_bytes(nbytes)
+
+
+def range_response_size(response):
+    return sum(len(kv.key) + len(kv.value) for kv in response.kvs)
+
+
+@contextmanager
+def timed(histogram, errors=None, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.labels(**labels).inc()
+        raise
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def etcd_call(call):
+    with tracing.span('etcd'), timed(ETCD_LATENCY, ETCD_ERRORS, call=call):
+        yield
+
+
+@contextmanager
+def sqlite_call(call):
+    with tracing.span('sqlite'), timed(SQLITE_LATENCY, SQLITE_ERRORS, call=call):
+        yield
+
+
+@contextmanager
+def ams_call(call):
+    with tracing.span('ams'), timed(AMS_LATENCY, AMS_ERRORS, call=call):
+        yield
+
+
+def observe_plan(tasks, scatter_task_names=()):
+    PLAN_TASKS.observe(len(tasks))
+
+    if scatter_task_names:
+        widths = dict((name, 0) for name in scatter_task_names)
+        for task in tasks:
+            name = task.get('task', '').rsplit('.', 1)[0]
+            if name in widths:
+                widths[name] += 1
+        for width in widths.values():
+            PLAN_SCATTER_WIDTH.observe(width)
+
+
+class CacheCollector(object):
+    # hit/miss/eviction counters and fill of in-process caches, read from their stats() when scraped.
+    # caches maps a cache name to a callable returning the stats
+    def __init__(self, caches):
+        self._caches = caches
+
+    def collect(self):
+        hits = CounterMetricFamily('wrs_cache_hits', 'Cache hits', labels=['cache'])
+        misses = CounterMetricFamily('wrs_cache_misses', 'Cache misses', labels=['cache'])
+        evictions = CounterMetricFamily('wrs_cache_evictions', 'Cache evictions', labels=['cache'])
+        size = GaugeMetricFamily('wrs_cache_entries', 'Entries in cache', labels=['cache'])
+        hit_ratio = GaugeMetricFamily('wrs_cache_hit_ratio', 'Cache hit ratio since start', labels=['cache'])
+
+        for name, get_stats in sorted(self._caches.items()):
+            stats = get_stats()
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            evictions.add_metric([name], stats['evictions'])
+            size.add_metric([name], stats['size'])
+            hit_ratio.add_metric([name], stats['hit_ratio'])
+
+        return [hits, misses, evictions, size, hit_ratio]
+
+
+_cache_collectors = []
+
+
+def register_caches(caches):
+    collector = CacheCollector(caches)
+    _cache_collectors.append(collector)
+    REGISTRY.register(collector)
+
+
+def _before_request():
+    g.wrs_request_start = time.perf_counter()
+
+
+def _after_request(response):
+    # streamed bodies are still being generated at this point, their latency is time to first byte
+    start = g.get('wrs_request_start')
+    if start is not None and request.endpoint != 'wrs_metrics':
+        operation = tracing.operation()
+        REQUEST_LATENCY.labels(operation=operation).observe(time.perf_counter() - start)
+        REQUESTS.labels(operation=operation, status=str(response.status_code)).inc()
+        REQUEST_ETCD_READ_BYTES.labels(operation=operation).observe(g.get('wrs_etcd_read_bytes', 0))
+
+    return response
+
+
+def expose():
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in _cache_collectors:
+            registry.register(collector)
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(flask_app, path='/metrics'):
+    flask_app.before_request(_before_request)
+    flask_app.after_request(_after_request)
+    flask_app.add_url_rule(path, 'wrs_metrics', expose)
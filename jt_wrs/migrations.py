@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import threading
+from . import storage
+from . import wrs
+
+
+# one-off data migrations, run with: python -m jt_wrs.migrations [<migration> ...]
+# or in the background of the service by listing them in WRS_BACKGROUND_MIGRATIONS
+
+SCAN_PAGE_SIZE = 1000
+MIGRATION_PAUSE = float(os.environ.get('WRS_MIGRATION_PAUSE', 0.01))  # seconds between workflows, eases etcd load
+
+
+def _scan_keys(key_prefix, keys_only=True):
+    # keys (with revisions) under key_prefix in key order, read one page at a time
+    range_end = storage.prefix_end(key_prefix)
+    range_start = storage.to_bytes(key_prefix)
+    while True:
+        r = wrs.store.range(range_start, range_end, limit=SCAN_PAGE_SIZE, keys_only=keys_only)
+        for kv in r.kvs:
+            yield kv
+
+        if not r.more or not r.kvs:
+            break
+        range_start = r.kvs[-1].key + b'\0'
+
+
+def _registered_versions():
+    # workflow id -> {version: create revision of its first key}, for all registered workflows
+    workflow_root = '%s/workflow/id:' % wrs.WRS_ETCD_ROOT
+
+    workflows = {}
+    for kv in _scan_keys(workflow_root):
+        parts = kv.key.decode('utf-8')[len(workflow_root):].split('/')
+        if len(parts) != 3 or not parts[1].startswith('ver:'):
+            continue
+
+        versions = workflows.setdefault(parts[0], {})
+        version = parts[1].split(':', 1)[1]
+        versions[version] = min(versions.get(version, kv.create_revision), kv.create_revision)
+
+    return workflows
+
+
+def backfill_version_index():
+    # version index and latest pointer for workflows registered before they were maintained.
+    # Existing index keys are left alone, so this can be run again (or while registering)
+    added = 0
+
+    for workflow_id, versions in _registered_versions().items():
+        ordered = sorted(versions, key=versions.get)  # in registration order
+        for version in ordered:
+            key = '%sver:%s' % (wrs._version_index_prefix(workflow_id), version)
+            added += 1 if wrs.store.put_if_missing(key, '') else 0
+
+        wrs.store.put_if_missing(wrs._latest_version_key(workflow_id), ordered[-1])
+
+    print('Version index backfilled, %s index keys added' % added)
+
+
+def migrate_workflow_records():
+    # records for workflows stored in per attribute keys, see records.py. Reads keep working
+    # throughout as workflows without records are read from their keys
+    if wrs.STORAGE_LAYOUT == 'keys':
+        print('Error: records are not used with WRS_STORAGE_LAYOUT=keys')
+        return
+
+    owner_root = '%s/owner.id:' % wrs.WRS_ETCD_ROOT
+
+    workflows = written = 0
+    for kv in _scan_keys(owner_root, keys_only=False):
+        if not kv.key.endswith(b'/id'):
+            continue
+
+        written += wrs.migrate_workflow_record(kv.value.decode('utf-8'))
+        workflows += 1
+        time.sleep(MIGRATION_PAUSE)
+
+    print('Workflow records migrated, %s workflows checked, %s records written' % (workflows, written))
+
+
+MIGRATIONS = {
+    'backfill_version_index': backfill_version_index,
+    'migrate_workflow_records': migrate_workflow_records
+}
+
+
+def start_background(names):
+    # run migrations one after the other in a daemon thread, names is a comma separated list
+    names = [name.strip() for name in (names or '').split(',') if name.strip()]
+    if not names:
+        return
+
+    def run():
+        for name in names:
+            try:
+                MIGRATIONS[name]()
+            except Exception as err:
+                print('Error: migration %s failed: %s' % (name, str(err)))
+
+    thread = threading.Thread(target=run, name='wrs-migrations')
+    thread.daemon = True
+    thread.start()
+
+    return thread
+
+
+def main(names):
+    for name in names or sorted(MIGRATIONS):
+        if name not in MIGRATIONS:
+            print('Error: unknown migration: %s, available: %s' % (name, ', '.join(sorted(MIGRATIONS))))
+            return 1
+
+        MIGRATIONS[name]()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,87 @@
+import time
+import zlib
+import hashlib
+import tarfile
+
+
+PACKAGE_FORMAT = 'jt-package/1'
+CHUNK_SIZE = 256 * 1024  # raw bytes per chunk, compressed chunks must stay well below etcd's value limit
+
+# a package is stored as a manifest plus zlib compressed chunks addressed by the sha256 of
+# their raw content, so files shared between versions (or workflows) are stored once
+#
+# manifest:
+#   {
+#     "format": "jt-package/1",
+#     "created": 1528213563,
+#     "files": [
+#       {"path": "main.jt", "mode": 420, "size": 1024, "chunks": ["<sha256>", ...]},
+#       ...
+#     ]
+#   }
+
+
+def build_manifest(archive):
+    # hash every chunk of every file in the archive's workflow directory, reading one chunk at a time
+    files = []
+    for path in sorted(archive.members):
+        info = archive.members[path]
+
+        chunks = []
+        with archive.open(path) as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                chunks.append(hashlib.sha256(data).hexdigest())
+
+        files.append({
+            'path': path,
+            'mode': (info.external_attr >> 16) & 0o777 or 0o644,
+            'size': info.file_size,
+            'chunks': chunks
+        })
+
+    return {
+        'format': PACKAGE_FORMAT,
+        'created': int(time.time()),
+        'files': files
+    }
+
+
+def iter_compressed_chunks(archive, manifest, wanted):
+    # (sha256, compressed chunk) for each of the wanted chunks, re-read from the archive
+    wanted = set(wanted)
+    for f in manifest['files']:
+        if not wanted.intersection(f['chunks']):
+            continue
+
+        with archive.open(f['path']) as fh:
+            for chunk_hash in f['chunks']:
+                data = fh.read(CHUNK_SIZE)
+                if chunk_hash in wanted:
+                    wanted.discard(chunk_hash)
+                    yield chunk_hash, zlib.compress(data)
+
+
+def iter_package(manifest, get_chunks, root='workflow', batch_size=4):
+    # stream the package as tar.gz, get_chunks(hashes) returns the compressed chunks in order.
+    # Only batch_size chunks are held in memory at any time
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+
+    for f in manifest['files']:
+        info = tarfile.TarInfo('%s/%s' % (root, f['path']))
+        info.size = f['size']
+        info.mode = f['mode']
+        info.mtime = manifest.get('created', 0)
+        yield compressor.compress(info.tobuf(format=tarfile.PAX_FORMAT))
+
+        chunks = f['chunks']
+        for i in range(0, len(chunks), batch_size):
+            for data in get_chunks(chunks[i:i + batch_size]):
+                yield compressor.compress(zlib.decompress(data))
+
+        yield compressor.compress(b'\0' * ((tarfile.BLOCKSIZE - f['size'] % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE))
+
+    # end of archive marker is two empty blocks
+    yield compressor.compress(b'\0' * tarfile.BLOCKSIZE * 2) + compressor.flush()
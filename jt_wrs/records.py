@@ -0,0 +1,77 @@
+import json
+
+
+# compact layout, one JSON record for a workflow's own attributes and one per version:
+#
+#   /jt:wrs/record/id:<workflow_id>/workflow      -> {"workflow_type": "JTracker", "name": ..., "owner.id": ...}
+#   /jt:wrs/record/id:<workflow_id>/ver:<version> -> {"git_path": ..., "git_tag": ..., "files": [...]}
+#
+# file bodies are not part of the records, they stay in their own keys. "files" lists the ones
+# stored for the version, they are decoded the same way as in the per attribute key layout:
+# as attribute without value
+
+HEADER_RECORD = b'workflow'
+
+# values file body attributes get when decoded from the per attribute key layout
+FILE_PLACEHOLDERS = {
+    'workflowfile': None,
+    'workflow_package': ''
+}
+
+
+def encode_header(attributes):
+    # keys sorted, the order attributes written in one transaction are decoded in from the
+    # per attribute key layout
+    return json.dumps(attributes, separators=(',', ':'), sort_keys=True)
+
+
+def encode_version(attributes, files=()):
+    record = dict((k, v) for k, v in attributes.items() if k not in FILE_PLACEHOLDERS)
+    record['files'] = sorted(f for f in files if f in FILE_PLACEHOLDERS)
+    return json.dumps(record, separators=(',', ':'), sort_keys=True)
+
+
+def split_workflow(workflow):
+    # (own attributes, {version: (attributes, files)}) of a decoded workflow
+    header = {}
+    versions = {}
+    for k, v in workflow.items():
+        if k.startswith('ver:'):
+            versions[k.split(':', 1)[1]] = (v, [f for f in FILE_PLACEHOLDERS if f in v])
+        elif k != 'id':
+            header[k] = v
+
+    return header, versions
+
+
+def decode(workflow_id, kvs):
+    # (decoded workflow, revisions) from the records of a workflow, same shape as decoded from the
+    # per attribute key layout. None when there is no header record
+    header = None
+    version_kvs = []
+    for kv in kvs:
+        name = kv.key.rsplit(b'/', 1)[-1]
+        if name == HEADER_RECORD:
+            header = kv
+        elif name.startswith(b'ver:'):
+            version_kvs.append(kv)
+
+    if header is None:
+        return None, None
+
+    workflow = {
+        'id': workflow_id
+    }
+    workflow.update(json.loads(header.value.decode('utf-8')))
+    revisions = {None: header.mod_revision}
+
+    for kv in sorted(version_kvs, key=lambda kv: kv.mod_revision):
+        ver = kv.key.rsplit(b'/', 1)[-1].decode('utf-8')
+        record = json.loads(kv.value.decode('utf-8'))
+        for f in record.pop('files', []):
+            record[f] = FILE_PLACEHOLDERS[f]
+
+        workflow[ver] = record
+        revisions[ver] = kv.mod_revision
+
+    return workflow, revisions
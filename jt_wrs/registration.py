@@ -0,0 +1,172 @@
+import time
+import uuid
+import queue
+import threading
+import gevent
+from .cache import LRUCache
+from .exceptions import RegistrationQueueFull
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class Registration(object):
+    def __init__(self, owner_name, workflow_entry):
+        self.id = str(uuid.uuid4())
+        self.owner_name = owner_name
+        self.workflow_entry = workflow_entry
+        self.status = QUEUED
+        self.workflow = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    @property
+    def key(self):
+        return self.owner_name, self.workflow_entry.get('name'), self.workflow_entry.get('version')
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    @classmethod
+    def from_dict(cls, d):
+        registration = cls(d.get('owner.name'), {'name': d.get('name'), 'version': d.get('version')})
+        for attribute in ('id', 'status', 'workflow', 'error', 'submitted_at', 'finished_at'):
+            setattr(registration, attribute, d.get(attribute))
+        return registration
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'owner.name': self.owner_name,
+            'name': self.workflow_entry.get('name'),
+            'version': self.workflow_entry.get('version'),
+            'status': self.status,
+            'workflow': self.workflow,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'finished_at': self.finished_at
+        }
+
+
+class RegistrationQueue(object):
+    # runs workflow registrations in background workers, a registration of the same
+    # owner/name/version that is still queued or running is handed back instead of
+    # being queued again. With save and load, registrations are also shared with other
+    # processes (eg, the other workers): save is called with a registration whenever its
+    # status changes and load returns a registration saved by any process, or None. With claim,
+    # registrations are de-duplicated across processes too: claim is called with a registration
+    # before it is queued and returns the one of the same owner/name/version still queued or
+    # running in another process, or None when this registration claimed it. save is then in
+    # charge of releasing the claim once the registration is done
+    LOAD_POLL_INTERVAL = 0.5
+
+    def __init__(self, register, workers=2, max_queued=1000, keep=86400, save=None, load=None, claim=None):
+        self._register = register
+        self._save = save
+        self._load = load
+        self._claim = claim
+        self._keep = keep
+        self._workers = workers
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._registrations = LRUCache(maxsize=max(max_queued * 10, 1000), ttl=keep)  # id -> Registration
+        self._pending = {}  # (owner name, workflow name, version) -> Registration not yet done
+        self._changed = threading.Condition()
+        self._threads = []
+
+    def submit(self, owner_name, workflow_entry):
+        registration = Registration(owner_name, workflow_entry)
+
+        with self._changed:
+            pending = self._pending.get(registration.key)
+            if pending:
+                return pending
+
+            # only submit puts in the queue, it can't fill up between here and put_nowait
+            if self._queue.full():
+                raise RegistrationQueueFull(self._queue.maxsize)
+
+            if self._claim:
+                pending = self._claim(registration)
+                if pending:
+                    return pending
+
+            self._queue.put_nowait(registration)
+
+            self._pending[registration.key] = registration
+            self._registrations.put(registration.id, registration)
+
+            # saved before a worker can pick it up, so a later status is never overwritten
+            self._saved(registration)
+
+            if not self._threads:
+                self._start_workers()
+
+        return registration
+
+    def get(self, registration_id, wait=0):
+        # wait up to 'wait' seconds for a queued or running registration to finish
+        deadline = time.monotonic() + wait
+        with self._changed:
+            registration = self._registrations.get(registration_id)
+            while registration and not registration.done:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+
+        if registration is None and self._load:
+            # submitted to another process, poll its saved status. gevent.sleep lets the other
+            # requests of the worker run meanwhile, monkey patched or not
+            registration = self._load(registration_id)
+            while registration and not registration.done and time.monotonic() < deadline:
+                gevent.sleep(min(self.LOAD_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+                registration = self._load(registration_id)
+
+            if registration and time.time() - registration.submitted_at > self._keep:
+                registration = None
+
+        return registration
+
+    def _saved(self, registration):
+        if self._save:
+            try:
+                self._save(registration)
+            except Exception as err:
+                print('Error: unable to save status of registration %s: %s' % (registration.id, str(err)))
+
+    def _start_workers(self):
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._run, name='wrs-registration-%s' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            registration = self._queue.get()
+
+            with self._changed:
+                registration.status = RUNNING
+                self._changed.notify_all()
+            self._saved(registration)
+
+            try:
+                workflow = self._register(registration.owner_name, registration.workflow_entry)
+            except Exception as err:
+                workflow, error = None, str(err)
+            else:
+                error = None
+
+            with self._changed:
+                registration.workflow = workflow
+                registration.error = error
+                registration.status = FAILED if error else SUCCEEDED
+                registration.finished_at = time.time()
+                self._pending.pop(registration.key, None)
+                self._changed.notify_all()
+            self._saved(registration)
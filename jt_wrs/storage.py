@@ -0,0 +1,451 @@
+import time
+import random
+import sqlite3
+import itertools
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+import grpc
+import etcd3
+import gevent
+import etcd3.etcdrpc as etcdrpc
+from . import metrics
+
+
+# key-value storage engines behind wrs.py. Keys and values are bytes (str is stored utf-8 encoded)
+# and read in key order. Every write transaction gets a new store wide revision, like in etcd,
+# recorded on the keys it writes as their mod revision (and create revision when new).
+#   EtcdStore, the registry in an etcd cluster
+#   SQLiteStore, the registry in a SQLite database file for single node deployments, or in
+#   memory (path ':memory:') for tests and load testing without etcd
+# A put with a ttl writes a key that expires ttl seconds later, through an etcd lease, or, in
+# SQLite, hidden from reads once expired and removed by the next write transaction (before its
+# conditions are checked). Deleted keys reach watchers too, those of SQLiteStore only when
+# deleted through the same store
+
+KeyValue = namedtuple('KeyValue', ['key', 'value', 'create_revision', 'mod_revision'])
+RangeResult = namedtuple('RangeResult', ['kvs', 'more', 'revision'])
+WatchEvent = namedtuple('WatchEvent', ['key', 'mod_revision'])
+
+# operations and conditions of write transactions
+Put = namedtuple('Put', ['key', 'value', 'ttl'], defaults=(None,))
+Delete = namedtuple('Delete', ['key'])
+Exists = namedtuple('Exists', ['key'])
+Missing = namedtuple('Missing', ['key'])
+
+
+def to_bytes(s):
+    return s if isinstance(s, bytes) else s.encode('utf-8')
+
+
+def prefix_end(prefix):
+    # end of the range of keys starting with prefix
+    end = bytearray(to_bytes(prefix))
+    end[-1] += 1
+    return bytes(end)
+
+
+class EtcdEndpoint(object):
+    # an etcd cluster member and its pool of clients, one gRPC channel each, created on first use.
+    # A member that failed is skipped until its backoff is over
+    def __init__(self, host, port, channels=2, timeout=None):
+        self.host = host
+        self.port = port
+        self.failures = 0
+        self.error = None
+        self.down_until = 0
+        self._channels = max(channels, 1)
+        self._timeout = timeout
+        self._clients = []
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return '%s:%s' % (self.host, self.port)
+
+    @property
+    def up(self):
+        return time.monotonic() >= self.down_until
+
+    def client(self):
+        if not self._clients:
+            with self._lock:
+                if not self._clients:
+                    # timeout only bounds watch creation, calls are given their own deadline
+                    self._clients = [etcd3.client(host=self.host, port=self.port, timeout=self._timeout)
+                                     for _ in range(self._channels)]
+
+        return self._clients[next(self._next) % len(self._clients)]
+
+    def succeeded(self):
+        self.failures = 0
+        self.error = None
+        self.down_until = 0
+
+    def failed(self, err, backoff, max_backoff):
+        self.failures += 1
+        if isinstance(err, grpc.RpcError) and hasattr(err, 'details'):
+            self.error = '%s: %s' % (err.code().name, err.details())
+        else:
+            self.error = str(err)
+        self.down_until = time.monotonic() + min(backoff * 2 ** (self.failures - 1), max_backoff)
+
+
+def parse_endpoints(endpoints, default_port=2379):
+    # 'host1:2379,host2:2379' -> [('host1', 2379), ('host2', 2379)], schemes like http:// are ignored
+    parsed = []
+    for endpoint in endpoints.split(','):
+        endpoint = endpoint.strip().split('://', 1)[-1].rstrip('/')
+        if endpoint:
+            host, _, port = endpoint.rpartition(':') if ':' in endpoint else (endpoint, '', default_port)
+            parsed.append((host, int(port)))
+    return parsed
+
+
+class EtcdStore(object):
+    # the registry in an etcd cluster, nothing connects before the first call. Calls go to the
+    # cluster members in turn and have a deadline, timeout for reads and write_timeout for write
+    # transactions. Reads, which are idempotent, are retried on unavailable members and timeouts,
+    # on another member when there is one, after an exponential backoff with jitter. Writes are
+    # not retried, their outcome is unknown when they fail this way
+    RETRY_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+    ERRORS = {
+        grpc.StatusCode.UNAVAILABLE: etcd3.exceptions.ConnectionFailedError,
+        grpc.StatusCode.DEADLINE_EXCEEDED: etcd3.exceptions.ConnectionTimeoutError,
+        grpc.StatusCode.INTERNAL: etcd3.exceptions.InternalServerError
+    }
+
+    def __init__(self, endpoints=(('localhost', 2379),), timeout=5, write_timeout=10, retries=2,
+                 backoff=0.05, max_backoff=2, channels=2, health_timeout=1):
+        self.endpoints = [EtcdEndpoint(host, port, channels=channels, timeout=timeout) for host, port in endpoints]
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.health_timeout = health_timeout
+        self._next = itertools.count()
+
+    def _endpoint(self):
+        # next member in turn that is up, or the one to be back first
+        start = next(self._next)
+        for i in range(len(self.endpoints)):
+            endpoint = self.endpoints[(start + i) % len(self.endpoints)]
+            if endpoint.up:
+                return endpoint
+        return min(self.endpoints, key=lambda e: e.down_until)
+
+    def _error(self, err):
+        error = self.ERRORS.get(err.code())
+        return error() if error else err
+
+    def _call(self, call, method, request, timeout, retry=True, endpoint=None, stub='kvstub'):
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            call_endpoint = endpoint or self._endpoint()
+            client = call_endpoint.client()
+            try:
+                with metrics.etcd_call(call):
+                    response = getattr(getattr(client, stub), method)(request, timeout,
+                                                              credentials=client.call_credentials,
+                                                              metadata=client.metadata)
+            except grpc.RpcError as err:
+                if err.code() not in self.RETRY_CODES:
+                    raise self._error(err)
+
+                call_endpoint.failed(err, self.backoff, self.max_backoff)
+                if attempt + 1 == attempts:
+                    raise self._error(err)
+
+                metrics.ETCD_RETRIES.labels(call=call).inc()
+                gevent.sleep(min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1))
+            else:
+                call_endpoint.succeeded()
+                return response
+
+    def _read(self, call, request):
+        response = self._call(call, 'Range', request, self.timeout)
+        metrics.observe_etcd_read(metrics.range_response_size(response))
+        return response
+
+    def revision(self):
+        return self._read('get', etcdrpc.RangeRequest(key=b'/', count_only=True)).header.revision
+
+    def get(self, key):
+        response = self._read('get', etcdrpc.RangeRequest(key=to_bytes(key)))
+        return response.kvs[0].value if response.kvs else None
+
+    def range(self, start, end, limit=None, keys_only=False):
+        r = self._read('range', etcdrpc.RangeRequest(key=to_bytes(start), range_end=to_bytes(end),
+                                                     limit=limit or 0, keys_only=keys_only))
+        return RangeResult(r.kvs, r.more, r.header.revision)
+
+    def ranges(self, ranges, keys_only=False):
+        # read many (key, range_end) ranges in one etcd transaction, returns the kvs of each
+        # range and the revision they were read at. A range given as (key, range_end, keys_only)
+        # overrides keys_only
+        request_ops = [
+            etcdrpc.RequestOp(request_range=etcdrpc.RangeRequest(key=r[0], range_end=r[1],
+                                                                 keys_only=r[2] if len(r) > 2 else keys_only))
+            for r in ranges
+        ]
+
+        response = self._call('txn_range', 'Txn', etcdrpc.TxnRequest(success=request_ops), self.timeout)
+
+        metrics.observe_etcd_read(sum(metrics.range_response_size(op.response_range) for op in response.responses))
+
+        return [op.response_range.kvs for op in response.responses], response.header.revision
+
+    @staticmethod
+    def _compare(condition):
+        if isinstance(condition, Exists):
+            return (etcd3.transactions.Version(condition.key) > 0).build_message()
+        return (etcd3.transactions.Version(condition.key) == 0).build_message()
+
+    @staticmethod
+    def _ops(ops, leases):
+        return [etcdrpc.RequestOp(request_delete_range=etcdrpc.DeleteRangeRequest(key=to_bytes(op.key)))
+                if isinstance(op, Delete) else
+                etcdrpc.RequestOp(request_put=etcdrpc.PutRequest(key=to_bytes(op.key), value=to_bytes(op.value),
+                                                                 lease=leases.get(op.ttl, 0)))
+                for op in ops]
+
+    def _lease(self, ttl):
+        # a lease not used, eg, by the puts of the branch not taken, just expires
+        return self._call('lease_grant', 'LeaseGrant', etcdrpc.LeaseGrantRequest(TTL=int(ttl)), self.write_timeout,
+                          stub='leasestub').ID
+
+    def transaction(self, compare, success, failure=()):
+        # writes the puts and deletes of success if all compare conditions hold, otherwise
+        # those of failure, returns whether they held
+        leases = dict((op.ttl, self._lease(op.ttl)) for op in list(success) + list(failure)
+                      if getattr(op, 'ttl', None))
+        request = etcdrpc.TxnRequest(compare=[self._compare(c) for c in compare],
+                                     success=self._ops(success, leases), failure=self._ops(failure, leases))
+        return self._call('txn', 'Txn', request, self.write_timeout, retry=False).succeeded
+
+    def put_if_missing(self, key, value):
+        return self.transaction([Missing(key)], [Put(key, value)])
+
+    def watch_prefix(self, prefix, callback, start_revision=None):
+        # callback is called with the WatchEvents of each change under prefix, or with the
+        # exception that ended the watch
+        endpoint = self._endpoint()
+
+        def on_response(response):
+            if isinstance(response, Exception):
+                endpoint.failed(response, self.backoff, self.max_backoff)
+                callback(response)
+                return
+
+            # older etcd3 clients call back with single events
+            callback([WatchEvent(event.key, event.mod_revision) for event in getattr(response, 'events', [response])])
+
+        try:
+            with metrics.etcd_call('watch'):
+                return endpoint.client().add_watch_prefix_callback(prefix, on_response, start_revision=start_revision)
+        except Exception as err:
+            endpoint.failed(err, self.backoff, self.max_backoff)
+            raise
+
+    def health(self):
+        # probes every member with a short deadline, healthy when any of them answers
+        endpoints = []
+        for endpoint in self.endpoints:
+            try:
+                self._call('health', 'Range', etcdrpc.RangeRequest(key=b'/', count_only=True), self.health_timeout,
+                           retry=False, endpoint=endpoint)
+            except Exception as err:
+                endpoints.append({'endpoint': str(endpoint), 'healthy': False, 'error': endpoint.error or str(err)})
+            else:
+                endpoints.append({'endpoint': str(endpoint), 'healthy': True, 'error': None})
+
+        return {'healthy': any(e['healthy'] for e in endpoints), 'endpoints': endpoints}
+
+
+class SQLiteStore(object):
+    # keys are the primary key of the kv table, so reads of the keys under a prefix, eg, the
+    # workflows of an owner (by name) or the versions of a workflow, are index range scans.
+    # Changes made by other processes sharing the database file reach watchers by polling
+    # every watch_interval seconds, changes made through this store right away
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS kv ('
+        '  key BLOB PRIMARY KEY,'
+        '  value BLOB NOT NULL,'
+        '  create_revision INTEGER NOT NULL,'
+        '  mod_revision INTEGER NOT NULL'
+        ') WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS kv_mod_revision ON kv (mod_revision)',
+        'CREATE TABLE IF NOT EXISTS revision (id INTEGER PRIMARY KEY CHECK (id = 0), revision INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO revision (id, revision) VALUES (0, 0)',
+        # keys written with a ttl, see _expire
+        'CREATE TABLE IF NOT EXISTS expiry (key BLOB PRIMARY KEY, expires_at REAL NOT NULL) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS expiry_expires_at ON expiry (expires_at)'
+    ]
+
+    def __init__(self, path, watch_interval=1.0):
+        self.path = path
+        self.watch_interval = watch_interval
+
+        # one connection shared by all threads, statements are serialized
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._transaction(write=True) as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+        self._watchers = {}  # watch id -> (prefix, callback)
+        self._watch_ids = itertools.count(1)
+        self._poll_thread = None
+        self._poll_revision = 0
+
+    @contextmanager
+    def _transaction(self, write=False):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    @staticmethod
+    def _revision(conn):
+        return conn.execute('SELECT revision FROM revision').fetchone()[0]
+
+    # expired keys not yet removed, see _expire, are not read
+    NOT_EXPIRED = 'NOT EXISTS (SELECT 1 FROM expiry WHERE expiry.key = kv.key AND expiry.expires_at <= ?)'
+
+    @classmethod
+    def _range(cls, conn, start, end, limit=None, keys_only=False):
+        sql = ('SELECT key, %s, create_revision, mod_revision FROM kv WHERE key >= ? AND key < ? AND %s ORDER BY key'
+               % ("x''" if keys_only else 'value', cls.NOT_EXPIRED))
+        if limit:
+            sql += ' LIMIT %d' % (limit + 1)
+
+        kvs = [KeyValue(*row) for row in conn.execute(sql, (to_bytes(start), to_bytes(end), time.time()))]
+        more = bool(limit) and len(kvs) > limit
+
+        return (kvs[:limit] if more else kvs), more
+
+    def revision(self):
+        with metrics.sqlite_call('revision'), self._lock:
+            return self._revision(self._conn)
+
+    def get(self, key):
+        with metrics.sqlite_call('get'), self._lock:
+            row = self._conn.execute('SELECT value FROM kv WHERE key = ? AND %s' % self.NOT_EXPIRED,
+                                     (to_bytes(key), time.time())).fetchone()
+        return row[0] if row else None
+
+    def range(self, start, end, limit=None, keys_only=False):
+        with metrics.sqlite_call('range'), self._transaction() as conn:
+            kvs, more = self._range(conn, start, end, limit=limit, keys_only=keys_only)
+            return RangeResult(kvs, more, self._revision(conn))
+
+    def ranges(self, ranges, keys_only=False):
+        with metrics.sqlite_call('txn_range'), self._transaction() as conn:
+            results = [self._range(conn, r[0], r[1], keys_only=r[2] if len(r) > 2 else keys_only)[0]
+                       for r in ranges]
+            return results, self._revision(conn)
+
+    @staticmethod
+    def _holds(conn, condition):
+        exists = conn.execute('SELECT 1 FROM kv WHERE key = ?', (to_bytes(condition.key),)).fetchone() is not None
+        return exists if isinstance(condition, Exists) else not exists
+
+    def transaction(self, compare, success, failure=()):
+        with metrics.sqlite_call('txn'), self._transaction(write=True) as conn:
+            self._expire(conn)
+            succeeded = all(self._holds(conn, c) for c in compare)
+
+            ops = success if succeeded else failure
+            if ops:
+                revision = self._revision(conn) + 1
+                conn.execute('UPDATE revision SET revision = ?', (revision,))
+                puts = [op for op in ops if not isinstance(op, Delete)]
+                conn.executemany(
+                    'INSERT INTO kv (key, value, create_revision, mod_revision) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (key) DO UPDATE SET value = excluded.value, mod_revision = excluded.mod_revision',
+                    [(to_bytes(op.key), to_bytes(op.value), revision, revision) for op in puts]
+                )
+                conn.executemany('DELETE FROM kv WHERE key = ?',
+                                 [(to_bytes(op.key),) for op in ops if isinstance(op, Delete)])
+
+                # like a put without a lease in etcd, a put without a ttl keeps the key
+                now = time.time()
+                conn.executemany('INSERT OR REPLACE INTO expiry (key, expires_at) VALUES (?, ?)',
+                                 [(to_bytes(op.key), now + op.ttl) for op in puts if op.ttl])
+                conn.executemany('DELETE FROM expiry WHERE key = ?',
+                                 [(to_bytes(op.key),) for op in ops if not getattr(op, 'ttl', None)])
+
+        if ops:
+            self._notify([WatchEvent(to_bytes(op.key), revision) for op in ops])
+
+        return succeeded
+
+    def put_if_missing(self, key, value):
+        return self.transaction([Missing(key)], [Put(key, value)])
+
+    @staticmethod
+    def _expire(conn):
+        expired = conn.execute('SELECT key FROM expiry WHERE expires_at <= ?', (time.time(),)).fetchall()
+        if expired:
+            conn.executemany('DELETE FROM kv WHERE key = ?', expired)
+            conn.executemany('DELETE FROM expiry WHERE key = ?', expired)
+
+    def health(self):
+        try:
+            with self._lock:
+                self._conn.execute('SELECT 1 FROM revision').fetchone()
+        except Exception as err:
+            return {'healthy': False, 'endpoints': [{'endpoint': self.path, 'healthy': False, 'error': str(err)}]}
+
+        return {'healthy': True, 'endpoints': [{'endpoint': self.path, 'healthy': True, 'error': None}]}
+
+    def watch_prefix(self, prefix, callback, start_revision=None):
+        # same as EtcdStore.watch_prefix
+        with self._lock:
+            watch_id = next(self._watch_ids)
+            self._watchers[watch_id] = (to_bytes(prefix), callback)
+
+            if self.path != ':memory:' and self._poll_thread is None:
+                self._poll_revision = start_revision - 1 if start_revision else self._revision(self._conn)
+                self._poll_thread = threading.Thread(target=self._poll, name='wrs-sqlite-watch')
+                self._poll_thread.daemon = True
+                self._poll_thread.start()
+
+        return watch_id
+
+    def _notify(self, events):
+        with self._lock:
+            watchers = list(self._watchers.values())
+
+        for prefix, callback in watchers:
+            matched = [event for event in events if event.key.startswith(prefix)]
+            if matched:
+                callback(matched)
+
+    def _poll(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                with self._transaction() as conn:
+                    rows = conn.execute('SELECT key, mod_revision FROM kv WHERE mod_revision > ? '
+                                        'ORDER BY mod_revision', (self._poll_revision,)).fetchall()
+            except Exception as err:
+                # watches end here, like broken etcd watches
+                with self._lock:
+                    watchers = self._watchers
+                    self._watchers = {}
+                    self._poll_thread = None
+                for prefix, callback in watchers.values():
+                    callback(err)
+                return
+
+            if rows:
+                self._poll_revision = rows[-1][1]
+                self._notify([WatchEvent(key, mod_revision) for key, mod_revision in rows])
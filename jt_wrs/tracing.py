@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import random
+import cProfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+
+
+# opt-in per request timing breakdown. A request is traced when it has the trace header set
+# (to anything but '0') or is picked by sampling. Traced requests get a Server-Timing header
+# with the time spent in each kind of span, eg, 'etcd;dur=12.5;desc="4 calls"', plus 'other'
+# for time not in any span, which includes connexion's validation and response serialization.
+# Requests slower than WRS_SLOW_REQUEST_SECONDS are logged as one JSON line, with their spans
+# when traced. With WRS_PROFILE_DIR set traced requests also run under cProfile and the
+# profiles of the WRS_PROFILE_KEEP slowest ones (above the slow request threshold) are kept.
+# A profiler covers its thread, which all requests of a gevent worker share: one request at a
+# time is profiled, and its profile also has whatever other requests ran while it waited, eg,
+# on etcd. Profiles of a single request are only had with WRS_WORKER_CONNECTIONS=1 (and
+# WRS_WORKERS > 1, the single process mode does not limit concurrent requests)
+
+TRACE_HEADER = os.environ.get('WRS_TRACE_HEADER', 'X-WRS-Trace')
+TRACE_SAMPLE_RATE = float(os.environ.get('WRS_TRACE_SAMPLE_RATE', 0))
+SLOW_REQUEST_SECONDS = float(os.environ.get('WRS_SLOW_REQUEST_SECONDS', 1))  # 0 turns the slow request log off
+PROFILE_DIR = os.environ.get('WRS_PROFILE_DIR')
+PROFILE_KEEP = int(os.environ.get('WRS_PROFILE_KEEP', 20))
+
+_profiles = []  # heap of (duration, file name) of the profiles kept
+_profiles_lock = threading.Lock()
+
+
+class Trace(object):
+    def __init__(self, profile=False):
+        self.start = time.perf_counter()
+        self.spans = []  # (name, start relative to the trace, duration)
+        self.profiler = cProfile.Profile() if profile else None
+
+    def add(self, name, start, duration):
+        self.spans.append((name, start - self.start, duration))
+
+    def summary(self):
+        # span name -> (total duration, count), in order of first occurrence
+        summary = OrderedDict()
+        for name, start, duration in self.spans:
+            total, count = summary.get(name, (0, 0))
+            summary[name] = (total + duration, count + 1)
+        return summary
+
+    def server_timing(self, duration):
+        summary = self.summary()
+        timings = ['%s;dur=%.3f;desc="%s calls"' % (name, total * 1000, count)
+                   for name, (total, count) in summary.items()]
+        timings.append('other;dur=%.3f' % (max(duration - sum(t for t, c in summary.values()), 0) * 1000))
+        timings.append('total;dur=%.3f' % (duration * 1000))
+        return ', '.join(timings)
+
+
+def current():
+    return g.get('wrs_trace') if has_request_context() else None
+
+
+@contextmanager
+def span(name):
+    # time a stage of the current request, spans should not be nested. No-op when not traced
+    trace = current()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start)
+
+
+def operation():
+    # connexion names flask endpoints after the operationId: <blueprint>.jt_wrs_<function>
+    return (request.endpoint or 'unknown').rsplit('.', 1)[-1]
+
+
+def _traced():
+    header = request.headers.get(TRACE_HEADER)
+    if header is not None:
+        return header != '0'
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+def _keep_profile(profiler, duration):
+    name = '%09.3f-%s-%s.prof' % (duration, operation(), uuid.uuid4().hex[:8])
+
+    with _profiles_lock:
+        if len(_profiles) >= PROFILE_KEEP and duration <= _profiles[0][0]:
+            return  # not among the slowest
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        heapq.heappush(_profiles, (duration, name))
+
+        while len(_profiles) > PROFILE_KEEP:
+            duration, name = heapq.heappop(_profiles)
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name))
+            except OSError:
+                pass
+
+
+def _before_request():
+    g.wrs_trace_start = time.perf_counter()
+    if _traced():
+        trace = Trace(profile=bool(PROFILE_DIR))
+        g.wrs_trace = trace
+        if trace.profiler:
+            try:
+                trace.profiler.enable()
+            except ValueError:  # another request is being profiled in this thread
+                trace.profiler = None
+
+
+def _after_request(response):
+    start = g.get('wrs_trace_start')
+    if start is None:
+        return response
+
+    duration = time.perf_counter() - start
+    trace = g.get('wrs_trace')
+    if trace:
+        if trace.profiler:
+            trace.profiler.disable()
+        response.headers['Server-Timing'] = trace.server_timing(duration)
+
+    if SLOW_REQUEST_SECONDS and duration >= SLOW_REQUEST_SECONDS:
+        entry = OrderedDict([
+            ('slow_request', operation()),
+            ('method', request.method),
+            ('path', request.path),
+            ('status', response.status_code),
+            ('duration_ms', round(duration * 1000, 3))
+        ])
+        if trace:
+            entry['spans'] = OrderedDict((name, {'duration_ms': round(total * 1000, 3), 'count': count})
+                                         for name, (total, count) in trace.summary().items())
+        print(json.dumps(entry))
+
+        if trace and trace.profiler:
+            try:
+                _keep_profile(trace.profiler, duration)
+            except Exception as err:
+                print('Error: unable to write request profile: %s' % str(err))
+
+    return response
+
+
+def init_app(flask_app):
+    flask_app.before_request(_before_request)
+    flask_app.after_request(_after_request)
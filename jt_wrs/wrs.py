@@ -1,13 +1,25 @@
 import os
-import etcd3
-import zipfile
-import tempfile
-from io import BytesIO
 import uuid
-import requests
 import json
-from .exceptions import OwnerNameNotFound, AMSNotAvailable, OwnerIDNotFound, InvalidJTWorkflowFile
+import base64
+import hashlib
+import binascii
+import threading
+from copy import deepcopy
+from .ams import OwnerResolver
+from . import metrics
+from . import package
+from . import records
+from . import storage
+from . import tracing
+from .archive import WorkflowArchive
+from .cache import LRUCache, SingleFlight, deep_getsizeof
+from .exceptions import OwnerNameNotFound, InvalidJTWorkflowFile, InvalidCursor, InvalidTaskDependency, \
+    InvalidLookup
 from .jtracker import JTracker
+from .jtracker.graph import plan_graph
+from .jtracker.batch import PlanPool
+from .registration import Registration, RegistrationQueue
 
 
 # settings, need to move out to config
@@ -15,73 +27,314 @@ from .jtracker import JTracker
 ams_host = os.environ.get('AMS_HOST', 'localhost')
 ams_port = os.environ.get('AMS_PORT', 12012)
 AMS_URL = 'http://%s:%s/api/jt-ams/v0.1' % (ams_host, ams_port)
+AMS_TIMEOUT = float(os.environ.get('AMS_TIMEOUT', 5))
+AMS_CACHE_TTL = float(os.environ.get('AMS_CACHE_TTL', 300))
+AMS_NEGATIVE_CACHE_TTL = float(os.environ.get('AMS_NEGATIVE_CACHE_TTL', 30))
+
+owner_resolver = OwnerResolver(AMS_URL, timeout=AMS_TIMEOUT, ttl=AMS_CACHE_TTL,
+                               negative_ttl=AMS_NEGATIVE_CACHE_TTL)
 
 etcd_host = os.environ.get('ETCD_HOST', 'localhost')
 etcd_port = os.environ.get('ETCD_PORT', 2379)
-etcd_client = etcd3.client(host=etcd_host, port=etcd_port)
+
+# etcd cluster members, ie, ETCD_ENDPOINTS=etcd-0:2379,etcd-1:2379,etcd-2:2379
+ETCD_ENDPOINTS = storage.parse_endpoints(os.environ.get('ETCD_ENDPOINTS') or '%s:%s' % (etcd_host, etcd_port))
+ETCD_TIMEOUT = float(os.environ.get('ETCD_TIMEOUT', 5))  # deadline of reads, in seconds
+ETCD_WRITE_TIMEOUT = float(os.environ.get('ETCD_WRITE_TIMEOUT', 10))
+ETCD_RETRIES = int(os.environ.get('ETCD_RETRIES', 2))  # of reads, writes are not retried
+ETCD_RETRY_BACKOFF = float(os.environ.get('ETCD_RETRY_BACKOFF', 0.05))
+ETCD_CHANNELS = int(os.environ.get('ETCD_CHANNELS', 2))  # gRPC channels per cluster member
+ETCD_HEALTH_TIMEOUT = float(os.environ.get('ETCD_HEALTH_TIMEOUT', 1))
+
+# where the registry is kept: 'etcd', 'sqlite', a SQLite database file for single node
+# deployments, or 'memory', an in-memory SQLite database for tests and load testing
+STORAGE_ENGINES = ('etcd', 'sqlite', 'memory')
+STORAGE_ENGINE = os.environ.get('WRS_STORAGE_ENGINE', 'etcd')
+SQLITE_PATH = os.environ.get('WRS_SQLITE_PATH', 'jt-wrs.db')
+SQLITE_WATCH_INTERVAL = float(os.environ.get('WRS_SQLITE_WATCH_INTERVAL', 1))
+
+if STORAGE_ENGINE == 'etcd':
+    store = storage.EtcdStore(ETCD_ENDPOINTS, timeout=ETCD_TIMEOUT, write_timeout=ETCD_WRITE_TIMEOUT,
+                              retries=ETCD_RETRIES, backoff=ETCD_RETRY_BACKOFF, channels=ETCD_CHANNELS,
+                              health_timeout=ETCD_HEALTH_TIMEOUT)
+elif STORAGE_ENGINE == 'sqlite':
+    store = storage.SQLiteStore(SQLITE_PATH, watch_interval=SQLITE_WATCH_INTERVAL)
+elif STORAGE_ENGINE == 'memory':
+    store = storage.SQLiteStore(':memory:')
+else:
+    raise ValueError('WRS_STORAGE_ENGINE must be one of: %s' % ', '.join(STORAGE_ENGINES))
 
 WRS_ETCD_ROOT = '/jt:wrs'
 
+# package chunks are kept outside of WRS_ETCD_ROOT/ so they are not sent to every watcher
+WRS_PACKAGE_ETCD_ROOT = '/jt:wrs-package'
+PACKAGE_FETCH_BATCH = int(os.environ.get('WRS_PACKAGE_FETCH_BATCH', 4))  # chunks per etcd read on download
+
+# file bodies stored under a workflow version, never read for metadata queries. They all
+# start with FILE_KEY_PREFIX, so they sort after the metadata keys of a version
+FILE_KEYS = (b'workflowfile', b'workflow_package')
+FILE_KEY_PREFIX = b'workflow'
+
+# how workflow attributes are stored: 'keys', one etcd key per attribute (the original layout),
+# 'records', one JSON record for the workflow and one for each version (see records.py), or
+# 'dual', which writes both while existing workflows are migrated. Records are read first in
+# 'dual' and 'records', falling back to the per attribute keys for workflows not yet migrated
+STORAGE_LAYOUTS = ('keys', 'dual', 'records')
+STORAGE_LAYOUT = os.environ.get('WRS_STORAGE_LAYOUT', 'dual')
+if STORAGE_LAYOUT not in STORAGE_LAYOUTS:
+    raise ValueError('WRS_STORAGE_LAYOUT must be one of: %s' % ', '.join(STORAGE_LAYOUTS))
+
+WRS_RECORD_ETCD_ROOT = WRS_ETCD_ROOT + '/record'
+
+# versions registered for each workflow and the latest one:
+#   /jt:wrs/workflow-index/id:<workflow_id>/ver:<version>
+#   /jt:wrs/workflow-index/id:<workflow_id>/latest -> <version>
+WRS_INDEX_ETCD_ROOT = WRS_ETCD_ROOT + '/workflow-index'
+
+ETCD_TXN_MAX_OPS = int(os.environ.get('ETCD_TXN_MAX_OPS', 128))  # etcd's default --max-txn-ops
+
+MAX_PAGE_SIZE = int(os.environ.get('WRS_MAX_PAGE_SIZE', 1000))
+LISTING_VERSIONS = ('all', 'latest', 'none')
+MAX_LOOKUP_SIZE = int(os.environ.get('WRS_MAX_LOOKUP_SIZE', 1000))  # workflows per bulk lookup
+
+WORKFLOW_CACHE_SIZE = int(os.environ.get('WRS_WORKFLOW_CACHE_SIZE', 2048))
+OWNER_WORKFLOW_CACHE_SIZE = int(os.environ.get('WRS_OWNER_WORKFLOW_CACHE_SIZE', 1024))
+
+# in-process caches of decoded etcd content, kept coherent by a watch on WRS_ETCD_ROOT
+workflow_cache = LRUCache(maxsize=WORKFLOW_CACHE_SIZE)  # workflow id -> (workflow with all versions, revisions)
+owner_workflow_cache = LRUCache(maxsize=OWNER_WORKFLOW_CACHE_SIZE)  # owner id -> [(workflow name, id)]
+
+# compiled JTracker objects keyed by (workflow id, version), a registered version
+# never changes so these are kept until evicted, bounded by estimated memory use
+COMPILED_WORKFLOW_CACHE_SIZE = int(os.environ.get('WRS_COMPILED_WORKFLOW_CACHE_SIZE', 1024))
+COMPILED_WORKFLOW_CACHE_BYTES = int(os.environ.get('WRS_COMPILED_WORKFLOW_CACHE_BYTES', 256 * 1024 * 1024))
+compiled_workflow_cache = LRUCache(maxsize=COMPILED_WORKFLOW_CACHE_SIZE,
+                                   maxweight=COMPILED_WORKFLOW_CACHE_BYTES,
+                                   getsizeof=lambda jt: deep_getsizeof(jt.workflow.workflow_dict))
+_compile_flight = SingleFlight()
+
+# execution plans keyed by (workflow id, version, hash of the canonical job JSON), so identical
+# job JSONs, eg, retried submissions, are expanded once. Bounded by estimated memory use
+PLAN_CACHE_SIZE = int(os.environ.get('WRS_PLAN_CACHE_SIZE', 1024))
+PLAN_CACHE_BYTES = int(os.environ.get('WRS_PLAN_CACHE_BYTES', 128 * 1024 * 1024))
+PLAN_SIZE_SAMPLE = 16  # measuring every task would take longer than generating them, they are sampled
+plan_cache = LRUCache(maxsize=PLAN_CACHE_SIZE, maxweight=PLAN_CACHE_BYTES,
+                      getsizeof=lambda plan: deep_getsizeof(plan, sample=PLAN_SIZE_SAMPLE))
+
+# worker processes for batch execution plan generation
+PLAN_WORKERS = int(os.environ.get('WRS_PLAN_WORKERS', os.cpu_count() or 1))
+PLAN_INLINE_BATCH_SIZE = int(os.environ.get('WRS_PLAN_INLINE_BATCH_SIZE', 8))
+plan_pool = PlanPool(workers=PLAN_WORKERS, inline_batch_size=PLAN_INLINE_BATCH_SIZE)
+
+# background workflow registration
+ARCHIVE_MAX_BYTES = int(os.environ.get('WRS_ARCHIVE_MAX_BYTES', 100 * 1024 * 1024))
+ARCHIVE_SPOOL_BYTES = int(os.environ.get('WRS_ARCHIVE_SPOOL_BYTES', 8 * 1024 * 1024))
+ARCHIVE_TIMEOUT = float(os.environ.get('WRS_ARCHIVE_TIMEOUT', 30))
+REGISTRATION_WORKERS = int(os.environ.get('WRS_REGISTRATION_WORKERS', 2))
+REGISTRATION_MAX_QUEUED = int(os.environ.get('WRS_REGISTRATION_MAX_QUEUED', 1000))
+REGISTRATION_KEEP = int(os.environ.get('WRS_REGISTRATION_KEEP', 86400))  # seconds a registration can be polled
+# seconds a queued or running registration holds its owner/name/version for, eg, when its process died
+REGISTRATION_CLAIM_TTL = int(os.environ.get('WRS_REGISTRATION_CLAIM_TTL', 3600))
+
+# with several processes serving the API (workers of app.py), a registration can be polled through
+# any of them, its status is kept in the registry store, expiring after REGISTRATION_KEEP seconds.
+# A registration also claims its owner/name/version in the store while it is queued or running, so
+# the same workflow version submitted to several workers is registered once.
+# Outside of WRS_ETCD_ROOT/, not for the watchers
+SHARE_REGISTRATIONS = os.environ.get('WRS_SHARE_REGISTRATIONS',
+                                     '1' if int(os.environ.get('WRS_WORKERS', 1)) > 1 else '0') == '1'
+WRS_REGISTRATION_ETCD_ROOT = '/jt:wrs-registration'
+
+registration_queue = RegistrationQueue(lambda owner_name, workflow_entry: register_workflow(owner_name, workflow_entry),
+                                       workers=REGISTRATION_WORKERS, max_queued=REGISTRATION_MAX_QUEUED,
+                                       keep=REGISTRATION_KEEP,
+                                       save=(lambda registration: _save_registration(registration))
+                                       if SHARE_REGISTRATIONS else None,
+                                       load=(lambda registration_id: _load_registration(registration_id))
+                                       if SHARE_REGISTRATIONS else None,
+                                       claim=(lambda registration: _claim_registration(registration))
+                                       if SHARE_REGISTRATIONS else None)
+
+metrics.register_caches({
+    'workflow': workflow_cache.stats,
+    'owner_workflow': owner_workflow_cache.stats,
+    'compiled_workflow': compiled_workflow_cache.stats,
+    'plan': plan_cache.stats,
+    'owner_name_to_id': lambda: owner_resolver.stats()['name_to_id'],
+    'owner_id_to_name': lambda: owner_resolver.stats()['id_to_name']
+})
+
+_cache_lock = threading.RLock()
+_cache_watch_lock = threading.Lock()
+_cache_watch_id = None
+_cache_watch_revision = 0  # latest revision known to the caches, older reads are not cached
+
+
+def get_health():
+    # for readiness probes, whether the registry store can be read
+    health = store.health()
+    health['storage'] = STORAGE_ENGINE
+    return health
+
 
 def _get_owner_id_by_name(owner_name):
-    request_url = '%s/accounts/%s' % (AMS_URL.strip('/'), owner_name)
-    try:
-        r = requests.get(request_url)
-    except:
-        raise AMSNotAvailable('AMS service temporarily unavailable')
+    return owner_resolver.get_id_by_name(owner_name)
 
-    if r.status_code != 200:
-        raise OwnerNameNotFound(owner_name)
 
-    return json.loads(r.text).get('id')
+def _get_owner_name_by_id(owner_id):
+    return owner_resolver.get_name_by_id(owner_id)
 
 
-def _get_owner_name_by_id(owner_id):
-    request_url = '%s/accounts/_id/%s' % (AMS_URL.strip('/'), owner_id)
-    try:
-        r = requests.get(request_url)
-    except:
-        raise AMSNotAvailable('AMS service temporarily unavailable')
+def _get_workflow_id_by_owner_id_and_workflow_name(owner_id, workflow_name):
+    for name, workflow_id in _get_owner_workflows(owner_id):
+        if name == workflow_name:
+            return workflow_id
 
-    if r.status_code != 200:
-        raise OwnerIDNotFound(owner_id)
 
-    return json.loads(r.text).get('name')
+def _start_cache_watch():
+    # caches are only trusted while the watch on WRS_ETCD_ROOT is up, returns
+    # whether they can be used
+    global _cache_watch_id, _cache_watch_revision
 
+    if _cache_watch_id is not None:
+        return True
 
-def _get_workflow_id_by_owner_id_and_workflow_name(owner_id, workflow_name):
-    v, meta = etcd_client.get('%s/owner.id:%s/workflow/name:%s/id' % (WRS_ETCD_ROOT, owner_id, workflow_name ))
-    if v:
-        return v.decode("utf-8")
+    with _cache_watch_lock:
+        if _cache_watch_id is not None:
+            return True
 
-def get_workflows(owner_name=None, workflow_name=None, workflow_version=None):
-    owner_id = _get_owner_id_by_name(owner_name)
+        try:
+            revision = store.revision()
+            watch_id = store.watch_prefix(WRS_ETCD_ROOT + '/', _on_cache_watch_response, start_revision=revision + 1)
+        except Exception as err:
+            print('Unable to watch registry store, in-process caches disabled: %s' % str(err))
+            return False
+
+        with _cache_lock:
+            # anything cached before the watch was in place may be stale
+            workflow_cache.clear()
+            owner_workflow_cache.clear()
+            _cache_watch_revision = revision
+            _cache_watch_id = watch_id
+
+    return True
+
+
+def _on_cache_watch_response(events):
+    global _cache_watch_id
+
+    if isinstance(events, Exception):
+        # watch is broken, drop everything, it will be set up again on next read
+        print('Registry store watch interrupted, in-process caches reset: %s' % str(events))
+        with _cache_lock:
+            _cache_watch_id = None
+            workflow_cache.clear()
+            owner_workflow_cache.clear()
+        return
 
-    if owner_id:
-        workflows = []
+    for event in events:
+        _invalidate_cached_key(event.key.decode('utf-8'), event.mod_revision)
+
+
+def _invalidate_cached_key(key, revision):
+    global _cache_watch_revision
+
+    # keys look like:
+    #   /jt:wrs/workflow/id:<workflow_id>/...
+    #   /jt:wrs/workflow/id:<workflow_id>/ver:<version>/...
+    #   /jt:wrs/record/id:<workflow_id>/[workflow|ver:<version>]
+    #   /jt:wrs/owner.id:<owner_id>/workflow/name:<workflow_name>/id
+    parts = key.replace(WRS_ETCD_ROOT, '', 1).strip('/').split('/')
 
-        # find the workflows' name and id first
-        workflow_name_id_prefix = '/'.join([WRS_ETCD_ROOT,
-                                            'owner.id:%s' % owner_id,
-                                            'workflow/'])
+    with _cache_lock:
+        _cache_watch_revision = max(_cache_watch_revision, revision)
 
-        if workflow_name:
-            key_search_prefix = '%sname:%s/id' % (workflow_name_id_prefix, workflow_name)
+        if parts[0] in ('workflow', 'record') and len(parts) > 1 and parts[1].startswith('id:'):
+            workflow_id = parts[1].split(':', 1)[1]
+            workflow_cache.pop(workflow_id)
+            if len(parts) > 2 and parts[2].startswith('ver:'):
+                # should not happen as versions are immutable, but be safe
+                compiled_workflow_cache.pop((workflow_id, parts[2].split(':', 1)[1]))
+        elif parts[0].startswith('owner.id:'):
+            owner_workflow_cache.pop(parts[0].split(':', 1)[1])
+
+
+def _cache_put(cache, key, value, revision):
+    # a read older than the latest change seen through the watch may already be stale
+    with _cache_lock:
+        if _cache_watch_id is not None and revision >= _cache_watch_revision:
+            cache.put(key, value)
+
+
+def _owner_workflows_prefix(owner_id):
+    return '%s/owner.id:%s/workflow/' % (WRS_ETCD_ROOT, owner_id)
+
+
+def _get_owner_workflows(owner_id):
+    # list of (workflow name, workflow id) registered under the owner
+    return _get_owners_workflows([owner_id])[owner_id]
+
+
+def _get_owners_workflows(owner_ids):
+    # owner id -> list of (workflow name, workflow id), owners not cached are read in batched transactions
+    use_cache = _start_cache_watch()
+
+    owners = {}
+    missing_ids = []
+    for owner_id in set(owner_ids):
+        workflows = owner_workflow_cache.get(owner_id) if use_cache else None
+        if workflows is None:
+            missing_ids.append(owner_id)
         else:
-            key_search_prefix = '%sname' % workflow_name_id_prefix
+            owners[owner_id] = workflows
+
+    for chunk in _chunks(missing_ids, ETCD_TXN_MAX_OPS):
+        ranges = []
+        for owner_id in chunk:
+            key_prefix = '%sname:' % _owner_workflows_prefix(owner_id)
+            ranges.append((storage.to_bytes(key_prefix), storage.prefix_end(key_prefix)))
 
-        r = etcd_client.get_prefix(key_prefix=key_search_prefix, sort_target='mod')
+        results, revision = store.ranges(ranges)
 
-        for value, meta in r:
-            k = meta.key.decode('utf-8').replace(workflow_name_id_prefix, '', 1)
-            try:
-                v = value.decode("utf-8")
-            except:
-                v = None  # assume binary value, deal with it later
+        for owner_id, kvs in zip(chunk, results):
+            owners[owner_id] = _decode_owner_workflows(owner_id, kvs)
+            if use_cache:
+                _cache_put(owner_workflow_cache, owner_id, owners[owner_id], revision)
 
-            #print("k:%s, v:%s" % (k, v))
+    return owners
 
-            workflow = get_workflow_by_id_and_version(v, workflow_version, owner_name=owner_name)
+
+def _decode_owner_workflows(owner_id, kvs):
+    workflow_name_id_prefix = _owner_workflows_prefix(owner_id)
+
+    workflows = []
+    for kv in sorted(kvs, key=lambda kv: kv.mod_revision):
+        k = kv.key.decode('utf-8').replace(workflow_name_id_prefix, '', 1)
+        if not k.endswith('/id'):
+            continue
+        try:
+            v = kv.value.decode("utf-8")
+        except:
+            continue  # not a valid workflow id
+
+        workflows.append((k[len('name:'):-len('/id')], v))
+
+    return workflows
+
+
+def get_workflows(owner_name=None, workflow_name=None, workflow_version=None):
+    owner_id = _get_owner_id_by_name(owner_name)
+
+    if owner_id:
+        workflows = []
+
+        workflow_ids = [workflow_id for name, workflow_id in _get_owner_workflows(owner_id)
+                        if not workflow_name or name == workflow_name]
+        decoded_workflows = _get_decoded_workflows(workflow_ids)
+
+        for workflow_id in workflow_ids:
+            decoded_workflow, revisions = decoded_workflows.get(workflow_id, (None, None))
+            workflow = _select_workflow_version(decoded_workflow, workflow_version, owner_name=owner_name)
 
             if workflow:
                 workflows.append(workflow)
@@ -91,22 +344,135 @@ def get_workflows(owner_name=None, workflow_name=None, workflow_version=None):
         raise OwnerNameNotFound(Exception("Specific owner name not found: %s" % owner_name))
 
 
-def get_workflow_by_id_and_version(workflow_id, workflow_version=None, owner_name=None):
-    workflow = {
-        "id": workflow_id
-    }
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(storage.to_bytes(key)).decode('ascii')
 
-    # ideally we don't read values yet, but python-etcd does not have this option
-    workflow_prefix = '/'.join([WRS_ETCD_ROOT, 'workflow', 'id:%s/' % workflow_id])
 
-    r2 = etcd_client.get_prefix(key_prefix=workflow_prefix, sort_target='mod')
+def _decode_cursor(cursor, key_prefix):
+    # cursor is the etcd key of the last workflow on the previous page
+    try:
+        key = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    except (ValueError, binascii.Error):
+        raise InvalidCursor(cursor)
 
-    workflow_version_found = False
+    if not key.startswith(key_prefix):
+        raise InvalidCursor(cursor)
+
+    return key
+
+
+def _get_workflow_entries(key_prefix, limit=None, after_key=None):
+    # (owner id, workflow name, workflow id) of the name -> id keys under key_prefix in etcd key
+    # order, starting after after_key. Also returns the key to continue from when there are more
+    range_start = after_key + '\0' if after_key else key_prefix
+    r = store.range(range_start, storage.prefix_end(key_prefix), limit=limit)
 
-    for value2, meta2 in r2:
-        k = meta2.key.decode('utf-8').replace(workflow_prefix, '', 1)
+    entries = []
+    for kv in r.kvs:
+        # /jt:wrs/owner.id:<owner_id>/workflow/name:<workflow_name>/id
+        parts = kv.key.decode('utf-8').replace(WRS_ETCD_ROOT, '', 1).strip('/').split('/')
+        if len(parts) != 4 or parts[3] != 'id':
+            continue
         try:
-            v = value2.decode("utf-8")
+            v = kv.value.decode("utf-8")
+        except:
+            continue  # not a valid workflow id
+
+        entries.append((parts[0].split(':', 1)[1], parts[2].split(':', 1)[1], v))
+
+    next_key = r.kvs[-1].key.decode('utf-8') if r.more and r.kvs else None
+
+    return entries, next_key
+
+
+def list_workflows(owner_name=None, limit=None, cursor=None, fields=None, versions='all'):
+    # one page of workflows in etcd key order (by owner id then workflow name) and the cursor of the
+    # next page, or None when this is the last one. fields limits the workflow attributes returned,
+    # versions is one of 'all', 'latest' (most recently registered) or 'none'
+    if versions not in LISTING_VERSIONS:
+        raise ValueError('versions must be one of: %s' % ', '.join(LISTING_VERSIONS))
+
+    if owner_name:
+        owner_id = _get_owner_id_by_name(owner_name)
+        if not owner_id:
+            raise OwnerNameNotFound(Exception("Specific owner name not found: %s" % owner_name))
+        key_prefix = '%s/owner.id:%s/workflow/name:' % (WRS_ETCD_ROOT, owner_id)
+    else:
+        key_prefix = '%s/owner.id:' % WRS_ETCD_ROOT
+
+    after_key = _decode_cursor(cursor, key_prefix) if cursor else None
+    limit = min(limit, MAX_PAGE_SIZE) if limit else None
+
+    if owner_name and not limit and not after_key:
+        entries = [(owner_id, name, workflow_id) for name, workflow_id in _get_owner_workflows(owner_id)]
+        next_key = None
+    else:
+        entries, next_key = _get_workflow_entries(key_prefix, limit=limit, after_key=after_key)
+
+    workflow_ids = [workflow_id for owner_id, name, workflow_id in entries]
+
+    latest_versions = {}
+    decoded_workflows = {}
+    if versions == 'latest':
+        # only the latest version of each workflow is read, found through the latest pointers
+        latest_versions = _get_latest_versions(workflow_ids)
+        decoded_versions = _get_decoded_workflow_versions(list(latest_versions.items()))
+        for (workflow_id, workflow_version), decoded in decoded_versions.items():
+            decoded_workflows[workflow_id] = decoded
+
+    missing_ids = [workflow_id for workflow_id in workflow_ids if workflow_id not in decoded_workflows]
+    decoded_workflows.update(_get_decoded_workflows(missing_ids, versions=versions != 'none'))
+
+    workflows = []
+    for owner_id, name, workflow_id in entries:
+        decoded_workflow, revisions = decoded_workflows.get(workflow_id, (None, None))
+        workflow = _project_workflow(decoded_workflow, revisions, fields=fields, versions=versions,
+                                     owner_name=owner_name, latest_version=latest_versions.get(workflow_id))
+        if workflow:
+            workflows.append(workflow)
+
+    return workflows, _encode_cursor(next_key) if next_key else None
+
+
+def _project_workflow(decoded_workflow, revisions, fields=None, versions='all', owner_name=None,
+                      latest_version=None):
+    if not decoded_workflow:
+        return
+
+    latest = None
+    if versions == 'latest' and latest_version:
+        latest = 'ver:%s' % latest_version
+    elif versions == 'latest':
+        version_revisions = [(r, k) for k, r in revisions.items() if k]
+        latest = max(version_revisions)[1] if version_revisions else None
+
+    # decoded workflow may be shared through the cache, only copy what is handed out
+    workflow = {}
+    for k, v in decoded_workflow.items():
+        if k.startswith('ver:'):
+            if versions == 'none' or (versions == 'latest' and k != latest):
+                continue
+        elif fields and k not in fields:
+            continue
+
+        workflow[k] = deepcopy(v)
+
+    if not fields or 'owner.name' in fields:
+        workflow['owner.name'] = owner_name or _get_owner_name_by_id(decoded_workflow.get('owner.id'))
+
+    return workflow
+
+
+def _decode_workflow(workflow_id, workflow_prefix, kvs):
+    # build workflow dict with all versions from the (key, value) pairs under workflow_prefix
+    workflow = {
+        "id": workflow_id
+    }
+
+    for key, value in kvs:
+        k = key.decode('utf-8').replace(workflow_prefix, '', 1)
+        try:
+            v = value.decode("utf-8")
         except:
             v = None  # assume binary value, deal with it later
         #print("k:%s, v:%s" % (k, v))
@@ -136,10 +502,6 @@ def get_workflow_by_id_and_version(workflow_id, workflow_version=None, owner_nam
 
         elif len(parts) == 2:
             ver_tag, ver = parts[0].split(':', 1)
-            if workflow_version and not workflow_version == ver:
-                continue
-            else:
-                workflow_version_found = True
 
             ver = 'ver:%s' % ver
             if ver_tag == 'ver' and not workflow.get(ver):
@@ -152,6 +514,334 @@ def get_workflow_by_id_and_version(workflow_id, workflow_version=None, owner_nam
                 if sub_type not in workflow[ver]: workflow[ver][sub_type] = []
                 workflow[ver][sub_type].append({sub_key: new_value})
 
+    return workflow
+
+
+def _workflow_prefix(workflow_id):
+    return '/'.join([WRS_ETCD_ROOT, 'workflow', 'id:%s/' % workflow_id])
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _metadata_key_runs(kvs):
+    # contiguous runs of keys (kvs in key order) that leave out file bodies, as ranges
+    runs = []
+    first = last = None
+    for kv in kvs:
+        if kv.key.rsplit(b'/', 1)[-1] in FILE_KEYS:
+            if first is not None:
+                runs.append((first, last + b'\0'))
+                first = None
+            continue
+
+        if first is None:
+            first = kv.key
+        last = kv.key
+
+    if first is not None:
+        runs.append((first, last + b'\0'))
+
+    return runs
+
+
+def _read_key_layout_workflows(workflow_ids, versions=True):
+    # decoded workflows in the per attribute key layout, in batched transactions: first the keys
+    # of all the workflows, then the values of everything but the (possibly large) file bodies.
+    # Returns them (with revisions) keyed by workflow id and the revision they were read at
+    workflows = {}
+    revision = None
+    for chunk in _chunks(workflow_ids, ETCD_TXN_MAX_OPS):
+        prefixes = [_workflow_prefix(workflow_id) for workflow_id in chunk]
+        key_ranges = [(storage.to_bytes(p), storage.prefix_end(p)) for p in prefixes]
+
+        workflow_keys, revision = store.ranges(key_ranges, keys_only=True)
+        if not versions:
+            workflow_keys = [[kv for kv in kvs if b'/' not in kv.key[len(start):]]
+                             for (start, end), kvs in zip(key_ranges, workflow_keys)]
+
+        value_ranges = []
+        for kvs in workflow_keys:
+            value_ranges += _metadata_key_runs(kvs)
+
+        values = {}
+        for value_chunk in _chunks(value_ranges, ETCD_TXN_MAX_OPS):
+            results, _ = store.ranges(value_chunk)
+            for kvs in results:
+                for kv in kvs:
+                    values[kv.key] = kv.value
+
+        for workflow_id, workflow_prefix, kvs in zip(chunk, prefixes, workflow_keys):
+            if not kvs:
+                continue
+
+            workflows[workflow_id] = _decode_key_layout(workflow_id, workflow_prefix, kvs, values)
+
+    return workflows, revision
+
+
+def _decode_key_layout(workflow_id, workflow_prefix, kvs, values=None):
+    # decoded workflow and its revisions from the keys under workflow_prefix. Values are
+    # looked up in values when given (keys read with keys_only), otherwise taken from the kvs.
+    # Keys are decoded in the order they were written
+    kvs = sorted(kvs, key=lambda kv: kv.mod_revision)
+    workflow = _decode_workflow(workflow_id, workflow_prefix,
+                                [(kv.key, kv.value if values is None else values.get(kv.key, b'')) for kv in kvs])
+
+    revisions = {None: 0}
+    for kv in kvs:
+        parts = kv.key.decode('utf-8').replace(workflow_prefix, '', 1).split('/')
+        ver = parts[0] if len(parts) == 2 else None
+        revisions[ver] = max(revisions.get(ver, 0), kv.mod_revision)
+
+    return workflow, revisions
+
+
+def _record_prefix(workflow_id):
+    return '%s/id:%s/' % (WRS_RECORD_ETCD_ROOT, workflow_id)
+
+
+def _header_record_key(workflow_id):
+    return storage.to_bytes(_record_prefix(workflow_id)) + records.HEADER_RECORD
+
+
+def _version_record_key(workflow_id, workflow_version):
+    return storage.to_bytes('%sver:%s' % (_record_prefix(workflow_id), workflow_version))
+
+
+def _read_workflow_records(workflow_ids, versions=True):
+    # same as _read_key_layout_workflows for workflows stored as records, one range per workflow.
+    # With versions, the version index of each workflow is read along: versions it lists without
+    # a record (not migrated yet, or registered in the per attribute key layout since) are read
+    # from their keys
+    workflows = {}
+    revision = None
+    unmigrated = {}  # workflow id -> versions without record
+    for chunk in _chunks(workflow_ids, ETCD_TXN_MAX_OPS // 2):
+        ranges = []
+        for workflow_id in chunk:
+            if versions:
+                record_prefix = storage.to_bytes(_record_prefix(workflow_id))
+                index_prefix = storage.to_bytes('%sver:' % _version_index_prefix(workflow_id))
+                ranges += [(record_prefix, storage.prefix_end(record_prefix)),
+                           (index_prefix, storage.prefix_end(index_prefix), True)]
+            else:
+                ranges.append((_header_record_key(workflow_id), _header_record_key(workflow_id) + b'\0'))
+
+        results, revision = store.ranges(ranges)
+        for i, workflow_id in enumerate(chunk):
+            workflow, revisions = records.decode(workflow_id, results[i * 2] if versions else results[i])
+            if not workflow:
+                continue
+
+            workflows[workflow_id] = (workflow, revisions)
+            if versions:
+                index_prefix = '%sver:' % _version_index_prefix(workflow_id)
+                indexed = ['ver:%s' % kv.key.decode('utf-8')[len(index_prefix):] for kv in results[i * 2 + 1]]
+                missing = [ver for ver in indexed if ver not in workflow]
+                if missing:
+                    unmigrated[workflow_id] = missing
+
+    if unmigrated:
+        key_layout_workflows, _ = _read_key_layout_workflows(list(unmigrated))
+        for workflow_id, missing in unmigrated.items():
+            key_layout_workflow, key_layout_revisions = key_layout_workflows.get(workflow_id, ({}, {}))
+            workflow, revisions = workflows[workflow_id]
+            for ver in missing:
+                if ver in key_layout_workflow:
+                    workflow[ver] = key_layout_workflow[ver]
+                    revisions[ver] = key_layout_revisions[ver]
+
+            # versions in the order they were written, as when decoded from one layout
+            merged = dict((k, v) for k, v in workflow.items() if not k.startswith('ver:'))
+            for ver in sorted((k for k in workflow if k.startswith('ver:')), key=lambda k: revisions[k]):
+                merged[ver] = workflow[ver]
+            workflows[workflow_id] = (merged, revisions)
+
+    return workflows, revision
+
+
+def _get_decoded_workflows(workflow_ids, versions=True):
+    # (decoded workflow, revisions) keyed by workflow id. revisions has the latest mod
+    # revision of the workflow's own keys under None and of each version under 'ver:<version>'.
+    # Cached ones come from the cache, the rest from the records and, for workflows not (yet)
+    # stored as records, from the per attribute keys. Without versions only the workflow's own
+    # attributes are read, such partial results are not cached
+    use_cache = _start_cache_watch()
+
+    workflows = {}
+    missing_ids = []
+    for workflow_id in workflow_ids:
+        decoded = workflow_cache.get(workflow_id) if use_cache else None
+        if decoded is None:
+            missing_ids.append(workflow_id)
+        else:
+            workflows[workflow_id] = decoded
+
+    reads = []
+    if missing_ids and STORAGE_LAYOUT != 'keys':
+        reads.append(_read_workflow_records(missing_ids, versions))
+        missing_ids = [workflow_id for workflow_id in missing_ids if workflow_id not in reads[-1][0]]
+    if missing_ids:
+        reads.append(_read_key_layout_workflows(missing_ids, versions))
+
+    for decoded_workflows, revision in reads:
+        workflows.update(decoded_workflows)
+        if use_cache and versions:
+            for workflow_id, decoded in decoded_workflows.items():
+                _cache_put(workflow_cache, workflow_id, decoded, revision)
+
+    return workflows
+
+
+def _version_index_prefix(workflow_id):
+    return '%s/id:%s/' % (WRS_INDEX_ETCD_ROOT, workflow_id)
+
+
+def _latest_version_key(workflow_id):
+    return '%slatest' % _version_index_prefix(workflow_id)
+
+
+def get_workflow_versions(workflow_id):
+    # versions in the order they were registered, from the version index
+    prefix = storage.to_bytes('%sver:' % _version_index_prefix(workflow_id))
+    r = store.range(prefix, storage.prefix_end(prefix), keys_only=True)
+    return [kv.key[len(prefix):].decode('utf-8') for kv in sorted(r.kvs, key=lambda kv: kv.create_revision)]
+
+
+def _get_latest_versions(workflow_ids):
+    # workflow id -> latest registered version, from the latest pointers, one get per workflow
+    # batched into transactions. Workflows without pointer (not yet backfilled) are left out
+    latest = {}
+    for chunk in _chunks(workflow_ids, ETCD_TXN_MAX_OPS):
+        keys = [storage.to_bytes(_latest_version_key(workflow_id)) for workflow_id in chunk]
+        results, _ = store.ranges([(k, k + b'\0') for k in keys])
+        for workflow_id, kvs in zip(chunk, results):
+            if kvs:
+                latest[workflow_id] = kvs[0].value.decode('utf-8')
+
+    return latest
+
+
+def get_latest_workflow_version(workflow_id):
+    return _get_latest_versions([workflow_id]).get(workflow_id)
+
+
+def _version_ranges(workflow_id, workflow_version):
+    # ranges covering the workflow's own keys and one of its versions, skipping other versions:
+    # own keys sorting before and after 'ver:', the version's metadata and (keys only) its file bodies
+    prefix = storage.to_bytes(_workflow_prefix(workflow_id))
+    ver_prefix = prefix + storage.to_bytes('ver:%s/' % workflow_version)
+    return [
+        (prefix, prefix + b'ver:', False),
+        (prefix + b'ver;', storage.prefix_end(prefix), False),
+        (ver_prefix, ver_prefix + FILE_KEY_PREFIX, False),
+        (ver_prefix + FILE_KEY_PREFIX, storage.prefix_end(ver_prefix), True)
+    ]
+
+
+def _read_key_layout_versions(workflow_versions):
+    # (decoded workflow, revisions) keyed by (workflow id, version) in the per attribute key layout,
+    # the workflow's own keys and only the requested version are read, in one transaction per batch
+    workflows = {}
+    for chunk in _chunks(workflow_versions, ETCD_TXN_MAX_OPS // 4):
+        ranges = []
+        for workflow_id, workflow_version in chunk:
+            ranges += _version_ranges(workflow_id, workflow_version)
+
+        results, _ = store.ranges(ranges)
+
+        for i, (workflow_id, workflow_version) in enumerate(chunk):
+            own_kvs = list(results[i * 4]) + list(results[i * 4 + 1])
+            version_kvs = list(results[i * 4 + 2]) + list(results[i * 4 + 3])
+            if not version_kvs:
+                continue
+
+            workflow_prefix = _workflow_prefix(workflow_id)
+            kvs = sorted(own_kvs + version_kvs, key=lambda kv: kv.mod_revision)
+            workflow = _decode_workflow(workflow_id, workflow_prefix, [(kv.key, kv.value) for kv in kvs])
+
+            revisions = {
+                None: max([kv.mod_revision for kv in own_kvs] or [0]),
+                'ver:%s' % workflow_version: max(kv.mod_revision for kv in version_kvs)
+            }
+
+            workflows[(workflow_id, workflow_version)] = (workflow, revisions)
+
+    return workflows
+
+
+def _read_version_records(workflow_versions):
+    # same as _read_key_layout_versions for workflows stored as records, two gets per version.
+    # A version without record is left out even if the workflow has one, it may not be migrated yet
+    workflows = {}
+    for chunk in _chunks(workflow_versions, ETCD_TXN_MAX_OPS // 2):
+        ranges = []
+        for workflow_id, workflow_version in chunk:
+            for key in (_header_record_key(workflow_id), _version_record_key(workflow_id, workflow_version)):
+                ranges.append((key, key + b'\0'))
+
+        results, _ = store.ranges(ranges)
+
+        for i, (workflow_id, workflow_version) in enumerate(chunk):
+            if not results[i * 2 + 1]:
+                continue
+
+            workflow, revisions = records.decode(workflow_id, list(results[i * 2]) + list(results[i * 2 + 1]))
+            if workflow:
+                workflows[(workflow_id, workflow_version)] = (workflow, revisions)
+
+    return workflows
+
+
+def _get_decoded_workflow_versions(workflow_versions):
+    # (decoded workflow, revisions) keyed by (workflow id, version), for the versions that exist.
+    # A cached workflow is used as is (it has all versions), otherwise only the workflow's own
+    # attributes and the requested version are read
+    use_cache = _start_cache_watch()
+
+    workflows = {}
+    missing = []
+    for workflow_id, workflow_version in workflow_versions:
+        decoded = workflow_cache.get(workflow_id) if use_cache else None
+        if decoded is None:
+            missing.append((workflow_id, workflow_version))
+        elif 'ver:%s' % workflow_version in decoded[1]:
+            workflows[(workflow_id, workflow_version)] = decoded
+
+    if missing and STORAGE_LAYOUT != 'keys':
+        workflows.update(_read_version_records(missing))
+        missing = [key for key in missing if key not in workflows]
+    if missing:
+        workflows.update(_read_key_layout_versions(missing))
+
+    return workflows
+
+
+def _get_decoded_workflow(workflow_id, workflow_version=None):
+    if workflow_version:
+        return _get_decoded_workflow_versions([(workflow_id, workflow_version)]).get((workflow_id, workflow_version),
+                                                                                     (None, None))
+    return _get_decoded_workflows([workflow_id]).get(workflow_id, (None, None))
+
+
+def _select_workflow_version(decoded_workflow, workflow_version=None, owner_name=None):
+    if not decoded_workflow:
+        return
+
+    # decoded workflow may be shared through the cache, hand out a copy
+    workflow = {}
+    workflow_version_found = False
+    for k, v in decoded_workflow.items():
+        if k.startswith('ver:'):
+            if workflow_version and not k == 'ver:%s' % workflow_version:
+                continue
+            workflow_version_found = True
+
+        workflow[k] = deepcopy(v)
+
     if workflow_version_found:
         if owner_name:
             workflow['owner.name'] = owner_name
@@ -160,12 +850,125 @@ def get_workflow_by_id_and_version(workflow_id, workflow_version=None, owner_nam
         return workflow
 
 
+def get_workflow_by_id_and_version(workflow_id, workflow_version=None, owner_name=None):
+    decoded_workflow, revisions = _get_decoded_workflow(workflow_id, workflow_version)
+    return _select_workflow_version(decoded_workflow, workflow_version, owner_name=owner_name)
+
+
 def get_workflow(owner_name, workflow_name, workflow_version=None):
-    workflow = get_workflows(owner_name, workflow_name, workflow_version)
-    if workflow and workflow_version and 'ver:%s' % workflow_version not in workflow[0]:
+    owner_id = _get_owner_id_by_name(owner_name)
+    if not owner_id:
+        raise OwnerNameNotFound(Exception("Specific owner name not found: %s" % owner_name))
+
+    workflow_id = _get_workflow_id_by_owner_id_and_workflow_name(owner_id, workflow_name)
+    if workflow_id:
+        return get_workflow_by_id_and_version(workflow_id, workflow_version, owner_name=owner_name)
+
+
+def _lookup_key(entry):
+    # <owner name>/<workflow name>[/<version>] or id:<workflow id>[/<version>]
+    if entry.get('id'):
+        key = 'id:%s' % entry['id']
+    else:
+        key = '%s/%s' % (entry.get('owner.name'), entry.get('name'))
+    return '%s/%s' % (key, entry['version']) if entry.get('version') else key
+
+
+def lookup_workflows(entries):
+    # many workflows in one go, each entry is {'owner.name', 'name', 'version'} or {'id', 'version'},
+    # without version for all versions. Returns the workflow, or {'error': ...} when it can't be
+    # found, keyed by _lookup_key of the entry. Each owner is resolved once and the registry is
+    # read in batched transactions
+    if len(entries) > MAX_LOOKUP_SIZE:
+        raise InvalidLookup('no more than %s workflows per lookup' % MAX_LOOKUP_SIZE)
+
+    results = {}
+    named = {}  # key -> (owner name, workflow name, version)
+    by_id = {}  # key -> (workflow id, version)
+    for entry in entries:
+        if not entry.get('id') and not (entry.get('owner.name') and entry.get('name')):
+            raise InvalidLookup('either id, or owner.name and name are required')
+
+        # keys join the fields with '/', eg, 'id:<workflow id>/<version>', a '/' in a field
+        # would make it another entry's key (and another registry path)
+        for field in ('id', 'owner.name', 'name', 'version'):
+            if '/' in str(entry.get(field) or ''):
+                raise InvalidLookup("%s must not contain '/': %s" % (field, entry[field]))
+
+        key = _lookup_key(entry)
+        if entry.get('id'):
+            by_id[key] = (entry['id'], entry.get('version'))
+        else:
+            named[key] = (entry['owner.name'], entry['name'], entry.get('version'))
+
+    owner_ids = owner_resolver.get_ids_by_names([owner_name for owner_name, _, _ in named.values()])
+    owners_workflows = _get_owners_workflows([owner_id for owner_id in owner_ids.values()
+                                              if owner_id and not isinstance(owner_id, Exception)])
+
+    owner_names = {}  # owner id -> owner name, or the exception resolving it
+    for key, (owner_name, workflow_name, workflow_version) in named.items():
+        owner_id = owner_ids[owner_name]
+        if not owner_id or isinstance(owner_id, Exception):
+            results[key] = {'error': str(owner_id or OwnerNameNotFound(owner_name))}
+            continue
+
+        owner_names[owner_id] = owner_name
+        workflow_id = next((i for name, i in owners_workflows[owner_id] if name == workflow_name), None)
+        if workflow_id:
+            by_id[key] = (workflow_id, workflow_version)
+        else:
+            results[key] = {'error': 'No workflow found'}
+
+    versions = _get_decoded_workflow_versions(list(set(v for v in by_id.values() if v[1])))
+    workflows = _get_decoded_workflows(list(set(workflow_id for workflow_id, v in by_id.values() if not v)))
+
+    decoded = {}
+    for key, (workflow_id, workflow_version) in by_id.items():
+        decoded[key] = (versions.get((workflow_id, workflow_version)) if workflow_version
+                        else workflows.get(workflow_id), workflow_version)
+
+    owner_names.update(owner_resolver.get_names_by_ids(set(
+        d[0].get('owner.id') for d, v in decoded.values() if d and d[0].get('owner.id') not in owner_names)))
+
+    for key, (d, workflow_version) in decoded.items():
+        workflow = None
+        if d:
+            owner_name = owner_names.get(d[0].get('owner.id'))
+            if isinstance(owner_name, Exception):
+                results[key] = {'error': str(owner_name)}
+                continue
+            workflow = _select_workflow_version(d[0], workflow_version, owner_name=owner_name)
+
+        results[key] = workflow or {'error': 'No workflow found'}
+
+    return results
+
+
+def get_workflow_etag_by_id(workflow_id, workflow_version=None, resource='workflow', owner=None):
+    # etag of a workflow (or one of its versions), derived from etcd mod revisions, so it can be
+    # checked without building the response. None when the workflow/version does not exist
+    decoded_workflow, revisions = _get_decoded_workflow(workflow_id, workflow_version)
+    if not revisions:
         return
-    elif workflow:
-        return workflow[0]
+
+    if workflow_version:
+        if 'ver:%s' % workflow_version not in revisions:
+            return
+        revision = max(revisions[None], revisions['ver:%s' % workflow_version])
+    elif len(revisions) > 1:  # has at least one version
+        revision = max(revisions.values())
+    else:
+        return
+
+    return hashlib.sha1(('%s|%s|%s|%s|%s' % (workflow_id, workflow_version or '', resource, revision,
+                                             owner or decoded_workflow.get('owner.id'))).encode('utf-8')).hexdigest()
+
+
+def get_workflow_etag(owner_name, workflow_name, workflow_version=None, resource='workflow'):
+    owner_id = _get_owner_id_by_name(owner_name)
+    workflow_id = _get_workflow_id_by_owner_id_and_workflow_name(owner_id, workflow_name)
+    if workflow_id:
+        return get_workflow_etag_by_id(workflow_id, workflow_version, resource, owner=owner_name)
 
 
 def get_file(owner_name, workflow_name, workflow_version, file_type):
@@ -178,30 +981,77 @@ def get_file(owner_name, workflow_name, workflow_version, file_type):
         workflow_id = _get_workflow_id_by_owner_id_and_workflow_name(owner_id, workflow_name)
         #print(workflow_id)
         if workflow_id:
-            v, meta = etcd_client.get('%s/workflow/id:%s/ver:%s/%s' %
-                                      (WRS_ETCD_ROOT, workflow_id, workflow_version, file_type))
-            if v:
-                return v.decode("utf-8") if file_type == 'workflowfile' else v
+            return _get_file_by_workflow_id(workflow_id, workflow_version, file_type)
+
+
+def _get_file_by_workflow_id(workflow_id, workflow_version, file_type):
+    v = store.get('%s/workflow/id:%s/ver:%s/%s' % (WRS_ETCD_ROOT, workflow_id, workflow_version, file_type))
+    if v:
+        return v.decode("utf-8") if file_type == 'workflowfile' else v
 
 
 def get_workflowfile(owner_name, workflow_name, workflow_version):
     return get_file(owner_name, workflow_name, workflow_version, 'workflowfile')
 
 
+def _package_chunk_key(chunk_hash):
+    return '%s/chunk/sha256:%s' % (WRS_PACKAGE_ETCD_ROOT, chunk_hash)
+
+
+def _store_workflow_package(archive):
+    # store the chunks of the archive's workflow directory not yet in etcd, returns the manifest
+    manifest = package.build_manifest(archive)
+
+    chunk_hashes = sorted(set(h for f in manifest['files'] for h in f['chunks']))
+    chunk_keys = [storage.to_bytes(_package_chunk_key(h)) for h in chunk_hashes]
+
+    existing_keys = set()
+    for keys in _chunks(chunk_keys, ETCD_TXN_MAX_OPS):
+        results, _ = store.ranges([(k, k + b'\0') for k in keys], keys_only=True)
+        existing_keys.update(kv.key for kvs in results for kv in kvs)
+
+    missing = [h for h, k in zip(chunk_hashes, chunk_keys) if k not in existing_keys]
+    for chunk_hash, data in package.iter_compressed_chunks(archive, manifest, missing):
+        store.put_if_missing(_package_chunk_key(chunk_hash), data)  # someone else may have just stored it
+
+    return manifest
+
+
+def _get_package_chunks(chunk_hashes):
+    keys = [storage.to_bytes(_package_chunk_key(h)) for h in chunk_hashes]
+    results, _ = store.ranges([(k, k + b'\0') for k in keys])
+
+    chunks = []
+    for chunk_hash, kvs in zip(chunk_hashes, results):
+        if not kvs:
+            raise Exception('Workflow package chunk missing: %s' % chunk_hash)
+        chunks.append(kvs[0].value)
+
+    return chunks
+
+
 def get_workflow_package(owner_name, workflow_name, workflow_version):
-    return get_file(owner_name, workflow_name, workflow_version, 'workflow_package')
+    # tar.gz stream of the workflow package, built from the stored chunks while it's sent
+    manifest = get_file(owner_name, workflow_name, workflow_version, 'workflow_package')
+    if manifest:
+        return package.iter_package(json.loads(manifest.decode('utf-8')), _get_package_chunks,
+                                    batch_size=PACKAGE_FETCH_BATCH)
 
 
-def get_jobjson_template(owner_name, workflow_name, workflow_version, jobjson):
-    pass
+def get_jobjson_template(owner_name, workflow_name, workflow_version):
+    jt = get_compiled_workflow(owner_name, workflow_name, workflow_version)
+    if jt:
+        return jt.job_json_template
 
 
-def register_workflow(owner_name, workflow_entry):
+def _check_workflow_entry(owner_name, workflow_entry):
+    # cheap checks done before a registration is queued and again when it runs
     owner_id = _get_owner_id_by_name(owner_name)
 
     # lots of validation/error check need to happen, do it later
     workflow_name = workflow_entry.get('name')
     workflow_version = workflow_entry.get('version')
+    git_tag = workflow_entry.get('git_tag')
 
     # make sure same workflow name/version does not exist for the same owner
     # not to allow this for now, later will need to consider user update a previously
@@ -209,102 +1059,349 @@ def register_workflow(owner_name, workflow_entry):
     if get_workflow(owner_name, workflow_name, workflow_version):
         raise Exception('Same workflow already registered.')
 
+    if workflow_version != git_tag and '%s.%s' % (workflow_name, workflow_version) != git_tag:
+        raise Exception('Workflow version must match git tag.')
+
+    return owner_id
+
+
+def submit_registration(owner_name, workflow_entry):
+    _check_workflow_entry(owner_name, workflow_entry)
+    return registration_queue.submit(owner_name, workflow_entry)
+
+
+def get_registration(registration_id, wait=0):
+    return registration_queue.get(registration_id, wait=wait)
+
+
+def _registration_key(registration_id):
+    return '%s/id:%s' % (WRS_REGISTRATION_ETCD_ROOT, registration_id)
+
+
+def _registration_claim_key(registration):
+    return '%s/pending/%s' % (WRS_REGISTRATION_ETCD_ROOT, '/'.join(str(k) for k in registration.key))
+
+
+def _save_registration(registration):
+    ops = [storage.Put(_registration_key(registration.id), json.dumps(registration.to_dict()), ttl=REGISTRATION_KEEP)]
+    if registration.done:
+        ops.append(storage.Delete(_registration_claim_key(registration)))
+    store.transaction([], ops)
+
+
+def _load_registration(registration_id):
+    v = store.get(_registration_key(registration_id))
+    return Registration.from_dict(json.loads(v.decode('utf-8'))) if v else None
+
+
+def _claim_registration(registration):
+    # None once claimed, or the registration holding the claim. The claim is saved along with the
+    # registration, a claim found with its registration done (or gone) is being released, tried again
+    key = _registration_claim_key(registration)
+    for attempt in range(3):
+        if store.transaction([storage.Missing(key)],
+                             [storage.Put(key, registration.id, ttl=REGISTRATION_CLAIM_TTL),
+                              storage.Put(_registration_key(registration.id), json.dumps(registration.to_dict()),
+                                          ttl=REGISTRATION_KEEP)]):
+            return None
+
+        v = store.get(key)
+        pending = _load_registration(v.decode('utf-8')) if v else None
+        if pending and not pending.done:
+            return pending
+
+    raise Exception('Same workflow registration is being claimed, please retry.')
+
+
+def register_workflow(owner_name, workflow_entry):
+    owner_id = _check_workflow_entry(owner_name, workflow_entry)
+
+    workflow_name = workflow_entry.get('name')
+    workflow_version = workflow_entry.get('version')
+
     git_server = workflow_entry.get('git_server')
     git_account = workflow_entry.get('git_account')
     git_repo = workflow_entry.get('git_repo')
     git_tag = workflow_entry.get('git_tag')
     git_path = workflow_entry.get('git_path')
 
-    if workflow_version != git_tag and '%s.%s' % (workflow_name, workflow_version) != git_tag:
-        raise Exception('Workflow version must match git tag.')
-
     git_download_url = "%s/%s/%s/archive/%s.zip" % (git_server, git_account,
                                                     git_repo, git_tag)
 
-    tmp_dir = tempfile.mkdtemp()
-    request = requests.get(git_download_url)
-    zfile = zipfile.ZipFile(BytesIO(request.content))
-    zfile.extractall(tmp_dir)
-
-    source_workflow_path = os.path.join(tmp_dir, '%s-%s' % (git_repo, git_tag), git_path, 'workflow')
+    workflow_dir = '%s-%s/%s/workflow' % (git_repo, git_tag, git_path)
 
-    # load entry point workflow file
     workflow_file_yaml = None
-    for ep in ['main.jt', 'main.yaml', '%s.jt.yaml' % workflow_name]:
-        try:
-            with open(os.path.join(source_workflow_path, ep), 'r') as f:
-                workflow_file_yaml = f.read()
-            break
-        except IOError:
-            continue  # if failed, try next one
-
-    try:  # validate workflow file by create a JT object
-        jt = JTracker(workflow_yaml_string=workflow_file_yaml)
-    except Exception as err:
-        print(str(err))
-        raise InvalidJTWorkflowFile
+    with WorkflowArchive(git_download_url, workflow_dir, max_bytes=ARCHIVE_MAX_BYTES,
+                         spool_bytes=ARCHIVE_SPOOL_BYTES, timeout=ARCHIVE_TIMEOUT) as archive:
+        # load entry point workflow file
+        for ep in ['main.jt', 'main.yaml', '%s.jt.yaml' % workflow_name]:
+            content = archive.read(ep)
+            if content is not None:
+                workflow_file_yaml = content.decode('utf-8')
+                break
+
+        try:  # validate workflow file by create a JT object
+            jt = JTracker(workflow_yaml_string=workflow_file_yaml)
+        except Exception as err:
+            print(str(err))
+            raise InvalidJTWorkflowFile
+
+        workflow_package = json.dumps(_store_workflow_package(archive))
 
     # workflow entry etcd key
     # /jt:wrs/owner.id:7ebf7fa9-f70f-481a-a499-5fba3f8c5078/workflow/name:test/id
     workflow_entry_etcd_key = '%s/owner.id:%s/workflow/name:%s/id' % (WRS_ETCD_ROOT,
                                                                       owner_id,  workflow_name)
-    # check whether the workflow exists already and this is to register a new version
-    v, meta = etcd_client.get(workflow_entry_etcd_key)
-    if v:
-        workflow_id = v.decode("utf-8")
-    else:
-        workflow_id = str(uuid.uuid4())
-
-    workflow_property_key_prefix = '%s/workflow/id:%s' % (WRS_ETCD_ROOT, workflow_id)
-
-    # now write to etcd
-    etcd_client.transaction(
-        compare=[
-            etcd_client.transactions.version(workflow_entry_etcd_key) > 0,  # test key exists
-        ],
-        success=[  # this is for additional new versions of the workflow
-            etcd_client.transactions.put('%s/ver:%s/%s' % (workflow_property_key_prefix,
-                                                           workflow_version, 'git_path'),
-                                         git_path),
-            etcd_client.transactions.put('%s/ver:%s/%s' % (workflow_property_key_prefix,
-                                                           workflow_version, 'git_tag'),
-                                         git_tag),
-            etcd_client.transactions.put('%s/ver:%s/%s' % (workflow_property_key_prefix,
-                                                           workflow_version, 'workflowfile'),
-                                         workflow_file_yaml)
-        ],
-        failure=[
-            etcd_client.transactions.put(workflow_entry_etcd_key, workflow_id),
-            etcd_client.transactions.put('%s/%s' % (workflow_property_key_prefix, 'workflow_type'), 'JTracker'),
-            etcd_client.transactions.put('%s/%s' % (workflow_property_key_prefix, 'git_account'), git_account),
-            etcd_client.transactions.put('%s/%s' % (workflow_property_key_prefix, 'git_repo'), git_repo),
-            etcd_client.transactions.put('%s/%s' % (workflow_property_key_prefix, 'name'), workflow_name),
-            etcd_client.transactions.put('%s/%s' % (workflow_property_key_prefix, 'owner.id'), owner_id),
-            etcd_client.transactions.put('%s/ver:%s/%s' % (workflow_property_key_prefix,
-                                                           workflow_version, 'git_path'),
-                                         git_path),
-            etcd_client.transactions.put('%s/ver:%s/%s' % (workflow_property_key_prefix,
-                                                           workflow_version, 'git_tag'),
-                                         git_tag),
-            etcd_client.transactions.put('%s/ver:%s/%s' % (workflow_property_key_prefix,
-                                                           workflow_version, 'workflowfile'),
-                                         workflow_file_yaml)
+
+    workflow_attributes = {
+        'workflow_type': 'JTracker',
+        'git_account': git_account,
+        'git_repo': git_repo,
+        'name': workflow_name,
+        'owner.id': owner_id
+    }
+    version_attributes = {
+        'git_path': git_path,
+        'git_tag': git_tag
+    }
+    version_files = {
+        'workflowfile': workflow_file_yaml,
+        'workflow_package': workflow_package
+    }
+
+    # check whether the workflow exists already and this is to register a new version. Another
+    # registration can add the workflow meanwhile (eg, of another version), then this one is
+    # written again as a new version of it, under its id
+    while True:
+        v = store.get(workflow_entry_etcd_key)
+        workflow_exists = bool(v)
+        if workflow_exists:
+            workflow_id = v.decode("utf-8")
+        else:
+            workflow_id = str(uuid.uuid4())
+
+        workflow_property_key_prefix = '%s/workflow/id:%s' % (WRS_ETCD_ROOT, workflow_id)
+        version_index_key = '%sver:%s' % (_version_index_prefix(workflow_id), workflow_version)
+        latest_version_key = _latest_version_key(workflow_id)
+
+        # file bodies are always in their own keys, attributes in per attribute keys and/or records
+        version_ops = [storage.Put('%s/ver:%s/%s' % (workflow_property_key_prefix, workflow_version, k), v)
+                       for k, v in version_files.items()]
+        workflow_ops = []
+        if STORAGE_LAYOUT != 'records':
+            version_ops += [storage.Put('%s/ver:%s/%s' % (workflow_property_key_prefix, workflow_version, k), v)
+                            for k, v in version_attributes.items()]
+            workflow_ops += [storage.Put('%s/%s' % (workflow_property_key_prefix, k), v)
+                             for k, v in workflow_attributes.items()]
+        if STORAGE_LAYOUT != 'keys':
+            version_ops.append(storage.Put(_version_record_key(workflow_id, workflow_version),
+                                           records.encode_version(version_attributes, version_files)))
+            workflow_ops.append(storage.Put(_header_record_key(workflow_id), records.encode_header(workflow_attributes)))
+            if workflow_exists and store.get(_header_record_key(workflow_id)) is None:
+                # a new version of a workflow from before records, its own record must exist first
+                migrate_workflow_record(workflow_id)
+
+        version_ops += [
+            storage.Put(version_index_key, ''),
+            storage.Put(latest_version_key, workflow_version)
         ]
-    )
 
-    return get_workflow(owner_name, workflow_name, workflow_version)
+        if workflow_exists and store.get(version_index_key) is not None:
+            raise Exception('Same workflow already registered.')
 
+        # now write to the registry store, the id of a workflow never changes once written and
+        # a version is written once
+        if workflow_exists:
+            written = store.transaction(compare=[storage.Exists(workflow_entry_etcd_key),
+                                                 storage.Missing(version_index_key)],
+                                        success=version_ops)  # this is for additional new versions of the workflow
+        else:
+            written = store.transaction(compare=[storage.Missing(workflow_entry_etcd_key)],
+                                        success=[storage.Put(workflow_entry_etcd_key, workflow_id)] +
+                                        workflow_ops + version_ops)
+        if written:
+            break
 
-def get_execution_plan(owner_name, workflow_name, workflow_version, job_json):
     workflow = get_workflow(owner_name, workflow_name, workflow_version)
-    workflowfile = get_workflowfile(owner_name, workflow_name, workflow_version)
+    if not workflow:
+        raise Exception('Workflow registered but could not be read back.')
+
+    return workflow
+
+
+def migrate_workflow_record(workflow_id):
+    # write the records of a workflow stored in per attribute keys, records already there are
+    # kept. Readers take a workflow with a header record for migrated, so the header goes last,
+    # once all version records are there. Returns the number of records written
+    decoded, _ = _read_key_layout_workflows([workflow_id])
+    if workflow_id not in decoded:
+        return 0
+
+    workflow_attributes, versions = records.split_workflow(decoded[workflow_id][0])
+
+    record_puts = []
+    for workflow_version, (version_attributes, files) in versions.items():
+        record_puts.append((_version_record_key(workflow_id, workflow_version),
+                            records.encode_version(version_attributes, files)))
+    record_puts.append((_header_record_key(workflow_id), records.encode_header(workflow_attributes)))
+
+    prefix = _record_prefix(workflow_id)
+    existing = set(kv.key for kv in store.range(prefix, storage.prefix_end(prefix), keys_only=True).kvs)
+    record_puts = [(key, record) for key, record in record_puts if key not in existing]
+
+    # in transactions of up to ETCD_TXN_MAX_OPS records, the header in the last one. Records
+    # written meanwhile (eg, by a registration) are kept, a transaction finding any of its
+    # records there writes the others one at a time
+    written = 0
+    for i in range(0, len(record_puts), ETCD_TXN_MAX_OPS):
+        chunk = record_puts[i:i + ETCD_TXN_MAX_OPS]
+        if store.transaction([storage.Missing(key) for key, _ in chunk],
+                             [storage.Put(key, record) for key, record in chunk]):
+            written += len(chunk)
+        else:
+            written += sum(1 for key, record in chunk if store.put_if_missing(key, record))
 
-    if workflow.get('workflow_type') == 'JTracker':
-        jt = JTracker(workflow_yaml_string=workflowfile)
-        return jt.get_execution_plan(job_json)
-    else:
+    return written
+
+
+def _compile_workflow(workflow_id, workflow_version, owner_name):
+    workflow = get_workflow_by_id_and_version(workflow_id, workflow_version, owner_name=owner_name)
+    if not workflow:
+        return
+
+    if workflow.get('workflow_type') != 'JTracker':
         raise NotImplementedError('Workflow types other than JTracker are not implemented yet')
 
+    workflowfile = _get_file_by_workflow_id(workflow_id, workflow_version, 'workflowfile')
+    with metrics.timed(metrics.WORKFLOW_COMPILE_LATENCY):
+        jt = JTracker(workflow_yaml_string=workflowfile, timer=tracing.span)
+    compiled_workflow_cache.put((workflow_id, workflow_version), jt)
+
+    return jt
+
+
+def _get_compiled_workflow_by_id(workflow_id, workflow_version, owner_name=None):
+    key = (workflow_id, workflow_version)
+    jt = compiled_workflow_cache.get(key)
+    if jt is None:
+        jt = _compile_flight.do(key, _compile_workflow, workflow_id, workflow_version, owner_name)
+
+    return jt
+
+
+def get_compiled_workflow(owner_name, workflow_name, workflow_version):
+    # JTracker object ready for job expansion, parsed at most once per version
+    owner_id = _get_owner_id_by_name(owner_name)
+    workflow_id = _get_workflow_id_by_owner_id_and_workflow_name(owner_id, workflow_name)
+    if workflow_id:
+        return _get_compiled_workflow_by_id(workflow_id, workflow_version, owner_name)
+
+
+def _observe_plan(jt, plan):
+    metrics.observe_plan(plan.get('tasks', []), [t.name for t in jt.workflow.task_templates if t.is_scatter])
+
+
+def _plan_cache_key(workflow_id, workflow_version, job_json, expand=True):
+    # job JSONs differing only in key order or formatting share plans. Taken before the plan
+    # is generated, which adds defaults to the job JSON
+    canonical = json.dumps(job_json, sort_keys=True, separators=(',', ':'))
+    return workflow_id, workflow_version, expand, hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _with_graph(plan):
+    # plan with its task dependency graph (see plan_graph) under '_graph', cached plans are
+    # shared so it goes on a copy. Raises InvalidTaskDependency for cycles and dangling dependencies
+    with tracing.span('graph'):
+        graph = plan_graph(plan.get('tasks', []))
+
+    plan = dict(plan)
+    plan['_graph'] = graph
+    return plan
+
+
+def get_execution_plan(owner_name, workflow_name, workflow_version, job_json, graph=False, expand=True):
+    # cached plans are shared, not to be modified. Without expand scatter tasks are not
+    # expanded into one task per item (see Job.iter_compact_tasks)
+    owner_id = _get_owner_id_by_name(owner_name)
+    workflow_id = _get_workflow_id_by_owner_id_and_workflow_name(owner_id, workflow_name)
+    if not workflow_id:
+        return
+
+    key = _plan_cache_key(workflow_id, workflow_version, job_json, expand)
+    plan = plan_cache.get(key)
+    if plan is None:
+        jt = _get_compiled_workflow_by_id(workflow_id, workflow_version, owner_name)
+        if not jt:
+            return
+
+        with tracing.span('expand'), metrics.timed(metrics.PLAN_LATENCY, mode='single'):
+            plan = jt.get_execution_plan(job_json, expand=expand)
+        if expand:
+            _observe_plan(jt, plan)
+        plan_cache.put(key, plan)
+
+    return _with_graph(plan) if graph else plan
+
+
+def iter_execution_plan(owner_name, workflow_name, workflow_version, job_json, expand=True):
+    # lazily generated plan, the job (without tasks) first followed by one task at a time
+    jt = get_compiled_workflow(owner_name, workflow_name, workflow_version)
+    if jt:
+        return jt.iter_execution_plan(job_json, expand=expand)
+
+
+def get_execution_plans(owner_name, workflow_name, workflow_version, job_jsons, graph=False, expand=True):
+    # workflow is resolved once for the whole batch, plans are expanded in the worker pool
+    owner_id = _get_owner_id_by_name(owner_name)
+    workflow_id = _get_workflow_id_by_owner_id_and_workflow_name(owner_id, workflow_name)
+    if not workflow_id:
+        return
+
+    keys = [_plan_cache_key(workflow_id, workflow_version, job_json, expand) for job_json in job_jsons]
+    results = []
+    for key in keys:
+        plan = plan_cache.get(key)
+        results.append({'job_execution_plan': plan} if plan is not None else None)
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        jt = _get_compiled_workflow_by_id(workflow_id, workflow_version, owner_name)
+        if not jt:
+            return
+
+        with tracing.span('expand'), metrics.timed(metrics.PLAN_LATENCY, mode='batch'):
+            expanded = plan_pool.expand((workflow_id, workflow_version), jt, [job_jsons[i] for i in missing],
+                                        expand=expand)
+        for i, result in zip(missing, expanded):
+            if 'job_execution_plan' in result:
+                if expand:
+                    _observe_plan(jt, result['job_execution_plan'])
+                plan_cache.put(keys[i], result['job_execution_plan'])
+            results[i] = result
+
+    if graph:
+        for i, result in enumerate(results):
+            if 'job_execution_plan' in result:
+                try:
+                    results[i] = {'job_execution_plan': _with_graph(result['job_execution_plan'])}
+                except InvalidTaskDependency as err:
+                    results[i] = {'error': 'Failed generating execution plan: %s' % str(err)}
+
+    return results
+
+
+def validate_job_jsons(owner_name, workflow_name, workflow_version, job_jsons):
+    # checked against the compiled validator of the workflow version, no plan is generated
+    jt = get_compiled_workflow(owner_name, workflow_name, workflow_version)
+    if not jt:
+        return
+
+    results = []
+    for job_json in job_jsons:
+        errors = jt.job_json_errors(job_json)
+        results.append({'valid': False, 'errors': errors} if errors else {'valid': True})
+    return results
+
 
 def update_owner():
     pass
@@ -0,0 +1,103 @@
+import io
+import os
+import uuid
+import zipfile
+import pytest
+
+# wrs picks its registry store when imported, tests give it one of their own
+os.environ.setdefault('WRS_STORAGE_ENGINE', 'memory')
+
+from jt_wrs import storage, wrs
+from jt_wrs.archive import WorkflowArchive
+
+# etcd to run the storage tests against as well, ie, WRS_TEST_ETCD_ENDPOINTS=localhost:2379
+TEST_ETCD_ENDPOINTS = os.environ.get('WRS_TEST_ETCD_ENDPOINTS')
+
+
+@pytest.fixture(params=['memory', 'etcd'])
+def kv_store(request):
+    if request.param == 'etcd':
+        if not TEST_ETCD_ENDPOINTS:
+            pytest.skip('WRS_TEST_ETCD_ENDPOINTS not set')
+        return storage.EtcdStore(storage.parse_endpoints(TEST_ETCD_ENDPOINTS))
+
+    return storage.SQLiteStore(':memory:')
+
+
+@pytest.fixture
+def prefix(kv_store):
+    # keys of each test kept apart, an etcd cluster outlives the test run
+    return '/jt:wrs-test/%s/' % uuid.uuid4().hex
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # wrs on an empty in-memory store, with empty caches
+    monkeypatch.setattr(wrs, 'store', storage.SQLiteStore(':memory:'))
+    monkeypatch.setattr(wrs, '_cache_watch_id', None)
+    for cache in (wrs.workflow_cache, wrs.owner_workflow_cache, wrs.compiled_workflow_cache, wrs.plan_cache):
+        cache.clear()
+
+    return wrs.store
+
+
+WORKFLOW = '''
+workflow:
+  name: wf
+  version: "%s"
+  input:
+    samples:
+      type: array
+  tasks:
+    per_sample:
+      scatter:
+        input:
+          sample:
+            with_items: samples
+            task_suffix: sample.id
+      tasks:
+        hello:
+          tool: echo
+          input:
+            file: sample.file
+tools:
+  echo:
+    command: echo
+'''
+
+OWNERS = {'alice': 'o1', 'bob': 'o2'}
+
+
+def workflow_entry(name, version):
+    # registration of a workflow of the git archives below
+    return {'name': name, 'version': version, 'git_server': 'https://git.invalid', 'git_account': 'alice',
+            'git_repo': 'repo', 'git_tag': version, 'git_path': 'wf'}
+
+
+@pytest.fixture
+def archives(monkeypatch):
+    # git archives of repo 'repo', with the workflow at path 'wf', for any tag
+    def download(archive):
+        tag = archive._url.rsplit('/', 1)[-1][:-len('.zip')]
+        archive._file = io.BytesIO()
+        with zipfile.ZipFile(archive._file, 'w') as z:
+            z.writestr('repo-%s/wf/workflow/main.jt' % tag, WORKFLOW % tag)
+
+    monkeypatch.setattr(WorkflowArchive, '_download', download)
+
+
+@pytest.fixture
+def owner(monkeypatch):
+    # owners of OWNERS instead of AMS
+    monkeypatch.setattr(wrs, '_get_owner_id_by_name', OWNERS.get)
+    monkeypatch.setattr(wrs, '_get_owner_name_by_id', dict((v, k) for k, v in OWNERS.items()).get)
+    return 'alice'
+
+
+@pytest.fixture
+def register(registry, archives, owner):
+    # registers a workflow version as the registration workers do
+    def register(name, version, owner_name=owner):
+        return wrs.register_workflow(owner_name, workflow_entry(name, version))
+
+    return register
@@ -0,0 +1,62 @@
+from jt_wrs import wrs
+
+
+# in-process caches of decoded workflows and owner listings, kept coherent by the registry watch
+
+def _versions(workflow):
+    return sorted(k for k in workflow if k.startswith('ver:'))
+
+
+def test_workflow_cached_until_changed(register, owner):
+    workflow_id = register('wf', '1')['id']
+
+    assert _versions(wrs.get_workflow(owner, 'wf')) == ['ver:1']
+    cached, revisions = wrs.workflow_cache.get(workflow_id)
+    assert _versions(cached) == ['ver:1']
+
+    # a new version is seen through the watch, the next read has it
+    register('wf', '2')
+    assert wrs.workflow_cache.get(workflow_id) is None
+    assert _versions(wrs.get_workflow(owner, 'wf')) == ['ver:1', 'ver:2']
+
+
+def test_owner_workflows_cached_until_changed(register, owner):
+    register('wf', '1')
+    assert [w['name'] for w in wrs.get_workflows(owner)] == ['wf']
+    assert wrs.owner_workflow_cache.get('o1') is not None
+
+    # dropped through the watch, and read again by the registration reading its workflow back
+    register('other', '1')
+    assert sorted(name for name, workflow_id in wrs.owner_workflow_cache.get('o1')) == ['other', 'wf']
+    assert sorted(w['name'] for w in wrs.get_workflows(owner)) == ['other', 'wf']
+
+    # other owners are kept
+    wrs.get_workflows('bob')
+    register('wf', '2')
+    assert wrs.owner_workflow_cache.get('o2') == []
+
+
+def test_reads_older_than_the_watch_not_cached(register, owner):
+    workflow_id = register('wf', '1')['id']
+    wrs.workflow_cache.clear()
+
+    # the read below is at an older revision than a change already seen through the watch
+    revision = wrs.store.revision()
+    wrs._invalidate_cached_key('%s/workflow/id:%s/name' % (wrs.WRS_ETCD_ROOT, workflow_id), revision + 1)
+    decoded = wrs._get_decoded_workflows([workflow_id])[workflow_id]
+    wrs._cache_put(wrs.workflow_cache, workflow_id, decoded, revision)
+    assert wrs.workflow_cache.get(workflow_id) is None
+
+
+def test_broken_watch_clears_caches(register, owner):
+    register('wf', '1')
+    wrs.get_workflow(owner, 'wf')
+    assert len(wrs.workflow_cache) and len(wrs.owner_workflow_cache)
+
+    wrs._on_cache_watch_response(RuntimeError('watch cancelled'))
+    assert wrs._cache_watch_id is None
+    assert not len(wrs.workflow_cache) and not len(wrs.owner_workflow_cache)
+
+    # set up again on the next read
+    assert _versions(wrs.get_workflow(owner, 'wf')) == ['ver:1']
+    assert wrs._cache_watch_id is not None
@@ -0,0 +1,67 @@
+import flask
+import pytest
+import jt_wrs
+
+# ETags and conditional GETs of workflow reads
+
+
+@pytest.fixture
+def get():
+    # calls an API handler as for a GET, conditional with if_none_match
+    app = flask.Flask(__name__)
+
+    def get(handler, *args, if_none_match=None):
+        with app.test_request_context('/', headers={'If-None-Match': if_none_match} if if_none_match else {}):
+            return handler(*args)
+
+    return get
+
+
+def test_version_immutable(register, owner, get):
+    register('wf', '1')
+
+    body, status, headers = get(jt_wrs.get_workflow_ver, owner, 'wf', '1')
+    assert status == 200 and body['ver:1']['git_tag'] == '1'
+    assert headers['Cache-Control'] == 'public, max-age=%s, immutable' % jt_wrs.IMMUTABLE_MAX_AGE
+
+    body, status, headers_304 = get(jt_wrs.get_workflow_ver, owner, 'wf', '1', if_none_match=headers['ETag'])
+    assert (body, status) == ('', 304) and headers_304 == headers
+
+    # versions registered later do not change it
+    register('wf', '2')
+    assert get(jt_wrs.get_workflow_ver, owner, 'wf', '1', if_none_match=headers['ETag'])[1] == 304
+    assert get(jt_wrs.get_workflow_ver, owner, 'wf', '2', if_none_match=headers['ETag'])[1] == 200
+
+
+def test_workflow_revalidated(register, owner, get):
+    register('wf', '1')
+
+    body, status, headers = get(jt_wrs.get_workflow, owner, 'wf')
+    assert status == 200 and headers['Cache-Control'] == 'no-cache'
+    assert get(jt_wrs.get_workflow, owner, 'wf', if_none_match=headers['ETag'])[1] == 304
+    assert get(jt_wrs.get_workflow, owner, 'wf', if_none_match='"other", %s' % headers['ETag'])[1] == 304
+
+    # a new version changes it
+    register('wf', '2')
+    body, status, new_headers = get(jt_wrs.get_workflow, owner, 'wf', if_none_match=headers['ETag'])
+    assert status == 200 and new_headers['ETag'] != headers['ETag'] and 'ver:2' in body
+
+
+def test_resources_have_own_etags(register, owner, get):
+    workflow_id = register('wf', '1')['id']
+
+    etags = [get(jt_wrs.get_workflow_ver, owner, 'wf', '1')[2]['ETag'],
+             get(jt_wrs.get_workflow_by_id_and_version, workflow_id, '1')[2]['ETag'],
+             get(jt_wrs.download_workflowfile, owner, 'wf', '1')[2]['ETag']]
+    assert len(set(etags)) == len(etags)
+
+    body, status, headers = get(jt_wrs.download_workflowfile, owner, 'wf', '1', if_none_match=etags[-1])
+    assert status == 304
+
+
+def test_not_found(register, owner, get):
+    register('wf', '1')
+
+    assert get(jt_wrs.get_workflow_ver, owner, 'wf', '2')[1] == 404
+    assert get(jt_wrs.get_workflow, owner, 'other')[1] == 404
+    assert get(jt_wrs.get_workflow_by_id_and_version, 'unknown', None)[1] == 404
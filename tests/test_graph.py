@@ -0,0 +1,63 @@
+import pytest
+from jt_wrs.exceptions import InvalidTaskDependency
+from jt_wrs.jtracker.graph import plan_graph
+
+
+def _tasks(depends_on):
+    return [{'task': task, 'depends_on': dependencies} for task, dependencies in depends_on]
+
+
+def test_levels_and_critical_path():
+    tasks = _tasks([
+        ('prepare', []),
+        ('align.s1', ['completed@prepare']),
+        ('align.s2', ['completed@prepare']),
+        ('call.s1', ['completed@align.s1']),
+        ('report', None)
+    ])
+    graph = plan_graph(tasks)
+
+    assert graph['parents'] == [[], [0], [0], [1], []]
+    assert graph['children'] == [[1, 2], [3], [], [], []]
+    assert graph['levels'] == [[0, 4], [1, 2], [3]]
+    assert graph['critical_path'] == [0, 1, 3]
+    assert graph['critical_path_length'] == 3
+
+
+def test_dependency_on_scatter_task():
+    # 'completed@align' is on all tasks of the scatter
+    tasks = _tasks([
+        ('align.s1', []),
+        ('align.s2', []),
+        ('merge', ['completed@align'])
+    ])
+    graph = plan_graph(tasks)
+
+    assert graph['parents'][2] == [0, 1]
+    assert graph['levels'] == [[0, 1], [2]]
+
+
+def test_no_tasks():
+    graph = plan_graph([])
+    assert graph['levels'] == [] and graph['critical_path'] == []
+
+
+def test_cycle():
+    tasks = _tasks([
+        ('a', []),
+        ('b', ['completed@a', 'completed@d']),
+        ('c', ['completed@b']),
+        ('d', ['completed@c'])
+    ])
+    with pytest.raises(InvalidTaskDependency) as err:
+        plan_graph(tasks)
+
+    assert 'cycle' in str(err.value)
+    assert str(err.value).endswith('tasks: b, c, d')
+
+
+def test_dependency_not_in_plan():
+    with pytest.raises(InvalidTaskDependency) as err:
+        plan_graph(_tasks([('a', ['completed@missing'])]))
+
+    assert 'missing' in str(err.value)
@@ -0,0 +1,90 @@
+from urllib.parse import urlencode
+import flask
+import pytest
+import jt_wrs
+from jt_wrs import wrs
+from jt_wrs.exceptions import InvalidCursor
+
+# paged workflow listings, with field projection and version selection
+
+
+@pytest.fixture
+def workflows(register):
+    # alice: a (versions 1, 2), b, c; bob: d
+    for name, version in (('a', '1'), ('b', '1'), ('c', '1'), ('a', '2')):
+        register(name, version)
+    register('d', '1', owner_name='bob')
+
+
+def _pages(owner_name, limit):
+    pages = []
+    cursor = None
+    while True:
+        workflows, cursor = wrs.list_workflows(owner_name, limit=limit, cursor=cursor, versions='none')
+        pages.append([w['name'] for w in workflows])
+        if not cursor:
+            return pages
+
+
+def test_pages_continue_from_cursor(workflows):
+    assert _pages('alice', 2) == [['a', 'b'], ['c']]
+    assert _pages('alice', 1) == [['a'], ['b'], ['c']]
+    assert _pages('alice', None) == [['a', 'b', 'c']]
+
+    # all owners, by owner id then name
+    assert _pages(None, 3) == [['a', 'b', 'c'], ['d']]
+
+
+def test_cursor_not_changed_by_registrations(workflows, register):
+    first, cursor = wrs.list_workflows('alice', limit=1)
+    register('aa', '1')
+    register('b', '2')
+
+    workflows, cursor = wrs.list_workflows('alice', limit=2, cursor=cursor, versions='none')
+    assert [w['name'] for w in workflows] == ['aa', 'b']
+    assert [w['name'] for w in wrs.list_workflows('alice', cursor=cursor)[0]] == ['c']
+
+
+def test_invalid_cursor(workflows):
+    _, cursor = wrs.list_workflows('alice', limit=1)
+    with pytest.raises(InvalidCursor):
+        wrs.list_workflows('bob', cursor=cursor)  # of another owner
+    with pytest.raises(InvalidCursor):
+        wrs.list_workflows('alice', cursor='not a cursor')
+
+
+def test_fields_and_versions(workflows):
+    workflows, _ = wrs.list_workflows('alice', limit=1, fields=['name'])
+    assert workflows[0]['name'] == 'a'
+    assert sorted(workflows[0]) == ['name', 'ver:1', 'ver:2']
+
+    workflows, _ = wrs.list_workflows('alice', limit=1, fields=['name', 'owner.name'], versions='latest')
+    assert sorted(workflows[0]) == ['name', 'owner.name', 'ver:2'] and workflows[0]['owner.name'] == 'alice'
+
+    workflows, _ = wrs.list_workflows('alice', limit=1, versions='none')
+    assert not [k for k in workflows[0] if k.startswith('ver:')] and workflows[0]['git_repo'] == 'repo'
+
+    with pytest.raises(ValueError):
+        wrs.list_workflows('alice', versions='first')
+
+
+def test_next_page_headers(workflows):
+    app = flask.Flask(__name__)
+    with app.test_request_context('/api/jt-wrs/v0.1/workflows/owner/alice?limit=2&versions=none'):
+        workflows, status, headers = jt_wrs.get_workflows('alice', limit=2, versions='none')
+        cursor = headers['X-Next-Cursor']
+        assert status == 200 and len(workflows) == 2
+        assert headers['Link'] == ('<http://localhost/api/jt-wrs/v0.1/workflows/owner/alice?limit=2&versions=none&'
+                                   '%s>; rel="next"' % urlencode({'cursor': cursor}))
+
+        workflows, status, headers = jt_wrs.get_workflows('alice', limit=2, cursor=cursor, versions='none')
+        assert status == 200 and len(workflows) == 1 and headers == {}
+
+        assert jt_wrs.get_workflows('alice', cursor='x')[1] == 400
+        assert jt_wrs.get_workflows('nobody')[1] == 404
+
+
+def test_empty_listing(register, owner):
+    app = flask.Flask(__name__)
+    with app.test_request_context('/'):
+        assert jt_wrs.get_workflows('alice') == ('No workflow found', 404)
@@ -0,0 +1,47 @@
+import pytest
+from conftest import OWNERS
+from jt_wrs import wrs
+from jt_wrs.ams import OwnerResolver
+from jt_wrs.exceptions import InvalidLookup, OwnerNameNotFound
+
+
+@pytest.mark.parametrize('entry', [
+    {'id': 'w1/1'},
+    {'owner.name': 'alice', 'name': 'wf/1'},
+    {'owner.name': 'alice/wf', 'name': '1'},
+    {'id': 'w1', 'version': '1/2'},
+    {'name': 'wf'},
+    {'owner.name': 'alice', 'version': '1'},
+    {}
+])
+def test_invalid_entry(registry, entry):
+    with pytest.raises(InvalidLookup):
+        wrs.lookup_workflows([{'id': 'w1'}, entry])
+
+
+def test_lookup(register, monkeypatch):
+    workflow_id = register('wf', '1')['id']
+    register('wf', '2')
+    monkeypatch.setattr(wrs.owner_resolver, 'get_ids_by_names', lambda names: dict((n, OWNERS.get(n)) for n in names))
+    monkeypatch.setattr(wrs.owner_resolver, 'get_names_by_ids',
+                        lambda ids: dict((i, {'o1': 'alice'}[i]) for i in ids))
+
+    results = wrs.lookup_workflows([{'owner.name': 'alice', 'name': 'wf', 'version': '1'},
+                                    {'id': workflow_id}, {'owner.name': 'alice', 'name': 'other'}])
+    assert sorted(results) == ['alice/other', 'alice/wf/1', 'id:%s' % workflow_id]
+    assert sorted(k for k in results['alice/wf/1'] if k.startswith('ver:')) == ['ver:1']
+    assert sorted(k for k in results['id:%s' % workflow_id] if k.startswith('ver:')) == ['ver:1', 'ver:2']
+    assert 'error' in results['alice/other']
+
+
+def test_owners_looked_up_concurrently():
+    resolver = OwnerResolver('http://ams.invalid', pool_size=2)
+
+    def get(owner_name):
+        if owner_name == 'nobody':
+            raise OwnerNameNotFound(owner_name)
+        return 'id-%s' % owner_name
+
+    results = resolver._get_many(['alice', 'bob', 'nobody', 'alice'], resolver._name_to_id, OwnerNameNotFound, get)
+    assert results['alice'] == 'id-alice' and results['bob'] == 'id-bob'
+    assert isinstance(results['nobody'], OwnerNameNotFound)
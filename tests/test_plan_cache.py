@@ -0,0 +1,53 @@
+from jt_wrs import wrs
+
+# execution plans cached by workflow version and canonical job JSON
+
+JOB = {'samples': [{'id': 's1', 'file': 'a.bam'}, {'id': 's2', 'file': 'b.bam'}]}
+
+
+def _plan(version, job_json, **kwargs):
+    return wrs.get_execution_plan('alice', 'wf', version, job_json, **kwargs)
+
+
+def test_same_job_json_shares_plan(register, monkeypatch):
+    register('wf', '1')
+
+    plan = _plan('1', JOB)
+    assert [t['task'] for t in plan['tasks']] == ['hello.s1', 'hello.s2']
+
+    # key order does not matter, the workflow is not even needed for a cached plan
+    monkeypatch.setattr(wrs, '_get_compiled_workflow_by_id', None)
+    reordered = {'samples': [{'file': 'a.bam', 'id': 's1'}, {'file': 'b.bam', 'id': 's2'}]}
+    assert _plan('1', reordered) is plan
+    assert wrs.get_execution_plans('alice', 'wf', '1', [reordered])[0]['job_execution_plan'] is plan
+
+
+def test_plans_keyed_apart(register):
+    register('wf', '1')
+    register('wf', '2')
+
+    plans = [_plan('1', JOB), _plan('2', JOB), _plan('1', JOB, expand=False),
+             _plan('1', {'samples': JOB['samples'][:1]})]
+    assert len(set(id(plan) for plan in plans)) == len(plans)
+    assert len(wrs.plan_cache) == len(plans)
+
+    assert [t['task'] for t in plans[3]['tasks']] == ['hello.s1']
+
+
+def test_cached_plan_not_changed(register):
+    register('wf', '1')
+
+    plan = _plan('1', JOB)
+    before = repr(plan)
+    assert '_graph' in _plan('1', JOB, graph=True)
+    assert '_graph' in wrs.get_execution_plans('alice', 'wf', '1', [JOB], graph=True)[0]['job_execution_plan']
+    assert repr(_plan('1', JOB)) == before
+
+
+def test_batch_fills_cache(register):
+    register('wf', '1')
+
+    results = wrs.get_execution_plans('alice', 'wf', '1', [JOB, {'samples': 'not an array'}])
+    assert 'error' in results[1]
+    assert _plan('1', dict(JOB)) is results[0]['job_execution_plan']
+    assert len(wrs.plan_cache) == 1  # failed plans are not cached
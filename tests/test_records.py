@@ -0,0 +1,170 @@
+import pytest
+from jt_wrs import records, storage, wrs
+from jt_wrs.storage import Put
+
+
+# reads of workflows while they are migrated from the per attribute key layout to records
+
+WORKFLOW_ATTRIBUTES = [('workflow_type', 'JTracker'), ('git_repo', 'repo'), ('name', 'wf'), ('owner.id', 'o1')]
+
+
+def _register_keys(workflow_id, version):
+    # a version registered in the per attribute key layout, with its version index keys
+    prefix = '%s/workflow/id:%s' % (wrs.WRS_ETCD_ROOT, workflow_id)
+    ops = [Put('%s/%s' % (prefix, k), v) for k, v in WORKFLOW_ATTRIBUTES]
+    ops += [Put('%s/ver:%s/%s' % (prefix, version, k), v)
+            for k, v in [('git_tag', 'tag-%s' % version), ('git_path', 'path'),
+                         ('workflowfile', 'workflow: {}'), ('workflow_package', '{}')]]
+    ops += [Put('%sver:%s' % (wrs._version_index_prefix(workflow_id), version), ''),
+            Put(wrs._latest_version_key(workflow_id), version)]
+    wrs.store.transaction([], ops)
+
+
+def _read(workflow_id):
+    # unpinned read, as for listings, from the store
+    wrs.workflow_cache.clear()
+    workflow, revisions = wrs._get_decoded_workflow(workflow_id)
+    return workflow
+
+
+def _versions(workflow):
+    return sorted(k for k in workflow if k.startswith('ver:'))
+
+
+def _record_keys(workflow_id):
+    prefix = wrs._record_prefix(workflow_id)
+    return [kv.key for kv in wrs.store.range(prefix, storage.prefix_end(prefix), keys_only=True).kvs]
+
+
+@pytest.fixture
+def workflow_id(registry):
+    for version in ('1', '2', '3'):
+        _register_keys('w1', version)
+    return 'w1'
+
+
+def test_migrated_reads_same(workflow_id):
+    before = _read(workflow_id)
+
+    assert wrs.migrate_workflow_record(workflow_id) == 4
+    assert wrs.migrate_workflow_record(workflow_id) == 0  # records already there are kept
+    assert _read(workflow_id) == before
+    assert _versions(before) == ['ver:1', 'ver:2', 'ver:3']
+    assert before['ver:2'] == {'git_tag': 'tag-2', 'git_path': 'path', 'workflowfile': None,
+                               'workflow_package': ''}
+
+
+def test_records_decode_like_keys(workflow_id):
+    workflows, _ = wrs._read_key_layout_workflows([workflow_id])
+    workflow, _ = workflows[workflow_id]
+
+    wrs.migrate_workflow_record(workflow_id)
+    record_prefix = wrs._record_prefix(workflow_id)
+    decoded, revisions = records.decode(workflow_id, wrs.store.range(record_prefix,
+                                                                     storage.prefix_end(record_prefix)).kvs)
+
+    assert decoded == workflow
+    assert sorted(k for k in revisions if k) == ['ver:1', 'ver:2', 'ver:3']
+
+
+def _record_transactions(monkeypatch, interrupt_after=None):
+    # the keys put by each write transaction, which fail once interrupt_after of them went through
+    transaction = wrs.store.transaction
+    written = []
+
+    def record(compare, success, failure=()):
+        if len(written) == interrupt_after:
+            raise RuntimeError('interrupted')
+        written.append([storage.to_bytes(op.key) for op in success])
+        return transaction(compare, success, failure)
+
+    monkeypatch.setattr(wrs.store, 'transaction', record)
+    return written
+
+
+def test_header_record_written_last(workflow_id, monkeypatch):
+    monkeypatch.setattr(wrs, 'ETCD_TXN_MAX_OPS', 3)
+    written = _record_transactions(monkeypatch)
+    wrs.migrate_workflow_record(workflow_id)
+
+    assert [len(keys) for keys in written] == [3, 1]
+    assert written[-1] == [wrs._header_record_key(workflow_id)]
+
+
+def test_interrupted_migration(workflow_id, monkeypatch):
+    monkeypatch.setattr(wrs, 'ETCD_TXN_MAX_OPS', 2)
+    transaction = wrs.store.transaction
+    _record_transactions(monkeypatch, interrupt_after=1)
+    with pytest.raises(RuntimeError):
+        wrs.migrate_workflow_record(workflow_id)
+    monkeypatch.setattr(wrs.store, 'transaction', transaction)
+
+    # no header yet, the workflow is still read from its keys
+    assert len(_record_keys(workflow_id)) == 2
+    assert wrs._header_record_key(workflow_id) not in _record_keys(workflow_id)
+    assert _versions(_read(workflow_id)) == ['ver:1', 'ver:2', 'ver:3']
+
+    # run again, it writes what is missing
+    assert wrs.migrate_workflow_record(workflow_id) == 2
+    assert _versions(_read(workflow_id)) == ['ver:1', 'ver:2', 'ver:3']
+    assert wrs._header_record_key(workflow_id) in _record_keys(workflow_id)
+
+
+def test_records_written_meanwhile_kept(workflow_id, monkeypatch):
+    # eg, by a registration between the read of the existing records and their writes
+    range_ = wrs.store.range
+
+    def range_then_register(*args, **kwargs):
+        result = range_(*args, **kwargs)
+        wrs.store.transaction([], [Put(wrs._version_record_key(workflow_id, '2'), 'registered')])
+        return result
+
+    monkeypatch.setattr(wrs.store, 'range', range_then_register)
+    assert wrs.migrate_workflow_record(workflow_id) == 3
+    assert wrs.store.get(wrs._version_record_key(workflow_id, '2')) == b'registered'
+
+
+def test_versions_without_record_read_from_keys(workflow_id):
+    # header and only some version records, eg, written by an earlier, interrupted migration
+    header, versions = records.split_workflow(_read(workflow_id))
+    wrs.store.put_if_missing(wrs._header_record_key(workflow_id), records.encode_header(header))
+    wrs.store.put_if_missing(wrs._version_record_key(workflow_id, '1'), records.encode_version(*versions['1']))
+
+    workflow = _read(workflow_id)
+    assert _versions(workflow) == ['ver:1', 'ver:2', 'ver:3']
+    assert workflow['ver:3']['git_tag'] == 'tag-3'
+    assert wrs.get_workflow_by_id_and_version(workflow_id, '3', owner_name='alice')['ver:3']['git_tag'] == 'tag-3'
+
+
+def test_version_registered_in_keys_after_migration(workflow_id):
+    wrs.migrate_workflow_record(workflow_id)
+    _register_keys(workflow_id, '4')
+
+    assert _versions(_read(workflow_id)) == ['ver:1', 'ver:2', 'ver:3', 'ver:4']
+    workflow = wrs.get_workflow_by_id_and_version(workflow_id, '4', owner_name='alice')
+    assert workflow['ver:4']['git_tag'] == 'tag-4'
+
+
+def test_cached_workflow_has_all_versions(workflow_id):
+    wrs.migrate_workflow_record(workflow_id)
+    _register_keys(workflow_id, '4')
+
+    wrs.workflow_cache.clear()
+    assert wrs.get_workflow_by_id_and_version(workflow_id, owner_name='alice')
+    cached, revisions = wrs.workflow_cache.get(workflow_id)
+    assert _versions(cached) == ['ver:1', 'ver:2', 'ver:3', 'ver:4']
+
+    # a new version invalidates it through the watch
+    _register_keys(workflow_id, '5')
+    assert wrs.workflow_cache.get(workflow_id) is None
+    assert 'ver:5' in wrs.get_workflow_by_id_and_version(workflow_id, owner_name='alice')
+
+
+def test_workflow_attributes_only(workflow_id):
+    wrs.migrate_workflow_record(workflow_id)
+    _register_keys(workflow_id, '4')
+
+    workflows = wrs._get_decoded_workflows([workflow_id], versions=False)
+    workflow, revisions = workflows[workflow_id]
+    assert _versions(workflow) == []
+    assert workflow['name'] == 'wf'
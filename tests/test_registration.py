@@ -0,0 +1,154 @@
+import threading
+import flask
+import pytest
+import jt_wrs
+from conftest import workflow_entry
+from jt_wrs import registration, storage, wrs
+from jt_wrs.exceptions import RegistrationQueueFull
+from jt_wrs.registration import RegistrationQueue
+
+def _entry(version):
+    return workflow_entry('wf', version)
+
+
+def test_register(registry, archives, owner):
+    workflow = wrs.register_workflow(owner, _entry('1'))
+    assert workflow['name'] == 'wf' and workflow['ver:1']['git_tag'] == '1'
+
+    assert 'ver:2' in wrs.register_workflow(owner, _entry('2'))
+    assert sorted(k for k in wrs.get_workflow(owner, 'wf') if k.startswith('ver:')) == ['ver:1', 'ver:2']
+
+    with pytest.raises(Exception) as err:
+        wrs.register_workflow(owner, _entry('2'))
+    assert str(err.value) == 'Same workflow already registered.'
+
+
+def test_concurrent_registrations_of_new_workflow(registry, archives, owner, monkeypatch):
+    # both find no workflow yet, the one written second becomes a new version of the other's
+    get = wrs.store.get
+    both_read = threading.Barrier(2)
+    entry_reads = []
+
+    def get_then_wait(key):
+        value = get(key)
+        if storage.to_bytes(key).endswith(b'/workflow/name:wf/id'):
+            entry_reads.append(key)
+            if len(entry_reads) <= 2:
+                both_read.wait(timeout=5)
+        return value
+
+    monkeypatch.setattr(wrs.store, 'get', get_then_wait)
+
+    results = {}
+
+    def register(version):
+        try:
+            results[version] = wrs.register_workflow(owner, _entry(version))
+        except Exception as err:
+            results[version] = err
+
+    threads = [threading.Thread(target=register, args=(version,)) for version in ('1', '2')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(isinstance(result, dict) for result in results.values()), results
+    assert results['1']['id'] == results['2']['id']
+
+    wrs.workflow_cache.clear()
+    workflow = wrs.get_workflow(owner, 'wf')
+    assert sorted(k for k in workflow if k.startswith('ver:')) == ['ver:1', 'ver:2']
+
+
+class Registrar(object):
+    # registers workflows once allowed to
+    def __init__(self):
+        self.allowed = threading.Event()
+        self.registered = []
+
+    def __call__(self, owner_name, workflow_entry):
+        self.allowed.wait(5)
+        if workflow_entry.get('version') == 'bad':
+            raise Exception('Invalid JTracker Workflow File')
+        self.registered.append((owner_name, workflow_entry['name'], workflow_entry['version']))
+        return {'name': workflow_entry['name']}
+
+
+def test_queue():
+    registrar = Registrar()
+    queue = RegistrationQueue(registrar, workers=1)
+
+    queued = queue.submit('alice', {'name': 'wf', 'version': '1'})
+    assert queued.status in (registration.QUEUED, registration.RUNNING)
+    assert queue.submit('alice', {'name': 'wf', 'version': '1'}) is queued  # still pending
+    assert queue.submit('alice', {'name': 'wf', 'version': '2'}) is not queued
+
+    assert not queue.get(queued.id, wait=0.05).done
+    registrar.allowed.set()
+    assert queue.get(queued.id, wait=5).status == registration.SUCCEEDED
+    assert queued.workflow == {'name': 'wf'} and queued.finished_at
+
+    failed = queue.get(queue.submit('alice', {'name': 'wf', 'version': 'bad'}).id, wait=5)
+    assert failed.status == registration.FAILED and failed.error == 'Invalid JTracker Workflow File'
+
+    # done, can be submitted again
+    assert queue.submit('alice', {'name': 'wf', 'version': '1'}) is not queued
+    assert queue.get('unknown') is None
+
+
+def test_queue_full():
+    registrar = Registrar()
+    queue = RegistrationQueue(registrar, workers=1, max_queued=1)
+
+    queue.submit('alice', {'name': 'wf', 'version': '1'})
+    for version in ('2', '3'):
+        try:
+            queue.submit('alice', {'name': 'wf', 'version': version})
+        except RegistrationQueueFull:
+            break
+    else:
+        pytest.fail('queue not full')
+    registrar.allowed.set()
+
+
+def _shared_queue(registrar):
+    # a queue of another process serving the API
+    return RegistrationQueue(registrar, workers=1, save=wrs._save_registration, load=wrs._load_registration,
+                             claim=wrs._claim_registration)
+
+
+def test_registration_shared_by_processes(registry):
+    registrar = Registrar()
+    first, second = _shared_queue(registrar), _shared_queue(registrar)
+
+    queued = first.submit('alice', {'name': 'wf', 'version': '1'})
+    assert second.submit('alice', {'name': 'wf', 'version': '1'}).id == queued.id
+
+    # polled through the other process
+    registrar.allowed.set()
+    assert second.get(queued.id, wait=5).status == registration.SUCCEEDED
+    assert registrar.registered == [('alice', 'wf', '1')]
+
+    # the claim is released once done
+    assert wrs.store.get(wrs._registration_claim_key(queued)) is None
+    assert second.get(second.submit('alice', {'name': 'wf', 'version': '1'}).id, wait=5).done
+    assert len(registrar.registered) == 2
+
+
+def test_register_and_poll(registry, archives, owner, monkeypatch):
+    monkeypatch.setattr(wrs, 'registration_queue', RegistrationQueue(wrs.register_workflow, workers=1))
+
+    app = flask.Flask(__name__)
+    with app.test_request_context('/api/jt-wrs/v0.1/workflows/owner/alice', method='POST'):
+        body, status, headers = jt_wrs.register_workflow(owner, _entry('1'))
+
+    assert status == 202
+    assert headers['Location'] == '/api/jt-wrs/v0.1/workflows/owner/alice/registrations/%s' % body['id']
+
+    # long polled until done
+    body = jt_wrs.get_registration(owner, body['id'], wait=10)
+    assert body['status'] == registration.SUCCEEDED and body['workflow']['ver:1']['git_tag'] == '1'
+
+    assert jt_wrs.get_registration('bob', body['id']) == ('No registration found', 404)
+    assert jt_wrs.register_workflow(owner, _entry('1'))[1] == 400  # already registered
@@ -0,0 +1,195 @@
+import time
+import pytest
+from jt_wrs import storage
+from jt_wrs.storage import Put, Delete, Exists, Missing
+
+
+# what wrs.py relies on from every storage engine, run against each of them (see conftest.py)
+
+def _put(kv_store, *items):
+    return kv_store.transaction([], [Put(k, v) for k, v in items])
+
+
+def _wait_for(condition, timeout=5):
+    # etcd watch events arrive on their own
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_get(kv_store, prefix):
+    _put(kv_store, (prefix + 'a', 'x'), (prefix + 'b', b'\x00y'))
+
+    assert kv_store.get(prefix + 'a') == b'x'
+    assert kv_store.get(storage.to_bytes(prefix + 'b')) == b'\x00y'
+    assert kv_store.get(prefix + 'c') is None
+
+
+def test_revisions(kv_store, prefix):
+    start = kv_store.revision()
+    _put(kv_store, (prefix + 'a', '1'), (prefix + 'b', '1'))
+    created = kv_store.revision()
+    _put(kv_store, (prefix + 'a', '2'))
+
+    assert created == start + 1  # one revision per write transaction
+    assert kv_store.revision() == created + 1
+
+    kvs = kv_store.range(prefix, storage.prefix_end(prefix)).kvs
+    a, b = kvs
+    assert (a.create_revision, a.mod_revision) == (created, created + 1)
+    assert (b.create_revision, b.mod_revision) == (created, created)
+
+
+def test_range(kv_store, prefix):
+    _put(kv_store, *[(prefix + k, k.upper()) for k in ('c', 'a', 'b', 'b/1', 'd')])
+    _put(kv_store, (prefix[:-1] + '0', 'outside'))
+
+    r = kv_store.range(prefix, storage.prefix_end(prefix))
+    assert [kv.key for kv in r.kvs] == [storage.to_bytes(prefix + k) for k in ('a', 'b', 'b/1', 'c', 'd')]
+    assert [kv.value for kv in r.kvs] == [b'A', b'B', b'B/1', b'C', b'D']
+    assert not r.more
+    assert r.revision == kv_store.revision()
+
+    r = kv_store.range(prefix + 'b', prefix + 'd', limit=2)
+    assert [kv.key for kv in r.kvs] == [storage.to_bytes(prefix + k) for k in ('b', 'b/1')]
+    assert r.more
+
+    r = kv_store.range(prefix + 'b', prefix + 'd', limit=3)
+    assert len(r.kvs) == 3 and not r.more
+
+    r = kv_store.range(prefix, storage.prefix_end(prefix), keys_only=True)
+    assert len(r.kvs) == 5 and all(not kv.value for kv in r.kvs)
+
+
+def test_ranges(kv_store, prefix):
+    _put(kv_store, *[(prefix + k, k) for k in ('a/1', 'a/2', 'b/1', 'c')])
+
+    a, b = storage.to_bytes(prefix + 'a/'), storage.to_bytes(prefix + 'b/')
+    c = storage.to_bytes(prefix + 'c')
+    results, revision = kv_store.ranges([(a, storage.prefix_end(a)), (b, storage.prefix_end(b), True),
+                                         (c, c + b'\0'), (b'/jt:wrs-test-none', b'/jt:wrs-test-none\0')])
+
+    assert [[kv.key for kv in kvs] for kvs in results] == [[a + b'1', a + b'2'], [b + b'1'], [c], []]
+    assert [kv.value for kv in results[0]] == [b'a/1', b'a/2']
+    assert not results[1][0].value  # keys only for this range
+    assert revision == kv_store.revision()
+
+
+def test_transaction(kv_store, prefix):
+    a, b = prefix + 'a', prefix + 'b'
+
+    assert kv_store.transaction([Missing(a)], [Put(a, '1')], [Put(b, 'failure')])
+    assert kv_store.get(a) == b'1' and kv_store.get(b) is None
+
+    assert not kv_store.transaction([Missing(a)], [Put(a, '2')], [Put(b, 'failure')])
+    assert kv_store.get(a) == b'1' and kv_store.get(b) == b'failure'
+
+    # all conditions must hold
+    assert not kv_store.transaction([Exists(a), Exists(prefix + 'c')], [Put(a, '3')])
+    assert kv_store.transaction([Exists(a), Exists(b), Missing(prefix + 'c')], [Put(a, '3'), Put(b, '3')])
+    assert kv_store.get(a) == b'3' and kv_store.get(b) == b'3'
+
+    # nothing written, no new revision
+    revision = kv_store.revision()
+    assert not kv_store.transaction([Missing(a)], [Put(a, '4')])
+    assert kv_store.revision() == revision
+
+
+def test_delete(kv_store, prefix):
+    _put(kv_store, (prefix + 'a', '1'), (prefix + 'b', '1'))
+    assert kv_store.transaction([Exists(prefix + 'a')], [Delete(prefix + 'a'), Put(prefix + 'c', '1')])
+
+    assert kv_store.get(prefix + 'a') is None
+    assert [kv.key for kv in kv_store.range(prefix, storage.prefix_end(prefix)).kvs] == \
+        [storage.to_bytes(prefix + k) for k in ('b', 'c')]
+    assert kv_store.put_if_missing(prefix + 'a', '2')
+
+
+def test_put_if_missing(kv_store, prefix):
+    assert kv_store.put_if_missing(prefix + 'a', '1')
+    assert not kv_store.put_if_missing(prefix + 'a', '2')
+    assert kv_store.get(prefix + 'a') == b'1'
+
+
+def test_watch_prefix(kv_store, prefix):
+    events = []
+    kv_store.watch_prefix(prefix + 'w/', events.extend)
+
+    _put(kv_store, (prefix + 'w/a', '1'), (prefix + 'other', '1'))
+    _put(kv_store, (prefix + 'w/b', '1'))
+    _put(kv_store, (prefix + 'w/a', '2'))
+
+    assert _wait_for(lambda: len(events) >= 3)
+    mod_revisions = dict((kv.key, kv.mod_revision) for kv in kv_store.range(prefix, storage.prefix_end(prefix)).kvs)
+
+    assert [e.key for e in events] == [storage.to_bytes(prefix + k) for k in ('w/a', 'w/b', 'w/a')]
+    assert events[-1].mod_revision == mod_revisions[storage.to_bytes(prefix + 'w/a')]
+    assert events[1].mod_revision == mod_revisions[storage.to_bytes(prefix + 'w/b')]
+    assert events[0].mod_revision < events[1].mod_revision < events[2].mod_revision
+
+
+def test_put_with_ttl(kv_store, prefix):
+    assert kv_store.transaction([], [Put(prefix + 'a', '1', ttl=60), Put(prefix + 'b', '1')])
+    assert kv_store.get(prefix + 'a') == b'1' and kv_store.get(prefix + 'b') == b'1'
+
+
+def test_sqlite_expiry():
+    store = storage.SQLiteStore(':memory:')
+    store.transaction([], [Put('/a', '1', ttl=0.01), Put('/b', '1', ttl=0.01), Put('/c', '1')])
+    store.transaction([], [Put('/b', '2')])  # no longer expires
+    time.sleep(0.02)
+
+    # expired keys are not read, with no write since
+    revision = store.revision()
+    assert store.get('/a') is None
+    assert [kv.key for kv in store.range('/', '0').kvs] == [b'/b', b'/c']
+    assert [[kv.key for kv in kvs] for kvs in store.ranges([(b'/a', b'/a\0'), (b'/', b'0', True)])[0]] == \
+        [[], [b'/b', b'/c']]
+    assert store.revision() == revision
+
+    # and are missing for write transactions
+    assert store.put_if_missing('/a', '2')
+    assert [kv.key for kv in store.range('/', '0').kvs] == [b'/a', b'/b', b'/c']
+
+
+def test_health(kv_store):
+    health = kv_store.health()
+    assert health['healthy']
+    assert all(e['healthy'] for e in health['endpoints'])
+
+
+def test_sqlite_watch_sees_other_processes(tmp_path):
+    # stores sharing a database file, as processes would, changes of one reach watchers of the other
+    path = str(tmp_path / 'wrs.db')
+    watched = storage.SQLiteStore(path, watch_interval=0.01)
+    writer = storage.SQLiteStore(path)
+
+    events = []
+    watched.watch_prefix('/w/', events.extend)
+    writer.transaction([], [Put('/w/a', '1'), Put('/x', '1')])
+    writer.transaction([], [Put('/w/b', '1')])
+
+    assert _wait_for(lambda: len(events) >= 2)
+    assert [e.key for e in events] == [b'/w/a', b'/w/b']
+    assert watched.get('/w/b') == b'1'
+    assert [e.mod_revision for e in events] == [writer.revision() - 1, writer.revision()]
+
+
+def test_sqlite_watch_from_revision(tmp_path):
+    path = str(tmp_path / 'wrs.db')
+    store = storage.SQLiteStore(path, watch_interval=0.01)
+    store.transaction([], [Put('/w/a', '1')])
+    store.transaction([], [Put('/w/b', '1')])
+
+    events = []
+    storage.SQLiteStore(path, watch_interval=0.01).watch_prefix('/w/', events.extend,
+                                                                start_revision=store.revision())
+
+    assert _wait_for(lambda: events)
+    assert [e.key for e in events] == [b'/w/b']
+
+
+@pytest.mark.parametrize('prefix, end', [('/a', b'/b'), ('/a/', b'/a0'), (b'/a\x00', b'/a\x01')])
+def test_prefix_end(prefix, end):
+    assert storage.prefix_end(prefix) == end
@@ -0,0 +1,118 @@
+import pytest
+from jt_wrs.exceptions import InvalidJobJSON
+from jt_wrs.jtracker import JTracker
+
+WORKFLOW = '''
+workflow:
+  name: validated
+  version: "0.1"
+  input:
+    samples:
+      type: array
+    words:
+      type: array
+    ref:
+      type: string
+      default: genome.fa
+    conf:
+      type: object
+    count:
+      type: integer
+      default: 1
+  tasks:
+    prepare:
+      tool: prep
+      input:
+        ref: ref
+    per_sample:
+      scatter:
+        input:
+          sample:
+            with_items: samples
+            task_suffix: sample.id
+      tasks:
+        align:
+          tool: aligner
+          input:
+            reads: sample.file
+            ref: "fa@prepare"
+            level: conf.level
+    per_word:
+      scatter:
+        input:
+          word:
+            with_items: words
+            task_suffix: word
+      tasks:
+        count:
+          tool: counter
+          input:
+            w: word
+tools:
+  prep:
+    command: prep.py
+  aligner:
+    command: bwa
+  counter:
+    command: wc
+'''
+
+JOB = {
+    'samples': [{'id': 's1', 'file': 'a.bam'}, {'id': 's2', 'file': 'b.bam'}],
+    'words': ['x', 'y'],
+    'conf': {'level': 3}
+}
+
+
+@pytest.fixture(scope='module')
+def jt():
+    return JTracker(workflow_yaml_string=WORKFLOW)
+
+
+def test_valid(jt):
+    assert jt.job_json_errors(JOB) == []
+    jt.validate_job_json(JOB)
+
+
+@pytest.mark.parametrize('changes, error', [
+    ({'samples': None}, "missing input 'samples'"),
+    ({'ref': 1}, "input 'ref' must be of type string"),
+    ({'count': True}, "input 'count' must be of type integer"),
+    ({'conf': []}, "input 'conf' must be of type object"),
+    ({'samples': []}, "input 'samples' must be a non-empty array of scatter items"),
+    ({'samples': ['s1']}, "item 1 of 'samples' must be an object"),
+    ({'samples': [{'file': 'a.bam'}]}, "item 1 of 'samples' must have 'id', a string for its task suffix"),
+    ({'samples': [{'id': 'a b'}, {'id': 'a-b'}]}, "item 2 of 'samples' has the same task suffix as another: a_b"),
+    ({'words': ['x', 'x']}, "item 2 of 'words' has the same task suffix as another: x"),
+    ({'words': [{'w': 1}]}, "item 1 of 'words' must be a string or an integer for its task suffix")
+])
+def test_invalid(jt, changes, error):
+    job_json = dict(JOB)
+    for name, value in changes.items():
+        if value is None:
+            job_json.pop(name)
+        else:
+            job_json[name] = value
+
+    assert jt.job_json_errors(job_json) == [error]
+    with pytest.raises(InvalidJobJSON):
+        jt.get_execution_plan(job_json)
+
+
+def test_not_an_object(jt):
+    assert jt.job_json_errors(['samples']) == ['JobJSON must be an object']
+
+
+def test_template(jt):
+    template = jt.job_json_template
+    assert template == {
+        'samples': [{'id': '', 'file': None}],
+        'words': [''],
+        'ref': 'genome.fa',
+        'conf': {'level': None},
+        'count': 1
+    }
+
+    # a fresh copy each time
+    template['conf']['level'] = 3
+    assert jt.job_json_template['conf'] == {'level': None}
@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from conftest import WORKFLOW
+from jt_wrs.jtracker import JTracker
+
+
+def test_timer():
+    stages = []
+
+    @contextmanager
+    def timer(name):
+        stages.append(name)
+        yield
+
+    jt = JTracker(workflow_yaml_string=WORKFLOW % '1', timer=timer)
+    assert stages == ['yaml', 'normalize']
+    assert [t.name for t in jt.workflow.task_templates] == ['hello']
+
+
+def test_library_without_service():
+    # as in the plan worker processes, which unpickle compiled workflows
+    code = ('import sys, jt_wrs.jtracker; '
+            'print(sorted(m for m in ("flask", "jt_wrs.api", "jt_wrs.wrs") if m in sys.modules))')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.check_output([sys.executable, '-c', code], cwd=root).decode().strip() == '[]'